@@ -30,9 +30,75 @@ CREATE TABLE IF NOT EXISTS fl_cultural_funding (
     housenumber VARCHAR,
     postcode VARCHAR,
     city VARCHAR,
+    district VARCHAR,
+    borough VARCHAR,
     wkb_geometry GEOMETRY(POINT, 4326)
 );
 
 
 -- GEOMETRY INDEX
 CREATE INDEX IF NOT EXISTS fl_cultural_funding_wkb_geometry_idx ON fl_cultural_funding USING GIST (wkb_geometry);
+
+
+-- TABELLE STADTTEILE UND STADTBEZIRKE FLENSBURG
+DROP TABLE IF EXISTS fl_district CASCADE;
+
+CREATE TABLE IF NOT EXISTS fl_district (
+    id SERIAL PRIMARY KEY,
+    level VARCHAR NOT NULL,
+    name VARCHAR NOT NULL,
+    wkb_geometry GEOMETRY(MULTIPOLYGON, 4326)
+);
+
+
+-- GEOMETRY INDEX
+CREATE INDEX IF NOT EXISTS fl_district_wkb_geometry_idx ON fl_district USING GIST (wkb_geometry);
+
+
+-- TABELLE KULTUR FÖRDERUNG BETRÄGE JE JAHR
+DROP TABLE IF EXISTS fl_cultural_funding_amount CASCADE;
+
+CREATE TABLE IF NOT EXISTS fl_cultural_funding_amount (
+    designation_id INT NOT NULL REFERENCES fl_cultural_funding (id) ON DELETE CASCADE,
+    year SMALLINT NOT NULL,
+    amount NUMERIC NOT NULL,
+    PRIMARY KEY (designation_id, year)
+);
+
+
+-- YEAR INDEX
+CREATE INDEX IF NOT EXISTS fl_cultural_funding_amount_year_idx ON fl_cultural_funding_amount (year);
+
+
+-- AGGREGATE JE JAHR
+DROP TABLE IF EXISTS fl_cultural_funding_by_year CASCADE;
+
+CREATE TABLE IF NOT EXISTS fl_cultural_funding_by_year (
+    year SMALLINT PRIMARY KEY,
+    designations INT NOT NULL,
+    total NUMERIC NOT NULL
+);
+
+
+-- AGGREGATE JE FÖRDERART UND JAHR
+DROP TABLE IF EXISTS fl_cultural_funding_by_type CASCADE;
+
+CREATE TABLE IF NOT EXISTS fl_cultural_funding_by_type (
+    funding_type VARCHAR NOT NULL,
+    year SMALLINT NOT NULL,
+    designations INT NOT NULL,
+    total NUMERIC NOT NULL,
+    PRIMARY KEY (funding_type, year)
+);
+
+
+-- AGGREGATE JE STADTTEIL UND JAHR
+DROP TABLE IF EXISTS fl_cultural_funding_by_district CASCADE;
+
+CREATE TABLE IF NOT EXISTS fl_cultural_funding_by_district (
+    district_id INT NOT NULL REFERENCES fl_district (id) ON DELETE CASCADE,
+    year SMALLINT NOT NULL,
+    designations INT NOT NULL,
+    total NUMERIC NOT NULL,
+    PRIMARY KEY (district_id, year)
+);
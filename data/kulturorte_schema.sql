@@ -7,19 +7,29 @@ DROP TABLE IF EXISTS sh_cultural_poi CASCADE;
 
 CREATE TABLE IF NOT EXISTS sh_cultural_poi (
   id SERIAL,
+  source_id VARCHAR,
+  source_url VARCHAR,
   regions VARCHAR,
-  created_at DATE,
-  updated_at DATE,
+  created_at TIMESTAMP,
+  updated_at TIMESTAMP,
+  deleted_at TIMESTAMP,
   website VARCHAR,
   meta_title VARCHAR,
   meta_description VARCHAR,
   phone VARCHAR,
+  email VARCHAR,
   street VARCHAR,
   city VARCHAR,
   postal_code VARCHAR,
   housenumber VARCHAR,
   title VARCHAR,
   description VARCHAR,
+  long_description VARCHAR,
+  opening_hours JSONB,
+  media_license JSONB,
+  contact2 JSONB,
+  district VARCHAR,
+  borough VARCHAR,
   wkb_geometry GEOMETRY(GEOMETRY, 4326),
   PRIMARY KEY(id)
 );
@@ -27,3 +37,26 @@ CREATE TABLE IF NOT EXISTS sh_cultural_poi (
 
 -- GEOMETRY INDEX
 CREATE INDEX IF NOT EXISTS sh_cultural_poi_wkb_geometry_idx ON sh_cultural_poi USING GIST (wkb_geometry);
+
+
+-- DISTRICT INDEX
+CREATE INDEX IF NOT EXISTS sh_cultural_poi_district_idx ON sh_cultural_poi (district);
+
+
+-- UPSTREAM ID INDEX
+CREATE UNIQUE INDEX IF NOT EXISTS sh_cultural_poi_source_id_idx ON sh_cultural_poi (source_id);
+
+
+-- FEED INDEX
+CREATE INDEX IF NOT EXISTS sh_cultural_poi_source_url_idx ON sh_cultural_poi (source_url);
+
+
+-- TABELLE SYNCHRONISATIONSSTAND
+DROP TABLE IF EXISTS sh_cultural_poi_sync CASCADE;
+
+CREATE TABLE IF NOT EXISTS sh_cultural_poi_sync (
+  source_url VARCHAR,
+  high_water_mark TIMESTAMP,
+  synced_at TIMESTAMP,
+  PRIMARY KEY(source_url)
+);
@@ -0,0 +1,20 @@
+-- POSTGIS ERWEITERUNG LADEN
+CREATE EXTENSION IF NOT EXISTS postgis;
+
+
+-- TABELLE KULTURORTE AUS OPENSTREETMAP
+DROP TABLE IF EXISTS fl_osm_venue CASCADE;
+
+CREATE TABLE IF NOT EXISTS fl_osm_venue (
+  id SERIAL,
+  name VARCHAR NOT NULL,
+  osm_ids VARCHAR,
+  wkb_geometry GEOMETRY(GEOMETRY, 4326),
+  centroid GEOMETRY(POINT, 4326),
+  PRIMARY KEY(id)
+);
+
+
+-- GEOMETRY INDEX
+CREATE INDEX IF NOT EXISTS fl_osm_venue_wkb_geometry_idx ON fl_osm_venue USING GIST (wkb_geometry);
+CREATE INDEX IF NOT EXISTS fl_osm_venue_centroid_idx ON fl_osm_venue USING GIST (centroid);
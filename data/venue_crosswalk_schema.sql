@@ -0,0 +1,19 @@
+-- POSTGIS ERWEITERUNG LADEN
+CREATE EXTENSION IF NOT EXISTS postgis;
+
+
+-- TABELLE ZUORDNUNG GLEICHER KULTURORTE AUS ALLEN QUELLEN
+DROP TABLE IF EXISTS fl_venue_crosswalk CASCADE;
+
+CREATE TABLE IF NOT EXISTS fl_venue_crosswalk (
+  cluster_id VARCHAR NOT NULL,
+  source VARCHAR NOT NULL,
+  source_id VARCHAR NOT NULL,
+  name VARCHAR,
+  wkb_geometry GEOMETRY(POINT, 4326),
+  PRIMARY KEY(source, source_id)
+);
+
+
+-- CLUSTER INDEX
+CREATE INDEX IF NOT EXISTS fl_venue_crosswalk_cluster_id_idx ON fl_venue_crosswalk (cluster_id);
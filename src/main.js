@@ -23,6 +23,10 @@ let previousSelectedMarker = null
 let previousSelectedId = null
 let slugUrlActive = null
 
+// venue pages rendered by tools/prerender_pages.py carry their feature inline
+const prerenderedFeature = document.querySelector('#feature')
+let slugFeatureRendered = prerenderedFeature !== null
+
 
 const center = [54.792023881765154, 9.435979166343026]
 const bounds = L.latLngBounds(L.latLng(54.75187298885215, 9.357220591547652), L.latLng(54.837075243318516, 9.50671528322748))
@@ -39,6 +43,41 @@ L.tileLayer('https://tiles.oklabflensburg.de/knf/{z}/{x}/{y}.png', {
 }).addTo(map)
 
 
+if (prerenderedFeature !== null) {
+  const feature = JSON.parse(prerenderedFeature.textContent)
+  const [lng, lat] = feature.geometry.coordinates
+
+  map.setView([lat, lng], 19)
+  slugUrlActive = true
+}
+else if (window.location.pathname.length > 1) {
+  // deep links fetch their single feature shard written by tools/generate_geojson.py --shards
+  fetch(`/features${window.location.pathname}.json`, {
+    method: 'GET'
+  }).then((response) => {
+    if (response.ok) {
+      return response.json()
+    }
+
+    return null
+  }).then((feature) => {
+    if (feature === null || slugFeatureRendered) {
+      return
+    }
+
+    const [lng, lat] = feature.geometry.coordinates
+
+    document.querySelector('#about').classList.add('hidden')
+    renderFeatureDetails(feature)
+    map.setView([lat, lng], 19)
+    slugFeatureRendered = true
+    slugUrlActive = true
+  }).catch(function (error) {
+    console.log(error)
+  })
+}
+
+
 window.addEventListener('popstate', (event) => {
   if (event.state !== null) {
     document.querySelector('#detailImage').innerHTML = ''
@@ -1484,7 +1523,7 @@ function renderFeatureDetails(feature) {
       descriptionLanguage = '[dansk]<br>'
     }
 
-    detailOutput += `<li class="py-1">${descriptionLanguage}${eventDescriptionGerman}</li>`
+    detailOutput += `<li class="py-1">${descriptionLanguage}${eventDescriptionDansk}</li>`
   }
 
   detailOutput += `<li class="py-2"><strong>Öffnungszeiten</strong><br>${venueOpen} Uhr bis ${venueClose} Uhr</li>`
@@ -1509,10 +1548,11 @@ function marker(data) {
     disableClusteringAtZoom: 15
   })
 
+  const path = decodeURIComponent(window.location.pathname)
+
   const geojsonGroup = L.geoJSON(data, {
     onEachFeature(feature, layer) {
       const slug = String(feature.properties.slug)
-      const path = decodeURIComponent(window.location.pathname)
 
       if (slug === path.slice(1)) {
         const eventId = feature.properties.event_id
@@ -1525,11 +1565,17 @@ function marker(data) {
           tooltipAnchor: [0, -17]
         })
 
-        document.querySelector('#about').classList.add('hidden')
         layer.setIcon(selectedIcon)
         previousSelectedMarker = layer
-        renderFeatureDetails(feature)
-        map.setView(layer._latlng, 19)
+
+        // a prerendered page or a feature shard already shows the details and the map position
+        if (!slugFeatureRendered) {
+          document.querySelector('#about').classList.add('hidden')
+          renderFeatureDetails(feature)
+          map.setView(layer._latlng, 19)
+          slugFeatureRendered = true
+        }
+
         slugUrlActive = true
       }
 
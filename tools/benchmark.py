@@ -0,0 +1,369 @@
+#!./venv/bin/python
+
+import json
+import time
+import click
+import shutil
+import platform
+import tempfile
+import subprocess
+import logging as log
+import psycopg2
+
+from datetime import datetime, timezone
+from pathlib import Path
+
+import metrics
+
+from synthetic_data import SIZES, parse_size, format_size, ensure_dataset, generate_venues
+from feed_server import serve
+from field_mapping import load_mapping, compile_mapping
+from location_downloader import get_database_params, fetch_data, read_archive, iter_mapped_rows, bulk_insert
+from insert_budget_csv import bulk_load
+from generate_geojson import get_slug, get_unique_slug, generate_geojson
+from generate_sitemap import get_data, iter_entries, generate_sitemap
+
+
+TOOLS = Path(__file__).parent
+SCHEMAS = {
+    'poi': TOOLS.parent / 'data' / 'kulturorte_schema.sql',
+    'funding': TOOLS.parent / 'data' / 'kultur_zuschuesse_schema.sql'
+}
+SCHEMA_NAME = 'benchmark'
+MAPPING = TOOLS / 'poi_fields.conf'
+
+BENCHMARKS = {}
+
+
+def benchmark(name, database=False):
+    # a benchmark prepares its data and returns a prepare and a run callable, only run is timed
+    def register(func):
+        BENCHMARKS[name] = (func, database)
+
+        return func
+
+    return register
+
+
+class Context:
+    def __init__(self, data_dir, work_dir, seed, batch_size, server=None, conn=None):
+        self.data_dir = data_dir
+        self.work_dir = work_dir
+        self.seed = seed
+        self.batch_size = batch_size
+        self.server = server
+        self.conn = conn
+
+    def dataset(self, name, rows):
+        return ensure_dataset(self.data_dir, name, rows, self.seed)
+
+    def work_path(self, name):
+        path = self.work_dir / name
+        path.mkdir(parents=True, exist_ok=True)
+
+        return path
+
+
+def load_feed(ctx, rows):
+    return list(read_archive(ctx.dataset('poi', rows)))
+
+
+def check_geometries(feed, columns, map_rows):
+    # a feed whose locations do not resolve would skip point encoding and the district join
+    index = columns.index('wkb_geometry')
+
+    if not any(values[index] is not None for values in map_rows(feed[:100])):
+        raise click.ClickException('the synthetic feed maps to no geometries, check iter_poi_rows against poi_fields.conf')
+
+
+def reset_schema(conn, name):
+    # every repeat starts from empty tables in a schema of its own, nothing outside of it is touched
+    with conn.cursor() as cur:
+        cur.execute(f'DROP SCHEMA IF EXISTS {SCHEMA_NAME} CASCADE')
+        cur.execute(f'CREATE SCHEMA {SCHEMA_NAME}')
+        cur.execute(SCHEMAS[name].read_text(encoding='utf8'))
+
+
+@benchmark('fetch_data')
+def bench_fetch_data(ctx, rows):
+    path = ctx.dataset('poi', rows)
+    url = f'{ctx.server.url}/{path.name}'
+    cache_dir = ctx.work_path('download_cache')
+
+    def prepare():
+        shutil.rmtree(cache_dir)
+
+    def run():
+        data, _ = fetch_data(url, cache_dir, retries=0, force=True)
+
+        return sum(1 for _ in data)
+
+    return prepare, run
+
+
+@benchmark('map_rows')
+def bench_map_rows(ctx, rows):
+    feed = load_feed(ctx, rows)
+    columns, map_rows = compile_mapping(load_mapping(MAPPING))
+
+    check_geometries(feed, columns, map_rows)
+
+    def run():
+        return sum(1 for _ in iter_mapped_rows(feed, ctx.batch_size, map_rows))
+
+    return None, run
+
+
+@benchmark('get_slug')
+def bench_get_slug(ctx, rows):
+    venues = generate_venues(rows, max(rows // 5, 1), ctx.seed)
+
+    def prepare():
+        get_slug.cache_clear()
+
+    def run():
+        registry = {}
+
+        for venue in venues:
+            get_unique_slug(*venue, registry)
+
+        return len(venues)
+
+    return prepare, run
+
+
+@benchmark('generate_geojson')
+def bench_generate_geojson(ctx, rows):
+    # the output is written next to the input, so the csv is copied into the work directory
+    src = ctx.work_path('geojson') / ctx.dataset('kulturnacht', rows).name
+    shutil.copyfile(ctx.dataset('kulturnacht', rows), src)
+
+    def prepare():
+        get_slug.cache_clear()
+
+    def run():
+        generate_geojson(src, False, None, False, 6, None, None, 'name', False, None)
+
+        return rows
+
+    return prepare, run
+
+
+@benchmark('generate_sitemap')
+def bench_generate_sitemap(ctx, rows):
+    work_dir = ctx.work_path('sitemap')
+    src = work_dir / ctx.dataset('kulturnacht', rows).name
+    shutil.copyfile(ctx.dataset('kulturnacht', rows), src)
+
+    generate_geojson(src, False, None, False, 6, None, None, 'name', False, None)
+
+    geojson = src.with_suffix('.geojson')
+    dst = work_dir / 'sitemap.xml'
+
+    def prepare():
+        # remove earlier output, otherwise unchanged shards are skipped
+        for path in work_dir.glob('sitemap*'):
+            path.unlink()
+
+    def run():
+        entries = iter_entries(metrics.timed('parse', get_data(geojson)), '2024-01-01')
+        generate_sitemap('https://example.org/', entries, dst)
+
+        return rows
+
+    return prepare, run
+
+
+@benchmark('bulk_insert', database=True)
+def bench_bulk_insert(ctx, rows):
+    feed = load_feed(ctx, rows)
+    columns, map_rows = compile_mapping(load_mapping(MAPPING))
+
+    check_geometries(feed, columns, map_rows)
+
+    def prepare():
+        reset_schema(ctx.conn, 'poi')
+
+    def run():
+        inserted, _ = bulk_insert(ctx.conn, feed, ctx.batch_size, columns, map_rows)
+
+        return inserted
+
+    return prepare, run
+
+
+@benchmark('bulk_load', database=True)
+def bench_bulk_load(ctx, rows):
+    src = ctx.dataset('funding', rows)
+
+    def prepare():
+        reset_schema(ctx.conn, 'funding')
+
+    def run():
+        inserted, _ = bulk_load(ctx.conn, src, True)
+
+        return inserted
+
+    return prepare, run
+
+
+def measure(prepare, run, repeats):
+    # the fastest repeat is kept, it is the one least disturbed by the rest of the machine
+    best = None
+
+    for _ in range(repeats):
+        if prepare is not None:
+            prepare()
+
+        metrics.reset()
+
+        start = time.perf_counter()
+        rows = run()
+        seconds = time.perf_counter() - start
+
+        if best is None or seconds < best[0]:
+            best = seconds, rows, metrics.get_report('benchmark', 'ok')['stages']
+
+    return best
+
+
+def get_commit():
+    try:
+        result = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=TOOLS, capture_output=True, text=True, check=True)
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+    return result.stdout.strip()
+
+
+def load_previous(results_path, label=None):
+    # the last stored run, or the last one with the given label
+    previous = None
+
+    try:
+        with open(results_path, 'r', encoding='utf8') as f:
+            for line in f:
+                record = json.loads(line)
+
+                if label is None or record.get('label') == label:
+                    previous = record
+    except FileNotFoundError:
+        pass
+
+    return previous
+
+
+def save_result(results_path, record):
+    results_path.parent.mkdir(parents=True, exist_ok=True)
+
+    with open(results_path, 'a', encoding='utf8') as f:
+        f.write(json.dumps(record, ensure_ascii=False) + '\n')
+
+
+def format_change(result, previous):
+    if previous is None:
+        return ''
+
+    for entry in previous['results']:
+        if entry['benchmark'] == result['benchmark'] and entry['rows'] == result['rows']:
+            change = result['seconds'] / entry['seconds'] - 1 if entry['seconds'] else 0.0
+
+            return f'{change:+8.1%} vs {previous.get("commit") or previous["started_at"]}'
+
+    return ''
+
+
+def connect_benchmark_database(env):
+    conn = psycopg2.connect(**get_database_params(env), options=f'-c search_path={SCHEMA_NAME},public')
+    conn.autocommit = True
+
+    with conn.cursor() as cur:
+        cur.execute('CREATE EXTENSION IF NOT EXISTS postgis SCHEMA public')
+
+    return conn
+
+
+@click.command()
+@click.option('--size', 'sizes', multiple=True, default=['1k', '100k'], show_default=True, help=f'Add number of rows, {", ".join(SIZES)} or a number')
+@click.option('--benchmark', '-b', 'names', multiple=True, type=click.Choice(list(BENCHMARKS)), help='Only run this benchmark, repeat for several')
+@click.option('--env', '-e', type=str, help='Set dot env path of a throwaway postgis database to also run the database benchmarks')
+@click.option('--repeats', '-r', type=int, default=3, show_default=True, help='Set number of repeats, the fastest is kept')
+@click.option('--seed', type=int, default=1, show_default=True, help='Set random seed of the synthetic data')
+@click.option('--batch-size', type=int, default=5000, show_default=True, help='Set number of rows per batch')
+@click.option('--data-dir', type=click.Path(file_okay=False), default='~/.cache/open-cultural-map/benchmark', show_default=True, help='Set directory for the synthetic datasets')
+@click.option('--results', type=click.Path(dir_okay=False), default='~/.cache/open-cultural-map/benchmark/results.jsonl', show_default=True, help='Set file the results are appended to')
+@click.option('--label', type=str, help='Store the run under this label')
+@click.option('--compare', type=str, help='Compare with the last run stored under this label instead of the last run')
+@click.option('--verbose', '-v', is_flag=True, help='Print more verbose output')
+def main(sizes, names, env, repeats, seed, batch_size, data_dir, results, label, compare, verbose):
+    if verbose:
+        log.basicConfig(format='%(levelname)s: %(message)s', level=log.INFO)
+    else:
+        log.basicConfig(format='%(levelname)s: %(message)s', level=log.ERROR)
+
+    data_dir = Path(data_dir).expanduser()
+    results_path = Path(results).expanduser()
+    names = names or list(BENCHMARKS)
+
+    if not env:
+        skipped = [name for name in names if BENCHMARKS[name][1]]
+        names = [name for name in names if not BENCHMARKS[name][1]]
+
+        if skipped:
+            click.echo(f'skipping {", ".join(skipped)}, set --env to run the database benchmarks')
+
+    previous = load_previous(results_path, compare)
+
+    record = {
+        'started_at': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'label': label,
+        'commit': get_commit(),
+        'python': platform.python_version(),
+        'machine': f'{platform.system()} {platform.machine()} {platform.processor()}'.strip(),
+        'seed': seed,
+        'repeats': repeats,
+        'results': []
+    }
+
+    server = serve(data_dir)
+    conn = connect_benchmark_database(env) if env else None
+
+    try:
+        with tempfile.TemporaryDirectory() as work_dir:
+            ctx = Context(data_dir, Path(work_dir), seed, batch_size, server, conn)
+
+            for rows in map(parse_size, sizes):
+                for name in names:
+                    prepare, run = BENCHMARKS[name][0](ctx, rows)
+                    seconds, processed, stages = measure(prepare, run, repeats)
+
+                    result = {
+                        'benchmark': name,
+                        'rows': rows,
+                        'processed': processed,
+                        'seconds': round(seconds, 6),
+                        'rows_per_second': round(processed / seconds) if seconds else None,
+                        'stages': stages
+                    }
+
+                    record['results'].append(result)
+
+                    click.echo(f'{name:18} {format_size(rows):>6} {seconds:10.3f} s {result["rows_per_second"] or 0:12,} rows/s '
+                        f'{format_change(result, previous)}')
+    finally:
+        server.shutdown()
+
+        if conn is not None:
+            with conn.cursor() as cur:
+                cur.execute(f'DROP SCHEMA IF EXISTS {SCHEMA_NAME} CASCADE')
+
+            conn.close()
+
+    record['peak_rss_bytes'] = metrics.get_peak_rss()
+    save_result(results_path, record)
+
+    click.echo(f'results appended to {results_path}')
+
+
+if __name__ == '__main__':
+    main()
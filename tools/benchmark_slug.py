@@ -0,0 +1,87 @@
+#!./venv/bin/python
+
+import re
+import click
+import timeit
+
+from generate_geojson import get_slug, get_unique_slug
+from synthetic_data import generate_venues
+
+
+def legacy_remove_chars(string):
+    slug = string
+
+    tpl = (('©', ''), ('"', ''), ('\\', ''), ('&', 'und'), ('(', ''), (')', ''))
+
+    for item1, item2 in tpl:
+        slug = slug.replace(item1, item2)
+
+    return slug
+
+
+def legacy_replace_umlauts(string):
+    slug = string
+
+    tpl = (('ü', 'ue'), ('Ü', 'Ue'), ('ä', 'ae'), ('Ä', 'Ae'), ('ö', 'oe'), ('Ö', 'Oe'), ('ß', 'ss'))
+
+    for item1, item2 in tpl:
+        slug = slug.replace(item1, item2)
+
+    return slug
+
+
+def legacy_get_slug(label, city, address):
+    title = re.sub(r'[\d\s!@#\$%\^&\*\(\)\[\]{};:,\./<>\?\|`~\-=_\+]', ' ', label)
+    addr = re.sub(r'[\s!@#\$%\^&\*\(\)\[\]{};:,\./<>\?\|`~\-=_\+]', ' ', address)
+
+    street = re.sub(r'\d.*', '', address)
+    streets = list(set(street.split()))
+
+    for item in streets:
+        title = title.replace(item.strip(), '')
+
+    slug = f'{title} {addr} {city}'.lower().strip()
+    slug = legacy_remove_chars(slug)
+    slug = re.sub(r'\s+', ' ', legacy_replace_umlauts(slug)).replace(' ', '-')
+
+    return slug
+
+
+@click.command()
+@click.option('--rows', type=int, default=100000, show_default=True, help='Set number of synthetic rows')
+@click.option('--distinct', type=int, default=20000, show_default=True, help='Set number of distinct venues')
+@click.option('--seed', type=int, default=1, show_default=True, help='Set random seed')
+def main(rows, distinct, seed):
+    venues = generate_venues(rows, distinct, seed)
+
+    mismatches = sum(1 for venue in set(venues) if get_slug(*venue) != legacy_get_slug(*venue))
+    click.echo(f'{mismatches} of {len(set(venues))} distinct venues differ from the legacy slug')
+
+    def run_legacy():
+        for venue in venues:
+            legacy_get_slug(*venue)
+
+    def run_uncached():
+        for venue in venues:
+            get_slug.__wrapped__(*venue)
+
+    def run_cached():
+        get_slug.cache_clear()
+
+        for venue in venues:
+            get_slug(*venue)
+
+    def run_unique():
+        get_slug.cache_clear()
+        registry = {}
+
+        for venue in venues:
+            get_unique_slug(*venue, registry)
+
+    for name, func in (('legacy', run_legacy), ('compiled', run_uncached), ('memoized', run_cached), ('unique', run_unique)):
+        seconds = min(timeit.repeat(func, number=1, repeat=3))
+        click.echo(f'{name:10} {seconds / rows * 1e6:8.2f} us/row')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+import json
+import numpy as np
+import shapely
+import logging as log
+
+from shapely.geometry import shape
+from geometry import to_coordinate_arrays
+
+
+def load_districts(src, name_property='name'):
+    with open(src, 'r') as f:
+        collection = json.load(f)
+
+    names = []
+    geometries = []
+
+    for feature in collection['features']:
+        if feature.get('geometry') is None:
+            continue
+
+        names.append(str(feature['properties'][name_property]))
+        geometries.append(shape(feature['geometry']))
+
+    geometries = np.array(geometries, dtype=object)
+    shapely.prepare(geometries)
+
+    return np.array(names, dtype=object), shapely.STRtree(geometries)
+
+
+def join_districts(lons, lats, districts):
+    names, tree = districts
+    lons = np.asarray(lons, dtype='float64')
+    lats = np.asarray(lats, dtype='float64')
+    valid = np.flatnonzero(~(np.isnan(lons) | np.isnan(lats)))
+
+    joined = np.full(len(lons), None, dtype=object)
+
+    if len(valid) == 0:
+        return joined
+
+    points = shapely.points(lons[valid], lats[valid])
+
+    # intersects instead of within, so points on a shared border still get a district
+    point_indexes, district_indexes = tree.query(points, predicate='intersects')
+
+    # the first polygon wins if a point touches several of them
+    point_indexes, first = np.unique(point_indexes, return_index=True)
+    joined[valid[point_indexes]] = names[district_indexes[first]]
+
+    return joined
+
+
+def assign_districts(lons, lats, districts=None, boroughs=None, labels=None):
+    count = len(lons)
+    assigned = []
+
+    for layer in (districts, boroughs):
+        if layer is None:
+            assigned.append([None] * count)
+            continue
+
+        joined = join_districts(lons, lats, layer)
+
+        for i, name in enumerate(joined):
+            if name is None and not (np.isnan(lons[i]) or np.isnan(lats[i])):
+                label = labels[i] if labels is not None else f'row {i}'
+                log.debug(f'{label} at {lons[i]}, {lats[i]} is outside of every district')
+
+        assigned.append(joined.tolist())
+
+    return tuple(assigned)
+
+
+def load_layers(districts_path=None, boroughs_path=None, name_property='name'):
+    districts = load_districts(districts_path, name_property) if districts_path else None
+    boroughs = load_districts(boroughs_path, name_property) if boroughs_path else None
+
+    return districts, boroughs
+
+
+def enrich_batch(features, districts=None, boroughs=None):
+    coordinates = [feature['geometry']['coordinates'][:2] if feature.get('geometry') else None
+        for feature in features]
+    lons, lats = to_coordinate_arrays(coordinates)
+
+    for feature, district, borough in zip(features, *assign_districts(lons, lats, districts, boroughs)):
+        feature['properties']['district'] = district
+        feature['properties']['borough'] = borough
+
+    return features
+
+
+def enrich_features(features, districts=None, boroughs=None, batch_size=5000):
+    # features are joined in batches so generators keep streaming
+    batch = []
+
+    for feature in features:
+        batch.append(feature)
+
+        if len(batch) >= batch_size:
+            yield from enrich_batch(batch, districts, boroughs)
+            batch = []
+
+    if batch:
+        yield from enrich_batch(batch, districts, boroughs)
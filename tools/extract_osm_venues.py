@@ -0,0 +1,272 @@
+#!./venv/bin/python
+
+import os
+import sys
+import json
+import click
+import osmium
+import shapely
+import tempfile
+import numpy as np
+import traceback
+import logging as log
+import psycopg2
+
+from psycopg2.extras import execute_values
+from shapely.geometry import mapping
+from dotenv import load_dotenv
+from pathlib import Path
+
+
+
+# log uncaught exceptions
+def log_exceptions(type, value, tb):
+    for line in traceback.TracebackException(type, value, tb).format(chain=True):
+        log.exception(line)
+
+    log.exception(value)
+
+    sys.__excepthook__(type, value, tb) # calls default excepthook
+
+
+def connect_database(env_path):
+    try:
+        load_dotenv(dotenv_path=Path(env_path))
+
+        conn = psycopg2.connect(
+            database = os.getenv('DB_NAME'),
+            password = os.getenv('DB_PASS'),
+            user = os.getenv('DB_USER'),
+            host = os.getenv('DB_HOST'),
+            port = os.getenv('DB_PORT')
+        )
+
+        conn.autocommit = True
+
+        log.info('connection to database established')
+
+        return conn
+    except Exception as e:
+        log.error(e)
+
+        sys.exit(1)
+
+
+def read_ids(src):
+    # blocks separated by blank lines, a venue name over one or more lines followed by its osm ids
+    ids = {}
+    venues = []
+    lines = []
+    name = None
+
+    with open(src, 'r', encoding='utf8') as f:
+        for number, line in enumerate(f, 1):
+            line = line.strip()
+
+            if not line:
+                lines = []
+                name = None
+                continue
+
+            if not line.isdigit():
+                if name is not None:
+                    raise click.ClickException(f'{src}:{number}: expected an osm id but got {line!r}')
+
+                lines.append(line)
+                continue
+
+            if name is None:
+                if not lines:
+                    raise click.ClickException(f'{src}:{number}: osm id {line} has no venue name')
+
+                name = ', '.join(lines)
+                venues.append(name)
+
+            osm_id = int(line)
+
+            if osm_id in ids and ids[osm_id] != name:
+                log.warning(f'osm id {osm_id} is listed for {ids[osm_id]} and {name}, keeping {ids[osm_id]}')
+                continue
+
+            ids[osm_id] = name
+
+    return ids, venues
+
+
+class VenueHandler(osmium.SimpleHandler):
+    # the ids carry no type, so nodes and ways are both matched and ways win later on
+    def __init__(self, ids):
+        super().__init__()
+
+        self.ids = ids
+        self.nodes = {}
+        self.ways = {}
+
+    def node(self, n):
+        if n.id in self.ids and n.location.valid():
+            self.nodes[n.id] = shapely.Point(n.location.lon, n.location.lat)
+
+    def way(self, w):
+        if w.id not in self.ids:
+            return
+
+        try:
+            coordinates = [(node.lon, node.lat) for node in w.nodes]
+        except osmium.InvalidLocationError:
+            log.warning(f'way {w.id} references nodes missing from the extract')
+            return
+
+        if len(coordinates) >= 4 and coordinates[0] == coordinates[-1]:
+            geometry = shapely.make_valid(shapely.Polygon(coordinates))
+        elif len(coordinates) >= 2:
+            geometry = shapely.LineString(coordinates)
+        else:
+            return
+
+        self.ways[w.id] = geometry
+
+
+def scan_extract(src, ids, index_type, index_path):
+    handler = VenueHandler(ids)
+
+    # node locations go to a file backed index, ways are resolved in the same pass since nodes come first
+    handler.apply_file(str(src), locations=True, idx=f'{index_type},{index_path}')
+
+    return handler.nodes, handler.ways
+
+
+def resolve_venues(ids, venues, nodes, ways):
+    parts = {name: ([], []) for name in venues}
+    collisions = []
+
+    for osm_id, name in ids.items():
+        if osm_id in ways:
+            # node and way ids are separate number ranges, the node is most likely unrelated
+            if osm_id in nodes:
+                log.warning(f'osm id {osm_id} of {name} matches a node and a way, using the way')
+
+                collisions.append((osm_id, name))
+
+            parts[name][0].append(f'w{osm_id}')
+            parts[name][1].append(ways[osm_id])
+        elif osm_id in nodes:
+            parts[name][0].append(f'n{osm_id}')
+            parts[name][1].append(nodes[osm_id])
+        else:
+            log.warning(f'osm id {osm_id} of {name} is not in the extract')
+
+    resolved = []
+
+    for name, (osm_ids, geometries) in parts.items():
+        if not geometries:
+            log.warning(f'no osm object found for {name}')
+            continue
+
+        footprint = shapely.union_all(geometries)
+        resolved.append((name, osm_ids, footprint, footprint.centroid))
+
+    return resolved, collisions
+
+
+def write_geojson(dst, resolved, centroids, precision):
+    features = []
+
+    for name, osm_ids, footprint, centroid in resolved:
+        geometry = centroid if centroids else footprint
+
+        features.append({
+            'type': 'Feature',
+            'geometry': mapping(shapely.transform(geometry, lambda coordinates: np.round(coordinates, precision))),
+            'properties': {
+                'name': name,
+                'osm_ids': osm_ids,
+                'centroid': [round(centroid.x, precision), round(centroid.y, precision)]
+            }
+        })
+
+    with open(dst, 'w', encoding='utf8') as f:
+        json.dump({'type': 'FeatureCollection', 'features': features}, f, ensure_ascii=False)
+
+
+def insert_venues(conn, resolved):
+    rows = []
+
+    for name, osm_ids, footprint, centroid in resolved:
+        footprint, centroid = shapely.set_srid([footprint, centroid], 4326)
+        rows.append((name, ','.join(osm_ids), shapely.to_wkb(footprint, hex=True, include_srid=True),
+            shapely.to_wkb(centroid, hex=True, include_srid=True)))
+
+    conn.autocommit = False
+
+    try:
+        with conn.cursor() as cur:
+            cur.execute('TRUNCATE fl_osm_venue RESTART IDENTITY')
+
+            execute_values(cur, '''
+                INSERT INTO fl_osm_venue (name, osm_ids, wkb_geometry, centroid) VALUES %s
+            ''', rows)
+
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        log.error(e)
+
+        sys.exit(1)
+    finally:
+        conn.autocommit = True
+
+
+@click.command()
+@click.argument('src', type=click.Path(exists=True, dir_okay=False))
+@click.option('--ids', type=click.Path(exists=True, dir_okay=False), default=str(Path(__file__).parent.parent / 'data' / 'osm-ids.txt'), show_default=True, help='Set file with venue names and their osm ids')
+@click.option('--dst', type=click.Path(dir_okay=False), help='Write the venues to this geojson file')
+@click.option('--env', '-e', type=str, help='Set your local dot env path to write the venues into fl_osm_venue')
+@click.option('--centroids', is_flag=True, help='Write centroids instead of footprints into the geojson file')
+@click.option('--precision', type=int, default=7, show_default=True, help='Set number of decimals kept in coordinates')
+@click.option('--index-type', type=click.Choice(['sparse_file_array', 'dense_file_array']), default='sparse_file_array', show_default=True, help='Set node location index, dense only pays off for planet sized extracts')
+@click.option('--index', 'index_path', type=click.Path(dir_okay=False), help='Set node location index file, a temporary file by default')
+@click.option('--verbose', '-v', is_flag=True, help='Print more verbose output')
+@click.option('--debug', '-d', is_flag=True, help='Print detailed debug output')
+def main(src, ids, dst, env, centroids, precision, index_type, index_path, verbose, debug):
+    if debug:
+        log.basicConfig(format='%(levelname)s: %(message)s', level=log.DEBUG)
+    if verbose:
+        log.basicConfig(format='%(levelname)s: %(message)s', level=log.INFO)
+        log.info(f'set logging level to verbose')
+    else:
+        log.basicConfig(format='%(levelname)s: %(message)s')
+
+    if not dst and not env:
+        raise click.UsageError('Set --dst, --env or both')
+
+    ids, venues = read_ids(ids)
+
+    log.info(f'looking up {len(ids)} osm ids of {len(venues)} venues in {src}')
+
+    if index_path:
+        nodes, ways = scan_extract(src, ids, index_type, index_path)
+    else:
+        with tempfile.TemporaryDirectory() as tmp:
+            nodes, ways = scan_extract(src, ids, index_type, Path(tmp) / 'nodes.idx')
+
+    resolved, collisions = resolve_venues(ids, venues, nodes, ways)
+
+    if dst:
+        write_geojson(dst, resolved, centroids, precision)
+
+    if env:
+        insert_venues(connect_database(env), resolved)
+
+    click.echo(f'resolved {len(resolved)} of {len(venues)} venues')
+
+    if collisions:
+        click.echo(f'{len(collisions)} osm ids matched a node and a way, the way was used:')
+
+        for osm_id, name in collisions:
+            click.echo(f'  {osm_id} {name}')
+
+
+if __name__ == '__main__':
+    sys.excepthook = log_exceptions
+
+    main()
@@ -0,0 +1,200 @@
+#!./venv/bin/python
+
+import gzip
+import time
+import click
+import threading
+import logging as log
+
+from email.utils import formatdate
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+
+CHUNK_SIZE = 65536
+
+
+class FeedHandler(BaseHTTPRequestHandler):
+    # stands in for the feed host, with the validators and range support download_archive relies on
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        log.debug(f'{self.address_string()} {format % args}')
+
+    def get_path(self):
+        root = self.server.directory
+        path = (root / self.path.split('?', 1)[0].lstrip('/')).resolve()
+
+        if root not in path.parents or not path.is_file():
+            return None
+
+        return path
+
+    def send_empty(self, status, headers=()):
+        self.send_response(status)
+
+        for key, value in headers:
+            self.send_header(key, value)
+
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def get_range(self, size, etag, last_modified):
+        header = self.headers.get('Range')
+        validator = self.headers.get('If-Range')
+
+        if not header or (validator and validator not in (etag, last_modified)):
+            return None
+
+        unit, _, spec = header.partition('=')
+        start, _, end = spec.partition('-')
+
+        if unit.strip() != 'bytes' or ',' in spec or not start.isdigit():
+            return None
+
+        start = int(start)
+        end = min(int(end), size - 1) if end.isdigit() else size - 1
+
+        return start, end
+
+    def do_HEAD(self):
+        self.respond(body=False)
+
+    def do_GET(self):
+        self.respond(body=True)
+
+    def respond(self, body):
+        time.sleep(self.server.latency)
+
+        path = self.get_path()
+
+        if path is None:
+            self.send_empty(HTTPStatus.NOT_FOUND)
+            return
+
+        stat = path.stat()
+        etag = f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+        last_modified = formatdate(stat.st_mtime, usegmt=True)
+        validators = [('ETag', etag), ('Last-Modified', last_modified)]
+
+        if etag in self.headers.get('If-None-Match', '') or self.headers.get('If-Modified-Since') == last_modified:
+            self.send_empty(HTTPStatus.NOT_MODIFIED, validators)
+            return
+
+        compress = path.suffix != '.gz' and 'gzip' in self.headers.get('Accept-Encoding', '')
+
+        if compress:
+            # plain files go out gzip encoded like from a compressing proxy, without range support
+            data = gzip.compress(path.read_bytes(), compresslevel=6)
+            start, end = 0, len(data) - 1
+            status = HTTPStatus.OK
+        else:
+            data = None
+            byte_range = self.get_range(stat.st_size, etag, last_modified)
+
+            if byte_range is not None and byte_range[0] >= stat.st_size:
+                self.send_empty(HTTPStatus.REQUESTED_RANGE_NOT_SATISFIABLE, [('Content-Range', f'bytes */{stat.st_size}')])
+                return
+
+            start, end = byte_range or (0, stat.st_size - 1)
+            status = HTTPStatus.PARTIAL_CONTENT if byte_range else HTTPStatus.OK
+
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/gzip' if path.suffix == '.gz' else 'application/octet-stream')
+        self.send_header('Content-Length', str(end - start + 1))
+        self.send_header('Accept-Ranges', 'none' if compress else 'bytes')
+
+        for key, value in validators:
+            self.send_header(key, value)
+
+        if compress:
+            self.send_header('Content-Encoding', 'gzip')
+
+        if status == HTTPStatus.PARTIAL_CONTENT:
+            self.send_header('Content-Range', f'bytes {start}-{end}/{stat.st_size}')
+
+        self.end_headers()
+
+        if body:
+            self.send_body(path, data, start, end)
+
+    def send_body(self, path, data, start, end):
+        rate = self.server.rate
+        began = time.perf_counter()
+        sent = 0
+
+        for chunk in iter_chunks(path, data, start, end):
+            self.wfile.write(chunk)
+            sent += len(chunk)
+
+            # throttle to the configured bandwidth
+            if rate:
+                ahead = sent / rate - (time.perf_counter() - began)
+
+                if ahead > 0:
+                    time.sleep(ahead)
+
+
+def iter_chunks(path, data, start, end):
+    if data is not None:
+        for offset in range(start, end + 1, CHUNK_SIZE):
+            yield data[offset:min(offset + CHUNK_SIZE, end + 1)]
+
+        return
+
+    remaining = end - start + 1
+
+    with open(path, 'rb') as f:
+        f.seek(start)
+
+        while remaining > 0:
+            chunk = f.read(min(CHUNK_SIZE, remaining))
+
+            if not chunk:
+                return
+
+            remaining -= len(chunk)
+
+            yield chunk
+
+
+def serve(directory, host='127.0.0.1', port=0, rate=None, latency=0.0):
+    server = ThreadingHTTPServer((host, port), FeedHandler)
+    server.daemon_threads = True
+    server.directory = Path(directory).resolve()
+    server.rate = rate
+    server.latency = latency
+    server.url = f'http://{host}:{server.server_address[1]}'
+
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    return server
+
+
+@click.command()
+@click.argument('directory', type=click.Path(exists=True, file_okay=False))
+@click.option('--host', type=str, default='127.0.0.1', show_default=True, help='Set address to listen on')
+@click.option('--port', type=int, default=8000, show_default=True, help='Set port to listen on')
+@click.option('--rate', type=float, help='Limit bandwidth per response to this many megabytes per second')
+@click.option('--latency', type=float, default=0.0, show_default=True, help='Set seconds to wait before every response')
+@click.option('--verbose', '-v', is_flag=True, help='Print more verbose output')
+def main(directory, host, port, rate, latency, verbose):
+    if verbose:
+        log.basicConfig(format='%(levelname)s: %(message)s', level=log.DEBUG)
+    else:
+        log.basicConfig(format='%(levelname)s: %(message)s')
+
+    server = serve(directory, host, port, rate * 1e6 if rate else None, latency)
+
+    click.echo(f'serving {server.directory} at {server.url}')
+
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
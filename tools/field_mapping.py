@@ -0,0 +1,220 @@
+import json
+
+from datetime import datetime
+from geometry import SCHLESWIG_HOLSTEIN_BBOX, to_coordinate_arrays, encode_points, flag_out_of_bounds
+from districts import assign_districts
+from metrics import stage
+
+
+DATE_FORMAT = '%Y-%m-%d %H:%M:%S.%f'
+
+
+def to_datetime(value):
+    # fromisoformat is an order of magnitude faster than strptime
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        return datetime.strptime(value, DATE_FORMAT)
+
+
+def to_point(value):
+    # points are collected per batch and encoded in one go by map_rows
+    if 'latitude' not in value or 'longitude' not in value:
+        return None
+
+    return value['longitude'], value['latitude']
+
+
+CONVERTERS = {
+    'str': str,
+    'datetime': to_datetime,
+    'join': lambda value: ', '.join(str(item) for item in value),
+    'json': lambda value: json.dumps(value, ensure_ascii=False),
+    'point': to_point
+}
+
+
+def compile_keys(keys):
+    if len(keys) == 1:
+        key = keys[0]
+
+        def getter(obj):
+            try:
+                return obj[key]
+            except (KeyError, TypeError):
+                return None
+    elif len(keys) == 2:
+        key1, key2 = keys
+
+        def getter(obj):
+            try:
+                return obj[key1][key2]
+            except (KeyError, TypeError):
+                return None
+    elif len(keys) == 3:
+        key1, key2, key3 = keys
+
+        def getter(obj):
+            try:
+                return obj[key1][key2][key3]
+            except (KeyError, TypeError):
+                return None
+    else:
+        def getter(obj):
+            try:
+                for key in keys:
+                    obj = obj[key]
+            except (KeyError, TypeError):
+                return None
+
+            return obj
+
+    return getter
+
+
+def compile_path(path):
+    # a path segment ending in [] iterates over a list, e.g. regions[].i18nName.de
+    head, sep, tail = path.partition('[].')
+
+    if not sep:
+        if path.endswith('[]'):
+            return compile_keys(tuple(path[:-2].split('.')))
+
+        return compile_keys(tuple(path.split('.')))
+
+    list_getter = compile_keys(tuple(head.split('.')))
+    item_getter = compile_path(tail)
+
+    def getter(obj):
+        items = list_getter(obj)
+
+        if not isinstance(items, list):
+            return None
+
+        values = [item_getter(item) for item in items]
+
+        return [value for value in values if value is not None]
+
+    return getter
+
+
+def compile_spec(path, converter=None):
+    getter = compile_path(path)
+
+    if converter is None:
+        return getter
+
+    convert = CONVERTERS[converter]
+
+    def convert_getter(obj):
+        value = getter(obj)
+
+        if value is None or value == '' or value == []:
+            return None
+
+        return convert(value)
+
+    return convert_getter
+
+
+def parse_spec(line):
+    if '->' not in line:
+        raise ValueError(f'invalid field spec {line!r}, expected "path -> column"')
+
+    path, target = line.split('->', 1)
+    column, _, converter = target.partition('|')
+
+    path = path.strip()
+    column = column.strip()
+    converter = converter.strip() or None
+
+    if converter is not None and converter not in CONVERTERS:
+        raise ValueError(f'unknown converter {converter!r} in field spec {line!r}')
+
+    return path, column, converter
+
+
+def load_mapping(mapping_path):
+    specs = []
+
+    with open(mapping_path, 'r') as f:
+        for line in f:
+            line = line.split('#', 1)[0].strip()
+
+            if line:
+                specs.append(parse_spec(line))
+
+    return specs
+
+
+ADDRESS_COLUMNS = ('street', 'housenumber', 'postal_code', 'city')
+
+
+def compile_mapping(specs, bbox=SCHLESWIG_HOLSTEIN_BBOX, districts=None, boroughs=None, geocoder=None):
+    columns = tuple(column for _, column, _ in specs)
+    getters = tuple(compile_spec(path, converter) for path, _, converter in specs)
+    point_indexes = [i for i, (_, _, converter) in enumerate(specs) if converter == 'point']
+    label_index = columns.index('source_id') if 'source_id' in columns else None
+    join = districts is not None or boroughs is not None
+
+    if len(set(columns)) != len(columns):
+        raise ValueError('every column may only be mapped once')
+
+    if join:
+        if not point_indexes:
+            raise ValueError('a district join needs a point column in the mapping')
+
+        if 'district' in columns or 'borough' in columns:
+            raise ValueError('district and borough are filled by the district join')
+
+        columns += ('district', 'borough')
+
+    address_indexes = [columns.index(column) if column in columns else None for column in ADDRESS_COLUMNS]
+
+    if geocoder is not None:
+        if not point_indexes:
+            raise ValueError('geocoding needs a point column in the mapping')
+
+        if address_indexes[0] is None:
+            raise ValueError('geocoding needs a street column in the mapping')
+
+    def map_rows(rows):
+        values = [[getter(row) for getter in getters] for row in rows]
+
+        if label_index is not None:
+            labels = [v[label_index] for v in values]
+        else:
+            labels = None
+
+        for n, i in enumerate(point_indexes):
+            # rows without coordinates are located by their address, the first point column gets the result
+            if geocoder is not None and n == 0:
+                missing = [v for v in values if v[i] is None]
+
+                if missing:
+                    with stage('geocode', rows=len(missing)):
+                        located = geocoder.geocode([tuple(v[k] if k is not None else None for k in address_indexes)
+                            for v in missing])
+
+                    for v, point in zip(missing, located):
+                        v[i] = point
+
+            with stage('geometry', rows=len(values)):
+                lons, lats = to_coordinate_arrays([v[i] for v in values])
+
+                flag_out_of_bounds(lons, lats, bbox, labels)
+
+                # the first point column locates the row within the districts
+                if join and n == 0:
+                    with stage('districts', rows=len(values)):
+                        located = assign_districts(lons, lats, districts, boroughs, labels)
+
+                    for v, district, borough in zip(values, *located):
+                        v.extend((district, borough))
+
+                for v, encoded in zip(values, encode_points(lons, lats)):
+                    v[i] = encoded
+
+        return [tuple(v) for v in values]
+
+    return columns, map_rows
@@ -0,0 +1,153 @@
+#!./venv/bin/python
+
+import json
+import math
+import click
+
+from pathlib import Path
+
+
+def project(lon, lat):
+    sin = math.sin(math.radians(lat))
+    y = 0.5 - 0.25 * math.log((1 + sin) / (1 - sin)) / math.pi
+
+    return lon / 360 + 0.5, min(max(y, 0), 1)
+
+
+def unproject(x, y):
+    lon = (x - 0.5) * 360
+    lat = 360 * math.atan(math.exp((180 - y * 360) * math.pi / 180)) / math.pi - 90
+
+    return lon, lat
+
+
+def read_points(src):
+    with open(src, 'r') as f:
+        collection = json.load(f)
+
+    points = []
+
+    for i, feature in enumerate(collection['features']):
+        geometry = feature.get('geometry')
+
+        if geometry is None or geometry['type'] != 'Point':
+            continue
+
+        x, y = project(*geometry['coordinates'][:2])
+        points.append({'x': x, 'y': y, 'count': 1, 'id': i, 'feature': feature, 'zoom': math.inf})
+
+    return points
+
+
+def cluster_zoom(points, z, radius, extent):
+    # grid cells as wide as the cluster radius, so neighbours are within the adjacent cells
+    r = radius / (extent * (1 << z))
+    grid = {}
+
+    for point in points:
+        key = (int(point['x'] / r), int(point['y'] / r))
+        grid.setdefault(key, []).append(point)
+
+    clusters = []
+
+    for point in points:
+        if point['zoom'] <= z:
+            continue
+
+        point['zoom'] = z
+
+        cx, cy = int(point['x'] / r), int(point['y'] / r)
+        neighbours = []
+
+        for gx in range(cx - 1, cx + 2):
+            for gy in range(cy - 1, cy + 2):
+                for other in grid.get((gx, gy), ()):
+                    if other['zoom'] <= z:
+                        continue
+
+                    if (other['x'] - point['x']) ** 2 + (other['y'] - point['y']) ** 2 <= r * r:
+                        neighbours.append(other)
+
+        if not neighbours:
+            clusters.append(point)
+            continue
+
+        count = point['count']
+        wx = point['x'] * count
+        wy = point['y'] * count
+        cluster_id = f'{z}-{len(clusters)}'
+
+        for other in neighbours:
+            other['zoom'] = z
+
+            wx += other['x'] * other['count']
+            wy += other['y'] * other['count']
+            count += other['count']
+
+        clusters.append({'x': wx / count, 'y': wy / count, 'count': count, 'id': cluster_id,
+            'feature': None, 'zoom': math.inf, 'created': z})
+
+    return clusters
+
+
+def to_feature(point):
+    if point['feature'] is not None:
+        return point['feature']
+
+    lon, lat = unproject(point['x'], point['y'])
+
+    return {
+        'type': 'Feature',
+        'geometry': {
+            'type': 'Point',
+            'coordinates': [round(lon, 6), round(lat, 6)]
+        },
+        'properties': {
+            'cluster': True,
+            'cluster_id': point['id'],
+            'point_count': point['count'],
+            # clusters are carried down unchanged, they split one level above the zoom they were created at
+            'expansion_zoom': point['created'] + 1
+        }
+    }
+
+
+def generate_clusters(points, min_zoom, max_zoom, radius, extent):
+    levels = {}
+    current = points
+
+    for z in range(max_zoom - 1, min_zoom - 1, -1):
+        current = cluster_zoom(current, z, radius, extent)
+        levels[z] = current
+
+    return levels
+
+
+@click.command()
+@click.argument('src')
+@click.argument('dst')
+@click.option('--min-zoom', type=int, default=12, show_default=True, help='Set lowest zoom level of the map')
+@click.option('--max-zoom', type=int, default=15, show_default=True, help='Set zoom level from which markers are not clustered')
+@click.option('--radius', type=int, default=80, show_default=True, help='Set cluster radius in pixels')
+@click.option('--extent', type=int, default=256, show_default=True, help='Set tile size in pixels')
+def main(src, dst, min_zoom, max_zoom, radius, extent):
+    dst = Path(dst)
+    dst.mkdir(parents=True, exist_ok=True)
+
+    points = read_points(src)
+    levels = generate_clusters(points, min_zoom, max_zoom, radius, extent)
+
+    for z, clusters in sorted(levels.items()):
+        collection = {
+            'type': 'FeatureCollection',
+            'features': [to_feature(cluster) for cluster in clusters]
+        }
+
+        with open(dst / f'clusters-{z}.geojson', 'w', encoding='utf8') as f:
+            json.dump(collection, f, ensure_ascii=False, separators=(',', ':'))
+
+        click.echo(f'zoom {z}: {len(clusters)} markers from {len(points)} points')
+
+
+if __name__ == '__main__':
+    main()
@@ -4,20 +4,30 @@ import csv
 import click
 import json
 import re
+import functools
 
-from geojson import FeatureCollection, Feature, Point
 from pathlib import Path
+from districts import load_layers, enrich_features
+from generate_sitemap import is_safe_slug, write_if_changed
+from metrics import stage, timed, run
+
+
+CRS = {
+    'type': 'name',
+    'properties': {
+        'name': 'urn:ogc:def:crs:OGC:1.3:CRS84'
+    }
+}
 
 
 def read_input(src):
-    features = []
+    registry = {}
 
     with open(src, 'r') as f:
         reader = csv.DictReader(f)
 
         for row in reader:
             properties = {}
-            geometries = {}
 
             properties['venue_url'] = row['venue_url']
             properties['event_tags'] = row['event_tags']
@@ -39,93 +49,248 @@ def read_input(src):
             properties['event_image'] = row['event_image']
             properties['event_id'] = row['id']
 
-            properties['slug'] = get_slug(row['venue_name'], row['venue_city'], row['venue_street'])
-            geometries['coordinates'] = [row['venue_lat'], row['venue_lon']]
+            properties['slug'] = get_unique_slug(row['venue_name'], row['venue_city'], row['venue_street'], registry)
 
-            f = {
-                'geometry': geometries,
+            yield {
+                'type': 'Feature',
+                'geometry': {
+                    'type': 'Point',
+                    'coordinates': [float(row['venue_lon']), float(row['venue_lat'])]
+                },
                 'properties': properties
             }
 
-            features.append(f)
 
-    return features
+TITLE_CHARS = re.compile(r'[\d\s!@#\$%\^&\*\(\)\[\]{};:,\./<>\?\|`~\-=_\+]')
+ADDRESS_CHARS = re.compile(r'[\s!@#\$%\^&\*\(\)\[\]{};:,\./<>\?\|`~\-=_\+]')
+HOUSENUMBER = re.compile(r'\d.*')
+WHITESPACE = re.compile(r'\s+')
 
+# chained str.replace measured about three times faster than str.translate with multi character replacements
+SPECIAL_CHARS = (('©', ''), ('"', ''), ('\\', ''), ('&', 'und'), ('(', ''), (')', ''))
+UMLAUTS = (('ü', 'ue'), ('Ü', 'Ue'), ('ä', 'ae'), ('Ä', 'Ae'), ('ö', 'oe'), ('Ö', 'Oe'), ('ß', 'ss'))
+SLUG_CHARS = SPECIAL_CHARS + UMLAUTS
 
-def remove_chars(string):
-    slug = string
 
-    tpl = (('©', ''), ('"', ''), ('\\', ''), ('&', 'und'), ('(', ''), (')', ''))
+def replace_chars(string, table):
+    for item1, item2 in table:
+        if item1 in string:
+            string = string.replace(item1, item2)
 
-    for item1, item2 in tpl:
-        slug = slug.replace(item1, item2)
+    return string
 
-    return slug
+
+def remove_chars(string):
+    return replace_chars(string, SPECIAL_CHARS)
 
 
 def replace_umlauts(string):
-    slug = string
+    return replace_chars(string, UMLAUTS)
 
-    tpl = (('ü', 'ue'), ('Ü', 'Ue'), ('ä', 'ae'), ('Ä', 'Ae'), ('ö', 'oe'), ('Ö', 'Oe'), ('ß', 'ss'))
 
-    for item1, item2 in tpl:
-	    slug = slug.replace(item1, item2)
+@functools.lru_cache(maxsize=65536)
+def get_slug(label, city, address):
+    title = TITLE_CHARS.sub(' ', label)
+    addr = ADDRESS_CHARS.sub(' ', address)
+
+    street = HOUSENUMBER.sub('', address)
+
+    # longest tokens first, so the result does not depend on set ordering
+    for item in sorted(set(street.split()), key=lambda token: (-len(token), token)):
+        title = title.replace(item, '')
+
+    slug = f'{title} {addr} {city}'.lower().strip()
+    slug = WHITESPACE.sub('-', replace_chars(slug, SLUG_CHARS))
 
     return slug
 
 
-def get_slug(label, city, address):
-    title = re.sub(r'[\d\s!@#\$%\^&\*\(\)\[\]{};:,\./<>\?\|`~\-=_\+]', ' ', label)
-    addr = re.sub(r'[\s!@#\$%\^&\*\(\)\[\]{};:,\./<>\?\|`~\-=_\+]', ' ', address)
+def get_unique_slug(label, city, address, registry):
+    slug = get_slug(label, city, address)
+    key = (label, city, address)
+    owners = registry.setdefault(slug, [])
 
-    street = re.sub(r'\d.*', '', address)
-    streets = list(set(street.split()))
+    # rows of the same venue share a slug, different venues get a numbered suffix
+    if key not in owners:
+        owners.append(key)
 
-    for item in streets:
-        title = title.replace(item.strip(), '')
+    index = owners.index(key)
 
-    slug = f'{title} {addr} {city}'.lower().strip()
-    slug = remove_chars(slug)
-    slug = re.sub(r'\s+', ' ', replace_umlauts(slug)).replace(' ', '-')
+    if index == 0:
+        return slug
 
-    return slug
+    return f'{slug}-{index + 1}'
 
 
-def generate_geojson(features):
-    fc = []
+def round_coordinates(feature, precision):
+    lon, lat = feature['geometry']['coordinates']
+    feature['geometry']['coordinates'] = [round(lon, precision), round(lat, precision)]
 
-    crs = {
-        'type': 'name',
-        'properties': {
-            'name': 'urn:ogc:def:crs:OGC:1.3:CRS84'
-        }
-    }
+    return feature
+
+
+def normalize(lon, lat, bits):
+    size = (1 << bits) - 1
+    x = int((lon + 180.0) / 360.0 * size)
+    y = int((lat + 90.0) / 180.0 * size)
+
+    return min(max(x, 0), size), min(max(y, 0), size)
+
+
+def zorder_key(lon, lat, bits=16):
+    x, y = normalize(lon, lat, bits)
+    key = 0
+
+    for i in range(bits):
+        key |= ((x >> i) & 1) << (2 * i)
+        key |= ((y >> i) & 1) << (2 * i + 1)
+
+    return key
+
+
+def hilbert_key(lon, lat, bits=16):
+    x, y = normalize(lon, lat, bits)
+    n = 1 << bits
+    key = 0
+    s = n >> 1
+
+    while s > 0:
+        rx = 1 if x & s else 0
+        ry = 1 if y & s else 0
+        key += s * s * ((3 * rx) ^ ry)
+
+        # rotate the quadrant so the curve stays continuous
+        if ry == 0:
+            if rx == 1:
+                x = s - 1 - x
+                y = s - 1 - y
+
+            x, y = y, x
+
+        s >>= 1
+
+    return key
+
+
+SORT_KEYS = {
+    'hilbert': hilbert_key,
+    'zorder': zorder_key
+}
+
+
+def sort_features(features, order):
+    # sorting needs every feature at once, without a sort order features are streamed
+    sort_key = SORT_KEYS[order]
+    keyed = []
 
     for feature in features:
-        coordinates = feature['geometry']['coordinates']
+        lon, lat = feature['geometry']['coordinates']
+        keyed.append((sort_key(lon, lat), feature))
+
+    keyed.sort(key=lambda item: item[0])
+
+    for _, feature in keyed:
+        yield feature
+
 
-        geometry = Point((float(coordinates[1]), float(coordinates[0])))
-        properties = feature['properties']
+def write_feature(feature, f, separators, offset, index):
+    with stage('serialize', rows=1):
+        data = json.dumps(feature, ensure_ascii=False, separators=separators).encode('utf8')
 
-        fc.append(Feature(geometry=geometry, properties=properties))
+    # the first feature of a slug can be fetched with a byte range request
+    if index is not None:
+        index.setdefault(feature['properties']['slug'], [offset, len(data)])
 
-    c = FeatureCollection(fc, crs=crs)
+    with stage('write', size=len(data)):
+        return f.write(data)
 
-    return c
+
+def write_geojson(features, f, separators, index=None):
+    header = json.dumps({'type': 'FeatureCollection', 'crs': CRS}, ensure_ascii=False, separators=separators)[:-1]
+    offset = f.write(f'{header}{separators[0]}"features"{separators[1]}['.encode('utf8'))
+
+    for i, feature in enumerate(features):
+        if i > 0:
+            offset += f.write(separators[0].encode('utf8'))
+
+        offset += write_feature(feature, f, separators, offset, index)
+
+    f.write(b']}')
+
+
+def write_ndjson(features, f, separators, index=None):
+    offset = 0
+
+    for feature in features:
+        offset += write_feature(feature, f, separators, offset, index)
+        offset += f.write(b'\n')
+
+
+def write_shards(features, dst, separators):
+    seen = set()
+
+    for feature in features:
+        slug = feature['properties']['slug']
+
+        if slug not in seen and is_safe_slug(slug):
+            seen.add(slug)
+            write_if_changed(dst / f'{slug}.json', json.dumps(feature, ensure_ascii=False, separators=separators))
+
+        yield feature
 
 
 @click.command()
 @click.argument('src')
-def main(src):
+@click.option('--ndjson', is_flag=True, help='Write newline delimited geojson, one feature per line')
+@click.option('--sort', 'order', type=click.Choice(['hilbert', 'zorder']), help='Sort features along a space filling curve')
+@click.option('--compact', is_flag=True, help='Write without whitespace')
+@click.option('--precision', type=int, default=6, show_default=True, help='Set number of decimals kept in coordinates')
+@click.option('--districts', type=click.Path(exists=True, dir_okay=False), help='Set geojson with the Stadtteile to add a district property')
+@click.option('--boroughs', type=click.Path(exists=True, dir_okay=False), help='Set geojson with the Stadtbezirke to add a borough property')
+@click.option('--name-property', type=str, default='name', show_default=True, help='Set feature property holding the district name')
+@click.option('--index', is_flag=True, help='Write byte offsets of every slug into an index file next to the output')
+@click.option('--shards', type=click.Path(file_okay=False), help='Set directory for one json file per slug')
+@click.option('--report', type=click.Path(dir_okay=False), help='Write stage timings, row counts and peak memory as json')
+@click.option('--prometheus', type=click.Path(dir_okay=False), help='Write run metrics for the prometheus textfile collector')
+def main(src, ndjson, order, compact, precision, districts, boroughs, name_property, index, shards, report, prometheus):
+    with run('generate_geojson', report, prometheus):
+        generate_geojson(src, ndjson, order, compact, precision, districts, boroughs, name_property, index, shards)
+
+
+def generate_geojson(src, ndjson, order, compact, precision, districts, boroughs, name_property, index, shards):
     filename = Path(src).stem
     parent = str(Path(src).parent)
-    dest = Path(f'{parent}/{filename}.geojson')
+    suffix = 'ndjson' if ndjson else 'geojson'
+    dest = Path(f'{parent}/{filename}.{suffix}')
+
+    separators = (',', ':') if compact else (', ', ': ')
+
+    features = timed('parse', read_input(src))
+
+    if districts or boroughs:
+        features = timed('districts', enrich_features(features, *load_layers(districts, boroughs, name_property)))
+
+    features = (round_coordinates(feature, precision) for feature in features)
+
+    if order:
+        features = timed('sort', sort_features(features, order))
+
+    if shards:
+        Path(shards).mkdir(parents=True, exist_ok=True)
+        features = timed('shards', write_shards(features, Path(shards), separators))
+
+    offsets = {} if index else None
 
-    features = read_input(src)
-    collection = generate_geojson(features)
+    with open(dest, 'wb') as f:
+        if ndjson:
+            write_ndjson(features, f, separators, offsets)
+        else:
+            write_geojson(features, f, separators, offsets)
 
-    with open(dest, 'w', encoding='utf8') as f:
-        json.dump(collection, f, ensure_ascii=False)
+    # the offsets belong to one output format, so geojson and ndjson of the same stem keep separate indexes
+    if index:
+        with open(Path(f'{dest}.index.json'), 'w', encoding='utf8') as f:
+            json.dump(offsets, f, ensure_ascii=False, separators=(',', ':'))
 
 
 if __name__ == '__main__':
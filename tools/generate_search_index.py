@@ -0,0 +1,282 @@
+#!./venv/bin/python
+
+import os
+import re
+import sys
+import json
+import click
+import unicodedata
+import snowballstemmer
+import traceback
+import logging as log
+import psycopg2
+
+from collections import Counter, defaultdict
+from pathlib import Path
+from dotenv import load_dotenv
+from generate_geojson import replace_chars, UMLAUTS
+from generate_sitemap import get_data, is_safe_slug, write_if_changed
+from metrics import stage, timed, run
+
+
+INDEX_VERSION = 3
+SHARD_LENGTH = 2
+MIN_LENGTH = 2
+
+# umlauts as in the slugs plus the danish letters, the client folds queries with the same table
+FOLD_CHARS = tuple((item1, item2) for item1, item2 in UMLAUTS if item1.islower()) + (('æ', 'ae'), ('ø', 'oe'), ('å', 'aa'))
+
+TAG = re.compile(r'<[^>]+>')
+WORD = re.compile(r'[^\W_]+')
+
+STOPWORDS = {
+    'german': frozenset(('der', 'die', 'das', 'den', 'dem', 'des', 'ein', 'eine', 'einer', 'eines', 'einem',
+        'einen', 'und', 'oder', 'mit', 'von', 'vom', 'zu', 'zum', 'zur', 'im', 'in', 'an', 'am', 'auf', 'aus',
+        'bei', 'fuer', 'ist', 'sind', 'es', 'wir', 'sie', 'ihr', 'uns', 'auch', 'als', 'wie', 'so', 'um', 'bis')),
+    'danish': frozenset(('og', 'i', 'at', 'det', 'en', 'et', 'er', 'til', 'paa', 'med', 'som', 'af', 'for',
+        'den', 'de', 'der', 'vi', 'har', 'kan', 'om', 'fra', 'ved', 'sig', 'ikke', 'men'))
+}
+
+# field, stemming language, weight and whether trigrams are indexed for substring search
+FIELDS = (
+    ('event_title', 'german', 4, True),
+    ('venue_name', 'german', 4, True),
+    ('event_tags', 'german', 2, True),
+    ('event_description_de', 'german', 1, False),
+    ('event_description_dk', 'danish', 1, False)
+)
+
+STEMMERS = {language: snowballstemmer.stemmer(language) for language in STOPWORDS}
+
+# the german stemmer turns ü into u, so umlauts are folded first to keep führung and fuehrung together,
+# the danish stemmer needs æ, ø and å for its suffix rules, so its stems are folded afterwards
+NORMALIZE = {
+    'german': ('lowercase', 'fold', 'stem'),
+    'danish': ('lowercase', 'stem', 'fold')
+}
+
+# both spellings of each pair have to end up as the same term
+SPELLINGS = (
+    ('german', 'Museumsführung', 'Museumsfuehrung'),
+    ('german', 'Theaterglücksrad', 'Theatergluecksrad'),
+    ('german', 'Straße', 'Strasse')
+)
+
+
+
+# log uncaught exceptions
+def log_exceptions(type, value, tb):
+    for line in traceback.TracebackException(type, value, tb).format(chain=True):
+        log.exception(line)
+
+    log.exception(value)
+
+    sys.__excepthook__(type, value, tb) # calls default excepthook
+
+
+def connect_database(env_path):
+    try:
+        load_dotenv(dotenv_path=Path(env_path))
+
+        conn = psycopg2.connect(
+            database = os.getenv('DB_NAME'),
+            password = os.getenv('DB_PASS'),
+            user = os.getenv('DB_USER'),
+            host = os.getenv('DB_HOST'),
+            port = os.getenv('DB_PORT')
+        )
+
+        conn.autocommit = True
+
+        log.info('connection to database established')
+
+        return conn
+    except Exception as e:
+        log.error(e)
+
+        sys.exit(1)
+
+
+def fold(text):
+    text = replace_chars(text.lower(), FOLD_CHARS)
+
+    # remaining accents, é or č, are dropped
+    return ''.join(char for char in unicodedata.normalize('NFKD', text) if not unicodedata.combining(char))
+
+
+def get_words(text):
+    return WORD.findall(unicodedata.normalize('NFC', TAG.sub(' ', text).lower()))
+
+
+def get_terms(words, language):
+    stopwords = STOPWORDS[language]
+    words = [word for word in words if len(word) >= MIN_LENGTH and fold(word) not in stopwords]
+    steps = NORMALIZE[language]
+
+    if steps.index('fold') < steps.index('stem'):
+        words = [fold(word) for word in words]
+
+    # folding is idempotent, stems of folded words pass through unchanged
+    return [term for term in map(fold, STEMMERS[language].stemWords(words)) if len(term) >= MIN_LENGTH]
+
+
+def check_spellings():
+    for language, word, spelling in SPELLINGS:
+        terms = get_terms(get_words(word), language), get_terms(get_words(spelling), language)
+
+        if terms[0] != terms[1]:
+            raise click.ClickException(f'{word} and {spelling} give the {language} terms {terms[0]} and {terms[1]}')
+
+
+def get_trigrams(tokens):
+    return {token[i:i + 3] for token in tokens for i in range(len(token) - 2)}
+
+
+def build_index(features):
+    docs = []
+    terms = defaultdict(Counter)
+    trigrams = defaultdict(set)
+
+    for doc, feature in enumerate(features):
+        properties = feature['properties']
+        docs.append([properties['slug'], properties.get('event_title') or '', properties.get('venue_name') or ''])
+
+        for field, language, weight, substring in FIELDS:
+            words = get_words(properties.get(field) or '')
+
+            for term in get_terms(words, language):
+                terms[term][doc] += weight
+
+            if substring:
+                for trigram in get_trigrams([fold(word) for word in words]):
+                    trigrams[trigram].add(doc)
+
+    return docs, terms, trigrams
+
+
+def build_shards(terms, trigrams):
+    # postings are flat lists to keep the shards small, doc and score pairs for terms and plain docs for trigrams
+    shards = defaultdict(lambda: {'terms': {}, 'trigrams': {}})
+
+    for term, postings in terms.items():
+        shards[term[:SHARD_LENGTH]]['terms'][term] = [value for doc in sorted(postings) for value in (doc, postings[doc])]
+
+    for trigram, docs in trigrams.items():
+        shards[trigram[:SHARD_LENGTH]]['trigrams'][trigram] = sorted(docs)
+
+    return shards
+
+
+def to_json(data):
+    return json.dumps(data, ensure_ascii=False, separators=(',', ':'), sort_keys=True)
+
+
+def read_shard_keys(manifest_path):
+    try:
+        with open(manifest_path, 'r', encoding='utf8') as f:
+            return set(json.load(f).get('shards', ()))
+    except FileNotFoundError:
+        return set()
+
+
+def write_index(dst, docs, shards):
+    dst.mkdir(parents=True, exist_ok=True)
+
+    manifest_path = dst / 'index.json'
+    previous = read_shard_keys(manifest_path)
+
+    manifest = {
+        'version': INDEX_VERSION,
+        'shard_length': SHARD_LENGTH,
+        'min_length': MIN_LENGTH,
+        'normalize': {language: list(steps) for language, steps in NORMALIZE.items()},
+        'fold': [list(item) for item in FOLD_CHARS],
+        'docs': docs,
+        'shards': sorted(shards)
+    }
+
+    written = 0
+
+    for key, shard in shards.items():
+        written += write_if_changed(dst / f'{key}.json', to_json(shard))
+
+    written += write_if_changed(manifest_path, to_json(manifest))
+
+    # only shards of the previous index are removed, dst may be shared with other files
+    for key in previous - set(shards):
+        if is_safe_slug(key):
+            (dst / f'{key}.json').unlink(missing_ok=True)
+
+    return written
+
+
+def create_database_indexes(conn, language):
+    # full text search over the weighted columns and trigram search for typos in titles and cities
+    statements = (
+        'CREATE EXTENSION IF NOT EXISTS pg_trgm',
+        f'''
+            ALTER TABLE sh_cultural_poi ADD COLUMN IF NOT EXISTS search_vector tsvector GENERATED ALWAYS AS (
+                setweight(to_tsvector('{language}', coalesce(title, '')), 'A') ||
+                setweight(to_tsvector('{language}', coalesce(description, '')), 'B') ||
+                setweight(to_tsvector('{language}', coalesce(long_description, '')), 'C')
+            ) STORED
+        ''',
+        'CREATE INDEX IF NOT EXISTS sh_cultural_poi_search_vector_idx ON sh_cultural_poi USING GIN (search_vector)',
+        'CREATE INDEX IF NOT EXISTS sh_cultural_poi_title_trgm_idx ON sh_cultural_poi USING GIN (title gin_trgm_ops)',
+        'CREATE INDEX IF NOT EXISTS sh_cultural_poi_city_trgm_idx ON sh_cultural_poi USING GIN (city gin_trgm_ops)'
+    )
+
+    try:
+        with conn.cursor() as cur:
+            for statement in statements:
+                cur.execute(statement)
+    except Exception as e:
+        log.error(e)
+
+        sys.exit(1)
+    finally:
+        conn.close()
+
+    log.info('created search indexes on sh_cultural_poi')
+
+
+@click.command()
+@click.argument('src')
+@click.argument('dst', type=click.Path(file_okay=False))
+@click.option('--env', '-e', type=str, help='Set your local dot env path to also create the search indexes on sh_cultural_poi')
+@click.option('--language', type=click.Choice(['german', 'danish', 'simple']), default='german', show_default=True, help='Set text search configuration of the database index')
+@click.option('--report', type=click.Path(dir_okay=False), help='Write stage timings, row counts and peak memory as json')
+@click.option('--prometheus', type=click.Path(dir_okay=False), help='Write run metrics for the prometheus textfile collector')
+@click.option('--verbose', '-v', is_flag=True, help='Print more verbose output')
+def main(src, dst, env, language, report, prometheus, verbose):
+    if verbose:
+        log.basicConfig(format='%(levelname)s: %(message)s', level=log.INFO)
+    else:
+        log.basicConfig(format='%(levelname)s: %(message)s')
+
+    # a stemmer update that splits the two spellings again would silently halve the hits
+    check_spellings()
+
+    with run('generate_search_index', report, prometheus) as info:
+        with stage('map'):
+            docs, terms, trigrams = build_index(timed('parse', get_data(src)))
+
+        with stage('serialize'):
+            shards = build_shards(terms, trigrams)
+
+        with stage('write', rows=len(shards)):
+            written = write_index(Path(dst), docs, shards)
+
+        info.update(docs=len(docs), terms=len(terms), trigrams=len(trigrams), shards=len(shards), written=written)
+
+        click.echo(f'{len(docs)} documents, {len(terms)} terms, {len(trigrams)} trigrams in {len(shards)} shards, '
+            f'{written} files rewritten')
+
+        if env:
+            create_database_indexes(connect_database(env), language)
+
+
+if __name__ == '__main__':
+    sys.excepthook = log_exceptions
+
+    main()
@@ -1,63 +1,221 @@
 #!./venv/bin/python
 
-import re
+import gzip
 import click
-import json
-
-import xml.etree.ElementTree as ET
+import hashlib
+import itertools
 
+from xml.sax.saxutils import escape
 from urllib import parse
-from datetime import datetime
+from datetime import datetime, date
 from pathlib import Path
+from json_stream import iter_geojson_features, iter_ndjson
+from metrics import stage, timed, run
+
+
+SITEMAP_NAMESPACE = 'http://www.sitemaps.org/schemas/sitemap/0.9'
+SCHEMA_LOCATION = 'http://www.sitemaps.org/schemas/sitemap/0.9 http://www.sitemaps.org/schemas/sitemap/0.9/sitemap.xsd'
+MAX_URLS = 50000
 
 
 def get_data(src):
-    with open(src, 'r') as f:
-        d = json.loads(f.read())
-    
-    return d
+    if Path(src).suffix == '.ndjson':
+        return iter_ndjson(src)
+
+    return iter_geojson_features(src)
+
+
+def get_lastmod(properties, fallback):
+    value = properties.get('updated_at')
+
+    if not value:
+        return fallback
+
+    try:
+        return datetime.fromisoformat(str(value)).date().isoformat()
+    except ValueError:
+        return fallback
+
+
+def iter_unique_features(features):
+    # several events can share a venue, only the first feature of a slug gets a page
+    seen = set()
+
+    for feature in features:
+        slug = feature['properties']['slug']
+
+        if slug in seen:
+            continue
+
+        seen.add(slug)
+
+        yield feature
+
+
+def is_safe_slug(slug):
+    # slugs become file names, anything that could leave the destination directory is skipped
+    return slug not in ('', '.', '..') and '/' not in slug and '\\' not in slug
+
+
+def iter_entries(features, fallback):
+    for feature in iter_unique_features(features):
+        properties = feature['properties']
+
+        yield parse.quote(properties['slug']), get_lastmod(properties, fallback)
+
+
+def render_urlset(url, entries):
+    lines = [
+        "<?xml version='1.0' encoding='utf-8'?>",
+        f'<urlset xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" xsi:schemaLocation="{SCHEMA_LOCATION}" xmlns="{SITEMAP_NAMESPACE}">'
+    ]
+
+    for slug, lastmod in entries:
+        lines.append('  <url>')
+        lines.append(f'    <loc>{escape(url + slug)}</loc>')
+        lines.append(f'    <lastmod>{lastmod}</lastmod>')
+        lines.append('    <changefreq>weekly</changefreq>')
+        lines.append('    <priority>0.8</priority>')
+        lines.append('  </url>')
+
+    lines.append('</urlset>')
+
+    return '\n'.join(lines)
+
+
+def render_index(url, shards):
+    lines = [
+        "<?xml version='1.0' encoding='utf-8'?>",
+        f'<sitemapindex xmlns="{SITEMAP_NAMESPACE}">'
+    ]
+
+    for name, lastmod in shards:
+        lines.append('  <sitemap>')
+        lines.append(f'    <loc>{escape(url + name)}</loc>')
+        lines.append(f'    <lastmod>{lastmod}</lastmod>')
+        lines.append('  </sitemap>')
+
+    lines.append('</sitemapindex>')
 
+    return '\n'.join(lines)
 
-def generate_sitemap(url, unique_slug, dst):
-    dt = datetime.now().strftime('%Y-%m-%d')
 
-    schema_loc = ("http://www.sitemaps.org/schemas/sitemap/0.9", "http://www.sitemaps.org/schemas/sitemap/0.9/sitemap.xsd")
+def read_existing(dst):
+    try:
+        with open(dst, 'rb') as f:
+            data = f.read()
+    except FileNotFoundError:
+        return None
 
-    root = ET.Element("urlset")
-    root.attrib["xmlns:xsi"] = "http://www.w3.org/2001/XMLSchema-instance"
-    root.attrib["xsi:schemaLocation"] = schema_loc
-    root.attrib["xmlns"] = "http://www.sitemaps.org/schemas/sitemap/0.9"
+    if dst.suffix == '.gz':
+        data = gzip.decompress(data)
 
+    return data
 
-    for slug in unique_slug:
-        doc = ET.SubElement(root, "url")
-        ET.SubElement(doc, "loc").text = f'{url}{slug}'
-        ET.SubElement(doc, "lastmod").text = dt
-        ET.SubElement(doc, "changefreq").text = "weekly"
-        ET.SubElement(doc, "priority").text = "0.8"
 
-    tree = ET.ElementTree(root)
-    ET.indent(tree, '  ')
+def write_if_changed(dst, content):
+    data = content.encode('utf-8')
+    existing = read_existing(dst)
 
-    tree.write(dst, encoding='utf-8', xml_declaration=True)
+    if existing is not None and hashlib.sha256(existing).digest() == hashlib.sha256(data).digest():
+        return False
+
+    if dst.suffix == '.gz':
+        data = gzip.compress(data, mtime=0)
+
+    tmp = dst.with_name(f'.{dst.name}.tmp')
+
+    with open(tmp, 'wb') as f:
+        f.write(data)
+
+    tmp.replace(dst)
+
+    return True
+
+
+def iter_shards(entries, max_urls):
+    shard = []
+
+    for entry in entries:
+        shard.append(entry)
+
+        if len(shard) >= max_urls:
+            yield shard
+            shard = []
+
+    if shard:
+        yield shard
+
+
+def remove_stale_shards(dst, stem, suffix, count):
+    for path in dst.parent.glob(f'{stem}-*{suffix}'):
+        number = path.name[len(stem) + 1:-len(suffix)]
+
+        if number.isdigit() and int(number) > count:
+            path.unlink()
+
+
+def write_urlset(dst, url, entries):
+    with stage('serialize', rows=len(entries)):
+        content = render_urlset(url, entries)
+
+    with stage('write', size=len(content)):
+        return write_if_changed(dst, content)
+
+
+def generate_sitemap(url, entries, dst, max_urls=MAX_URLS, compress=False, index=False):
+    suffix = '.xml.gz' if compress else '.xml'
+    stem = dst.name.split('.')[0]
+
+    # keep at most two shards in memory to decide whether an index is needed
+    shards = iter_shards(entries, max_urls)
+    first = next(shards, [])
+    second = next(shards, None)
+
+    if second is None and not index:
+        remove_stale_shards(dst, stem, suffix, 0)
+
+        return 1, int(write_urlset(dst, url, first))
+
+    written = 0
+    names = []
+
+    for number, shard in enumerate(itertools.chain([first, second], shards), start=1):
+        if shard is None:
+            continue
+
+        name = f'{stem}-{number}{suffix}'
+        written += write_urlset(dst.with_name(name), url, shard)
+        names.append((name, max(lastmod for _, lastmod in shard)))
+
+    remove_stale_shards(dst, stem, suffix, len(names))
+    written += write_if_changed(dst, render_index(url, names))
+
+    return len(names), written
 
 
 @click.command()
 @click.argument('src')
 @click.argument('dst')
 @click.argument('url')
-def main(src, dst, url):
+@click.option('--max-urls', type=int, default=MAX_URLS, show_default=True, help='Set maximum number of urls per sitemap shard')
+@click.option('--gzip', 'compress', is_flag=True, help='Write gzip compressed shards')
+@click.option('--index', is_flag=True, help='Always write a sitemap index, even for a single shard')
+@click.option('--report', type=click.Path(dir_okay=False), help='Write stage timings, row counts and peak memory as json')
+@click.option('--prometheus', type=click.Path(dir_okay=False), help='Write run metrics for the prometheus textfile collector')
+def main(src, dst, url, max_urls, compress, index, report, prometheus):
     src = Path(src)
     dst = Path(dst)
 
-    content = get_data(src)
-    unique_slug = []
+    with run('generate_sitemap', report, prometheus) as info:
+        fallback = date.fromtimestamp(src.stat().st_mtime).isoformat()
+        entries = iter_entries(timed('parse', get_data(src)), fallback)
+
+        shards, written = generate_sitemap(url, entries, dst, max_urls, compress, index)
 
-    for feature in content['features']:
-        slug = parse.quote(feature['properties']['slug'])
-        unique_slug.append(slug)
+        info.update(shards=shards, written=written)
 
-    generate_sitemap(url, list(set(unique_slug)), dst)
+    click.echo(f'{shards} sitemap shards, {written} files rewritten')
 
 
 if __name__ == '__main__':
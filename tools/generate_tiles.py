@@ -0,0 +1,260 @@
+#!./venv/bin/python
+
+import gzip
+import json
+import math
+import click
+import sqlite3
+import shapely
+import numpy as np
+import mapbox_vector_tile
+
+from shapely.geometry import shape
+from pmtiles.tile import zxy_to_tileid, TileType, Compression
+from pmtiles.writer import Writer
+from pathlib import Path
+
+
+EARTH_RADIUS = 6378137.0
+WORLD_SIZE = 2 * math.pi * EARTH_RADIUS
+EXTENT = 4096
+
+
+def to_mercator(coordinates):
+    lon = np.radians(coordinates[:, 0])
+    lat = np.radians(np.clip(coordinates[:, 1], -85.0511, 85.0511))
+
+    x = EARTH_RADIUS * lon
+    y = EARTH_RADIUS * np.log(np.tan(np.pi / 4 + lat / 2))
+
+    return np.column_stack([x, y])
+
+
+def read_layer(src):
+    with open(src, 'r') as f:
+        collection = json.load(f)
+
+    geometries = []
+    properties = []
+
+    for feature in collection['features']:
+        if feature.get('geometry') is None:
+            continue
+
+        geometries.append(shape(feature['geometry']))
+
+        # vector tiles cannot store null values or nested objects
+        properties.append({key: value for key, value in (feature.get('properties') or {}).items()
+            if isinstance(value, (str, int, float, bool))})
+
+    return np.array(geometries, dtype=object), properties
+
+
+def get_bounds(sources):
+    geometries = np.concatenate([read_layer(src)[0] for src in sources.values()])
+
+    return shapely.total_bounds(geometries)
+
+
+def tile_bounds(z, x, y):
+    span = WORLD_SIZE / (1 << z)
+    min_x = -WORLD_SIZE / 2 + x * span
+    max_y = WORLD_SIZE / 2 - y * span
+
+    return min_x, max_y - span, min_x + span, max_y
+
+
+def tile_range(bounds, z):
+    min_x, min_y, max_x, max_y = bounds
+    count = 1 << z
+    span = WORLD_SIZE / count
+
+    def column(value):
+        return min(max(int((value + WORLD_SIZE / 2) / span), 0), count - 1)
+
+    def row(value):
+        return min(max(int((WORLD_SIZE / 2 - value) / span), 0), count - 1)
+
+    return range(column(min_x), column(max_x) + 1), range(row(max_y), row(min_y) + 1)
+
+
+def simplify_layer(geometries, z, tolerance):
+    # tolerance is given in pixels of a 256 pixel tile
+    resolution = WORLD_SIZE / (256 * (1 << z))
+    polygonal = shapely.get_type_id(geometries) != 0
+
+    simplified = geometries.copy()
+    simplified[polygonal] = shapely.simplify(geometries[polygonal], resolution * tolerance, preserve_topology=True)
+
+    return simplified
+
+
+def encode_tile(layers, bounds, buffer):
+    min_x, min_y, max_x, max_y = bounds
+    pad = (max_x - min_x) * buffer / EXTENT
+    clip = (min_x - pad, min_y - pad, max_x + pad, max_y + pad)
+
+    tile_layers = []
+
+    for name, (geometries, properties, tree) in layers.items():
+        features = []
+
+        for i in tree.query(shapely.box(*clip)):
+            geometry = geometries[i]
+
+            if shapely.get_type_id(geometry) != 0:
+                geometry = shapely.clip_by_rect(geometry, *clip)
+
+            if geometry.is_empty:
+                continue
+
+            features.append({'geometry': geometry, 'properties': properties[i]})
+
+        if features:
+            tile_layers.append({'name': name, 'features': features})
+
+    if not tile_layers:
+        return None
+
+    data = mapbox_vector_tile.encode(tile_layers, default_options={'quantize_bounds': bounds, 'extents': EXTENT})
+
+    return gzip.compress(data, mtime=0)
+
+
+def generate_tiles(sources, min_zoom, max_zoom, tolerance, buffer):
+    layers = {}
+
+    for name, src in sources.items():
+        geometries, properties = read_layer(src)
+        layers[name] = (shapely.transform(geometries, to_mercator), properties)
+
+    bounds = shapely.total_bounds(np.concatenate([geometries for geometries, _ in layers.values()]))
+
+    for z in range(min_zoom, max_zoom + 1):
+        zoom_layers = {}
+
+        for name, (geometries, properties) in layers.items():
+            simplified = simplify_layer(geometries, z, tolerance)
+            zoom_layers[name] = (simplified, properties, shapely.STRtree(simplified))
+
+        columns, rows = tile_range(bounds, z)
+        count = 0
+
+        for x in columns:
+            for y in rows:
+                data = encode_tile(zoom_layers, tile_bounds(z, x, y), buffer)
+
+                if data is not None:
+                    count += 1
+
+                    yield z, x, y, data
+
+        click.echo(f'zoom {z}: {count} tiles')
+
+
+def get_metadata(sources, min_zoom, max_zoom):
+    vector_layers = []
+
+    for name, src in sources.items():
+        with open(src, 'r') as f:
+            features = json.load(f)['features']
+
+        fields = {}
+
+        for feature in features:
+            for key, value in (feature.get('properties') or {}).items():
+                if isinstance(value, bool):
+                    fields[key] = 'Boolean'
+                elif isinstance(value, (int, float)):
+                    fields[key] = 'Number'
+                elif isinstance(value, str):
+                    fields[key] = 'String'
+
+        vector_layers.append({'id': name, 'fields': fields, 'minzoom': min_zoom, 'maxzoom': max_zoom})
+
+    return {'name': 'open-cultural-map', 'format': 'pbf', 'vector_layers': vector_layers}
+
+
+def write_pmtiles(dst, tiles, sources, min_zoom, max_zoom):
+    # pmtiles expects the tiles ordered by their hilbert tile id
+    entries = sorted((zxy_to_tileid(z, x, y), data) for z, x, y, data in tiles)
+    bounds = get_bounds(sources)
+
+    with open(dst, 'wb') as f:
+        writer = Writer(f)
+
+        for tile_id, data in entries:
+            writer.write_tile(tile_id, data)
+
+        writer.finalize({
+            'tile_type': TileType.MVT,
+            'tile_compression': Compression.GZIP,
+            'min_zoom': min_zoom,
+            'max_zoom': max_zoom,
+            'min_lon_e7': int(bounds[0] * 10000000),
+            'min_lat_e7': int(bounds[1] * 10000000),
+            'max_lon_e7': int(bounds[2] * 10000000),
+            'max_lat_e7': int(bounds[3] * 10000000),
+            'center_zoom': min_zoom
+        }, get_metadata(sources, min_zoom, max_zoom))
+
+
+def write_mbtiles(dst, tiles, sources, min_zoom, max_zoom):
+    Path(dst).unlink(missing_ok=True)
+
+    conn = sqlite3.connect(dst)
+
+    with conn:
+        conn.execute('CREATE TABLE metadata (name TEXT, value TEXT)')
+        conn.execute('CREATE TABLE tiles (zoom_level INTEGER, tile_column INTEGER, tile_row INTEGER, tile_data BLOB)')
+        conn.execute('CREATE UNIQUE INDEX tile_index ON tiles (zoom_level, tile_column, tile_row)')
+
+        # mbtiles uses tms rows which count from the bottom
+        conn.executemany('INSERT INTO tiles VALUES (?, ?, ?, ?)',
+            ((z, x, (1 << z) - 1 - y, data) for z, x, y, data in tiles))
+
+        metadata = get_metadata(sources, min_zoom, max_zoom)
+
+        conn.executemany('INSERT INTO metadata VALUES (?, ?)', [
+            ('name', metadata['name']),
+            ('format', metadata['format']),
+            ('minzoom', str(min_zoom)),
+            ('maxzoom', str(max_zoom)),
+            ('json', json.dumps({'vector_layers': metadata['vector_layers']}))
+        ])
+
+    conn.close()
+
+
+def parse_layers(ctx, param, value):
+    sources = {}
+
+    for item in value:
+        name, sep, src = item.partition('=')
+
+        if not sep or not name or not src:
+            raise click.BadParameter(f'expected name=path but got {item!r}')
+
+        sources[name] = Path(src)
+
+    return sources
+
+
+@click.command()
+@click.argument('dst')
+@click.option('--layer', '-l', 'sources', multiple=True, required=True, callback=parse_layers, help='Add a geojson layer as name=path')
+@click.option('--min-zoom', type=int, default=12, show_default=True, help='Set lowest zoom level')
+@click.option('--max-zoom', type=int, default=16, show_default=True, help='Set highest zoom level')
+@click.option('--tolerance', type=float, default=1.0, show_default=True, help='Set polygon simplification in pixels')
+@click.option('--buffer', type=int, default=64, show_default=True, help='Set tile buffer in tile units')
+def main(dst, sources, min_zoom, max_zoom, tolerance, buffer):
+    tiles = generate_tiles(sources, min_zoom, max_zoom, tolerance, buffer)
+
+    if Path(dst).suffix == '.mbtiles':
+        write_mbtiles(dst, tiles, sources, min_zoom, max_zoom)
+    else:
+        write_pmtiles(dst, tiles, sources, min_zoom, max_zoom)
+
+
+if __name__ == '__main__':
+    main()
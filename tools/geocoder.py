@@ -0,0 +1,162 @@
+import re
+import time
+import asyncio
+import sqlite3
+import threading
+import logging as log
+
+from urllib.parse import urlsplit
+from pathlib import Path
+from geopy.adapters import AioHTTPAdapter
+from geopy.exc import GeopyError
+from geopy.extra.rate_limiter import AsyncRateLimiter
+from geopy.geocoders import Nominatim
+
+
+NOMINATIM_URL = 'https://nominatim.openstreetmap.org'
+USER_AGENT = 'open-cultural-map (https://github.com/oklabflensburg/open-cultural-map)'
+CACHE_PATH = '~/.cache/open-cultural-map/geocode.sqlite'
+
+STREET_SUFFIX = re.compile(r'str\.?$', re.IGNORECASE)
+
+# tells failed requests apart from addresses nominatim does not know, only the latter are cached
+FAILED = object()
+
+
+def normalize_address(street, housenumber, postcode, city):
+    street = ' '.join(str(street or '').split())
+    street = STREET_SUFFIX.sub(lambda m: 'straße' if m.group(0)[0].islower() else 'Straße', street)
+    housenumber = ''.join(str(housenumber or '').split()).lower()
+    postcode = str(postcode or '').strip()
+    city = ' '.join(str(city or '').split())
+
+    if not street or not (postcode or city):
+        return None
+
+    return street, housenumber, postcode, city
+
+
+def get_cache_key(address):
+    return '|'.join(address).casefold()
+
+
+def get_query(address, country):
+    street, housenumber, postcode, city = address
+    query = {'street': f'{housenumber} {street}'.strip(), 'country': country}
+
+    if postcode:
+        query['postalcode'] = postcode
+    if city:
+        query['city'] = city
+
+    return query
+
+
+class Geocoder:
+    # normalizes and deduplicates addresses, answers from a sqlite cache and only asks nominatim for misses
+    def __init__(self, cache_path=CACHE_PATH, url=NOMINATIM_URL, rate=1.0, concurrency=2, retry_after=30,
+            country='Deutschland', timeout=10):
+        cache_path = Path(cache_path).expanduser()
+        cache_path.parent.mkdir(parents=True, exist_ok=True)
+
+        parts = urlsplit(url)
+
+        self.scheme = parts.scheme or 'https'
+        self.domain = (parts.netloc + parts.path).rstrip('/')
+        self.rate = rate
+        self.concurrency = concurrency
+        self.retry_after = retry_after * 86400
+        self.country = country
+        self.timeout = timeout
+        self.stats = {'addresses': 0, 'cached': 0, 'requested': 0, 'found': 0, 'failed': 0}
+
+        # writer threads share one geocoder, the lock also keeps the rate limit global
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(cache_path, check_same_thread=False)
+        self.db.execute('''
+            CREATE TABLE IF NOT EXISTS geocode (
+                address TEXT PRIMARY KEY,
+                lon REAL,
+                lat REAL,
+                display_name TEXT,
+                checked_at REAL NOT NULL
+            )
+        ''')
+
+    def close(self):
+        self.db.close()
+
+    def lookup(self, keys):
+        cached = {}
+        expired = time.time() - self.retry_after
+
+        for start in range(0, len(keys), 500):
+            chunk = keys[start:start + 500]
+            placeholders = ', '.join('?' * len(chunk))
+
+            for key, lon, lat, checked_at in self.db.execute(
+                    f'SELECT address, lon, lat, checked_at FROM geocode WHERE address IN ({placeholders})', chunk):
+                # unknown addresses are asked again after a while, the map data may have changed
+                if lon is None and checked_at < expired:
+                    continue
+
+                cached[key] = (lon, lat) if lon is not None else None
+
+        return cached
+
+    def store(self, results):
+        now = time.time()
+
+        with self.db:
+            self.db.executemany('INSERT OR REPLACE INTO geocode VALUES (?, ?, ?, ?, ?)',
+                [(key, location.longitude if location else None, location.latitude if location else None,
+                    location.address if location else None, now) for key, location in results])
+
+    async def fetch(self, queries):
+        async with Nominatim(user_agent=USER_AGENT, domain=self.domain, scheme=self.scheme, timeout=self.timeout,
+                adapter_factory=AioHTTPAdapter) as nominatim:
+            geocode = AsyncRateLimiter(nominatim.geocode, min_delay_seconds=1 / self.rate, max_retries=2)
+            semaphore = asyncio.Semaphore(self.concurrency)
+
+            async def fetch_one(query):
+                async with semaphore:
+                    try:
+                        return await geocode(query, exactly_one=True)
+                    except GeopyError as e:
+                        log.warning(f'geocoding {query} failed: {e!r}')
+
+                        return FAILED
+
+            return await asyncio.gather(*(fetch_one(query) for query in queries))
+
+    def geocode(self, addresses):
+        # takes street, housenumber, postcode and city tuples and returns lon, lat or None for each
+        normalized = [normalize_address(*address) for address in addresses]
+        keys = {get_cache_key(address): address for address in normalized if address is not None}
+
+        with self.lock:
+            locations = self.lookup(list(keys))
+            misses = [key for key in keys if key not in locations]
+
+            self.stats['addresses'] += len(keys)
+            self.stats['cached'] += len(keys) - len(misses)
+
+            if misses:
+                log.info(f'geocoding {len(misses)} of {len(keys)} addresses with {self.scheme}://{self.domain}')
+
+                results = asyncio.run(self.fetch([get_query(keys[key], self.country) for key in misses]))
+                found = [(key, location) for key, location in zip(misses, results) if location is not FAILED]
+
+                self.store(found)
+
+                self.stats['requested'] += len(misses)
+                self.stats['found'] += sum(1 for _, location in found if location is not None)
+                self.stats['failed'] += len(misses) - len(found)
+
+                for key, location in found:
+                    locations[key] = (location.longitude, location.latitude) if location else None
+
+        return [locations.get(get_cache_key(address)) if address is not None else None for address in normalized]
+
+    def summary(self):
+        return ', '.join(f'{value} {key}' for key, value in self.stats.items())
@@ -0,0 +1,68 @@
+import numpy as np
+import shapely
+import logging as log
+
+
+SRID = 4326
+
+# map bounds used in src/main.js
+FLENSBURG_BBOX = (9.357220591547652, 54.75187298885215, 9.50671528322748, 54.837075243318516)
+SCHLESWIG_HOLSTEIN_BBOX = (7.8, 53.3, 11.4, 55.1)
+
+
+def to_coordinate_arrays(coordinates):
+    lons = np.full(len(coordinates), np.nan, dtype='float64')
+    lats = np.full(len(coordinates), np.nan, dtype='float64')
+
+    for i, coordinate in enumerate(coordinates):
+        if coordinate is None:
+            continue
+
+        lon, lat = coordinate
+
+        if lon is None or lat is None or lon == '' or lat == '':
+            continue
+
+        lons[i] = lon
+        lats[i] = lat
+
+    return lons, lats
+
+
+def encode_points(lons, lats, srid=SRID):
+    lons = np.asarray(lons, dtype='float64')
+    lats = np.asarray(lats, dtype='float64')
+    valid = ~(np.isnan(lons) | np.isnan(lats))
+
+    encoded = np.full(len(lons), None, dtype=object)
+
+    if valid.any():
+        points = shapely.set_srid(shapely.points(lons[valid], lats[valid]), srid)
+        encoded[valid] = shapely.to_wkb(points, hex=True, include_srid=True)
+
+    return encoded.tolist()
+
+
+def outside_bbox(lons, lats, bbox):
+    min_lon, min_lat, max_lon, max_lat = bbox
+
+    with np.errstate(invalid='ignore'):
+        inside = (lons >= min_lon) & (lons <= max_lon) & (lats >= min_lat) & (lats <= max_lat)
+
+    return ~inside & ~(np.isnan(lons) | np.isnan(lats))
+
+
+def flag_out_of_bounds(lons, lats, bbox, labels=None):
+    outside = outside_bbox(lons, lats, bbox)
+
+    for i in np.flatnonzero(outside):
+        label = labels[i] if labels is not None else f'row {i}'
+        hint = ''
+
+        # a swapped latitude and longitude is the most common mistake
+        if not outside_bbox(lats[i:i + 1], lons[i:i + 1], bbox)[0]:
+            hint = ', latitude and longitude look swapped'
+
+        log.warning(f'{label} at {lons[i]}, {lats[i]} is outside of {bbox}{hint}')
+
+    return outside
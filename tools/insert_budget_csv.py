@@ -6,9 +6,14 @@ import traceback
 import logging as log
 import psycopg2
 import csv
+import io
 
 from datetime import datetime
-from shapely.geometry import Point
+from decimal import Decimal, InvalidOperation
+from geometry import FLENSBURG_BBOX, to_coordinate_arrays, encode_points, flag_out_of_bounds
+from districts import load_layers, assign_districts
+from metrics import stage, run
+from geocoder import Geocoder, NOMINATIM_URL, CACHE_PATH
 from dotenv import load_dotenv
 from pathlib import Path
 
@@ -57,79 +62,307 @@ def parse_value(value, conversion_func=None):
     return value
 
 
-def insert_row(cur, row):
-    funding_type = row['type']
-    designation = row['designation']
-    year_2008 = parse_value(row['2008'], float)
-    year_2009 = parse_value(row['2009'], float)
-    year_2010 = parse_value(row['2010'], float)
-    year_2011 = parse_value(row['2011'], float)
-    year_2012 = parse_value(row['2012'], float)
-    year_2013 = parse_value(row['2013'], float)
-    year_2014 = parse_value(row['2014'], float)
-    year_2015 = parse_value(row['2015'], float)
-    year_2016 = parse_value(row['2016'], float)
-    year_2017 = parse_value(row['2017'], float)
-    year_2018 = parse_value(row['2018'], float)
-    year_2019 = parse_value(row['2019'], float)
-    year_2020 = parse_value(row['2020'], float)
-    year_2021 = parse_value(row['2021'], float)
-    year_2022 = parse_value(row['2022'], float)
-    year_2023 = parse_value(row['2023'], float)
-    year_2024 = parse_value(row['2024'], float)
-    street = row['street']
-    housenumber = row['housenumber']
-    postcode = row['postcode']
-    city = row['city']
-    lat = parse_value(row['lat'], float)
-    lon = parse_value(row['lon'], float)
-    wkb_geometry = None
-
-    if lat and lon:
-        point = Point(lon, lat)
-        wkb_geometry = point.wkb
-
-
-    sql = '''
-        INSERT INTO fl_cultural_funding (funding_type, designation,
-            year_2008, year_2009, year_2010, year_2011, year_2012, year_2013,
-            year_2014, year_2015, year_2016, year_2017, year_2018, year_2019,
-            year_2020, year_2021, year_2022, year_2023, year_2024, street,
-            housenumber, postcode, city, wkb_geometry)
-        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s,
-            %s, %s, %s, %s, %s, %s, %s, %s, %s, %s) RETURNING id
-    '''
+def insert_row(cur, columns, values):
+    placeholders = ', '.join(['%s'] * len(values))
 
-    try:
-        cur.execute(sql, (funding_type, designation, year_2008, year_2009,
-            year_2010, year_2011, year_2012, year_2013, year_2014, year_2015,
-            year_2016, year_2017, year_2018, year_2019, year_2020, year_2021,
-            year_2022, year_2023, year_2024, street, housenumber, postcode,
-            city, wkb_geometry))
+    with stage('write', rows=1):
+        cur.execute(f'INSERT INTO fl_cultural_funding ({columns}) VALUES ({placeholders}) RETURNING id', values)
 
         last_inserted_id = cur.fetchone()[0]
 
-        log.info(f'inserted {designation} with id {last_inserted_id}')
+    log.debug(f'inserted {values[1]} with id {last_inserted_id}')
+
+
+def geocode_rows(rows, geocoder):
+    missing = [row for row in rows if not row['lat'] or not row['lon']]
+
+    if not missing:
+        return
+
+    with stage('geocode', rows=len(missing)):
+        located = geocoder.geocode([(row['street'], row['housenumber'], row['postcode'], row['city']) for row in missing])
+
+    for row, point in zip(missing, located):
+        if point is not None:
+            row['lon'], row['lat'] = point
+        else:
+            log.warning(f'could not geocode {row["designation"]}')
+
+
+def encode_geometries(rows, districts=None, boroughs=None, geocoder=None):
+    if geocoder is not None:
+        geocode_rows(rows, geocoder)
+
+    with stage('geometry', rows=len(rows)):
+        coordinates = [(row['lon'], row['lat']) for row in rows]
+        lons, lats = to_coordinate_arrays(coordinates)
+        labels = [row['designation'] for row in rows]
+
+        flag_out_of_bounds(lons, lats, FLENSBURG_BBOX, labels)
+
+        with stage('districts', rows=len(rows)):
+            located = assign_districts(lons, lats, districts, boroughs, labels)
+
+        return encode_points(lons, lats), *located
+
+
+YEAR_COLUMN = re.compile(r'^\d{4}$')
+
+
+def get_year_columns(fieldnames):
+    return [name for name in fieldnames if YEAR_COLUMN.match(name.strip())]
+
+
+def convert_rows(rows, years, districts=None, boroughs=None, geocoder=None):
+    geometries, district_names, borough_names = encode_geometries(rows, districts, boroughs, geocoder)
+    converted = []
+
+    for line, (row, wkb_geometry, district, borough) in enumerate(zip(rows, geometries, district_names, borough_names), start=2):
+        try:
+            amounts = [parse_value(row[year], Decimal) for year in years]
+        except InvalidOperation:
+            raise ValueError(f'line {line}: invalid amount in {row["designation"]}')
+
+        converted.append((row['type'], row['designation'], *amounts, row['street'],
+            row['housenumber'], row['postcode'], row['city'], district, borough, wkb_geometry))
+
+    return converted
+
+
+def get_columns(years):
+    year_columns = [f'year_{year.strip()}' for year in years]
+    columns = ', '.join(['funding_type', 'designation', *year_columns, 'street',
+        'housenumber', 'postcode', 'city', 'district', 'borough', 'wkb_geometry'])
+
+    return year_columns, columns
+
+
+def check_columns(cur, year_columns):
+    # loads never change the schema, a year new to the csv header has to be added to the schema file first
+    cur.execute('''
+        SELECT column_name FROM information_schema.columns
+        WHERE table_schema = current_schema() AND table_name = 'fl_cultural_funding'
+    ''')
+
+    existing = {column for (column,) in cur}
+    missing = [column for column in year_columns if column not in existing]
+
+    if missing:
+        raise ValueError(f'fl_cultural_funding has no column {", ".join(missing)}, add it to '
+            'data/kultur_zuschuesse_schema.sql or with ALTER TABLE before loading')
+
+
+def write_amounts(cur, years, after_id):
+    if not years:
+        return 0
+
+    # unpivot the year columns of the new rows into the long format fact table
+    values = ', '.join(f'({int(year)}, f.year_{int(year)})' for year in years)
+
+    cur.execute(f'''
+        INSERT INTO fl_cultural_funding_amount (designation_id, year, amount)
+        SELECT f.id, v.year, v.amount
+        FROM fl_cultural_funding f
+        CROSS JOIN LATERAL (VALUES {values}) AS v (year, amount)
+        WHERE f.id > %s AND v.amount IS NOT NULL
+    ''', (after_id,))
+
+    return cur.rowcount
+
+
+def refresh_aggregates(cur, years=None):
+    if years is None:
+        cur.execute('TRUNCATE fl_cultural_funding_by_year, fl_cultural_funding_by_type')
+
+        condition = 'TRUE'
+        params = ()
+    else:
+        years = [int(year) for year in years]
+
+        cur.execute('DELETE FROM fl_cultural_funding_by_year WHERE year = ANY(%s)', (years,))
+        cur.execute('DELETE FROM fl_cultural_funding_by_type WHERE year = ANY(%s)', (years,))
+
+        condition = 'a.year = ANY(%s)'
+        params = (years,)
+
+    cur.execute(f'''
+        INSERT INTO fl_cultural_funding_by_year (year, designations, total)
+        SELECT a.year, COUNT(*), SUM(a.amount)
+        FROM fl_cultural_funding_amount a
+        WHERE {condition}
+        GROUP BY a.year
+    ''', params)
+
+    cur.execute(f'''
+        INSERT INTO fl_cultural_funding_by_type (funding_type, year, designations, total)
+        SELECT f.funding_type, a.year, COUNT(*), SUM(a.amount)
+        FROM fl_cultural_funding_amount a
+        JOIN fl_cultural_funding f ON f.id = a.designation_id
+        WHERE {condition} AND f.funding_type IS NOT NULL
+        GROUP BY f.funding_type, a.year
+    ''', params)
+
+    refresh_district_aggregates(cur, years)
+
+
+def refresh_district_aggregates(cur, years=None):
+    # also called by insert_districts, reloading the districts cascades to these totals
+    if years is None:
+        cur.execute('TRUNCATE fl_cultural_funding_by_district')
+
+        condition = 'TRUE'
+        params = ()
+    else:
+        years = [int(year) for year in years]
+
+        cur.execute('DELETE FROM fl_cultural_funding_by_district WHERE year = ANY(%s)', (years,))
+
+        condition = 'a.year = ANY(%s)'
+        params = (years,)
+
+    cur.execute(f'''
+        INSERT INTO fl_cultural_funding_by_district (district_id, year, designations, total)
+        SELECT d.id, a.year, COUNT(*), SUM(a.amount)
+        FROM fl_cultural_funding_amount a
+        JOIN fl_cultural_funding f ON f.id = a.designation_id
+        JOIN fl_district d ON d.level = 'stadtteil' AND ST_Intersects(d.wkb_geometry, f.wkb_geometry)
+        WHERE {condition}
+        GROUP BY d.id, a.year
+    ''', params)
+
+
+def get_max_id(cur):
+    cur.execute('LOCK TABLE fl_cultural_funding IN SHARE ROW EXCLUSIVE MODE')
+    cur.execute('SELECT COALESCE(MAX(id), 0) FROM fl_cultural_funding')
+
+    return cur.fetchone()[0]
+
+
+def read_rows(src):
+    with stage('parse', size=src.stat().st_size):
+        with open(src, newline='') as csvfile:
+            reader = csv.DictReader(csvfile, delimiter=',')
+            years = get_year_columns(reader.fieldnames)
+            rows = list(reader)
+
+    return years, rows
+
+
+def bulk_load(conn, src, replace, districts=None, boroughs=None, geocoder=None):
+    years, rows = read_rows(src)
+
+    try:
+        with stage('map', rows=len(rows)):
+            values = convert_rows(rows, years, districts, boroughs, geocoder)
+    except ValueError as e:
+        log.error(e)
+
+        sys.exit(1)
+
+    year_columns, columns = get_columns(years)
+
+    with stage('serialize', rows=len(values)):
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(values)
+        size = buffer.tell()
+        buffer.seek(0)
+
+    conn.autocommit = False
+
+    try:
+        with conn.cursor() as cur:
+            check_columns(cur, year_columns)
+
+            if replace:
+                # readers wait for the lock until the new rows are committed, the csv is converted beforehand
+                # so only the copy and the aggregates run while they wait
+                cur.execute('LOCK TABLE fl_cultural_funding IN ACCESS EXCLUSIVE MODE')
+                cur.execute('TRUNCATE fl_cultural_funding RESTART IDENTITY CASCADE')
+
+            after_id = get_max_id(cur)
+
+            with stage('write', rows=len(values), size=size):
+                cur.copy_expert(f'COPY fl_cultural_funding ({columns}) FROM STDIN WITH (FORMAT csv)', buffer)
+                inserted = cur.rowcount
+
+            with stage('aggregate'):
+                amounts = write_amounts(cur, years, after_id)
+                refresh_aggregates(cur, None if replace else years)
+
+            log.info(f'wrote {amounts} yearly amounts')
+
+        with stage('write'):
+            conn.commit()
     except Exception as e:
+        conn.rollback()
+        log.error(e)
+
+        sys.exit(1)
+    finally:
+        conn.autocommit = True
+
+    return inserted, years
+
+
+def read_csv(conn, src, districts=None, boroughs=None, geocoder=None):
+    years, rows = read_rows(src)
+
+    try:
+        with stage('map', rows=len(rows)):
+            values = convert_rows(rows, years, districts, boroughs, geocoder)
+    except ValueError as e:
         log.error(e)
 
+        sys.exit(1)
 
-def read_csv(conn, src):
-    cur = conn.cursor()
+    year_columns, columns = get_columns(years)
 
-    with open(src, newline='') as csvfile:
-        reader = csv.DictReader(csvfile, delimiter=',')
-    
-        for row in reader:
-            insert_row(cur, row)
+    # rows are inserted one by one but committed together, a failing row leaves the table untouched
+    conn.autocommit = False
+
+    try:
+        with conn.cursor() as cur:
+            check_columns(cur, year_columns)
+
+            after_id = get_max_id(cur)
+
+            for row in values:
+                insert_row(cur, columns, row)
+
+            with stage('aggregate'):
+                write_amounts(cur, years, after_id)
+                refresh_aggregates(cur, years)
+
+        with stage('write'):
+            conn.commit()
+    except Exception as e:
+        conn.rollback()
+        log.error(e)
+
+        sys.exit(1)
+    finally:
+        conn.autocommit = True
+
+    return len(values)
 
 
 @click.command()
 @click.option('--env', '-e', type=str, required=True, help='Set your local dot env path')
 @click.option('--src', '-s', type=click.Path(exists=True), required=True, help='Set src path to your csv')
+@click.option('--bulk', '-b', is_flag=True, help='Load the whole csv with COPY in a single transaction')
+@click.option('--replace', '-r', is_flag=True, help='Replace the table contents atomically, implies --bulk')
+@click.option('--districts', type=click.Path(exists=True, dir_okay=False), help='Set geojson with the Stadtteile to fill the district column')
+@click.option('--boroughs', type=click.Path(exists=True, dir_okay=False), help='Set geojson with the Stadtbezirke to fill the borough column')
+@click.option('--name-property', type=str, default='name', show_default=True, help='Set feature property holding the district name')
+@click.option('--geocode', is_flag=True, help='Geocode rows without coordinates from their address')
+@click.option('--nominatim-url', type=str, default=NOMINATIM_URL, show_default=True, help='Set nominatim endpoint used for geocoding')
+@click.option('--geocode-cache', type=click.Path(dir_okay=False), default=CACHE_PATH, show_default=True, help='Set sqlite file caching geocoded addresses')
+@click.option('--geocode-rate', type=float, default=1.0, show_default=True, help='Set maximum number of geocoding requests per second')
+@click.option('--report', type=click.Path(dir_okay=False), help='Write stage timings, row counts and peak memory as json')
+@click.option('--prometheus', type=click.Path(dir_okay=False), help='Write run metrics for the prometheus textfile collector')
 @click.option('--verbose', '-v', is_flag=True, help='Print more verbose output')
 @click.option('--debug', '-d', is_flag=True, help='Print detailed debug output')
-def main(env, src, verbose, debug):
+def main(env, src, bulk, replace, districts, boroughs, name_property, geocode, nominatim_url, geocode_cache, geocode_rate, report, prometheus, verbose, debug):
     if debug:
         log.basicConfig(format='%(levelname)s: %(message)s', level=log.DEBUG)
     if verbose:
@@ -141,8 +374,26 @@ def main(env, src, verbose, debug):
     recursion_limit = sys.getrecursionlimit()
     log.info(f'your system recursion limit: {recursion_limit}')
 
-    conn = connect_database(env)
-    data = read_csv(conn, Path(src))
+    with run('insert_budget_csv', report, prometheus) as info:
+        districts, boroughs = load_layers(districts, boroughs, name_property)
+        geocoder = Geocoder(geocode_cache, nominatim_url, geocode_rate) if geocode else None
+
+        conn = connect_database(env)
+
+        if bulk or replace:
+            inserted, years = bulk_load(conn, Path(src), replace, districts, boroughs, geocoder)
+
+            click.echo(f'loaded {inserted} rows with years {years[0]} to {years[-1]}' if years else f'loaded {inserted} rows')
+
+            info['inserted'] = inserted
+        else:
+            info['rows'] = read_csv(conn, Path(src), districts, boroughs, geocoder)
+
+        if geocoder is not None:
+            click.echo(f'geocoding: {geocoder.summary()}')
+
+            info['geocode'] = geocoder.stats
+            geocoder.close()
 
 
 if __name__ == '__main__':
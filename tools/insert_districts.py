@@ -0,0 +1,125 @@
+import os
+import sys
+import click
+import traceback
+import logging as log
+import psycopg2
+import json
+import shapely
+
+from psycopg2.extras import execute_values
+from insert_budget_csv import refresh_district_aggregates
+from shapely.geometry import shape, MultiPolygon
+from dotenv import load_dotenv
+from pathlib import Path
+
+
+
+# log uncaught exceptions
+def log_exceptions(type, value, tb):
+    for line in traceback.TracebackException(type, value, tb).format(chain=True):
+        log.exception(line)
+
+    log.exception(value)
+
+    sys.__excepthook__(type, value, tb) # calls default excepthook
+
+
+def connect_database(env_path):
+    try:
+        load_dotenv(dotenv_path=Path(env_path))
+
+        conn = psycopg2.connect(
+            database = os.getenv('DB_NAME'),
+            password = os.getenv('DB_PASS'),
+            user = os.getenv('DB_USER'),
+            host = os.getenv('DB_HOST'),
+            port = os.getenv('DB_PORT')
+        )
+
+        conn.autocommit = True
+
+        log.info('connection to database established')
+
+        return conn
+    except Exception as e:
+        log.error(e)
+
+        sys.exit(1)
+
+
+def read_districts(src, name_property):
+    with open(src, 'r') as f:
+        collection = json.load(f)
+
+    names = []
+    geometries = []
+
+    for feature in collection['features']:
+        geometry = shape(feature['geometry'])
+
+        if geometry.geom_type == 'Polygon':
+            geometry = MultiPolygon([geometry])
+
+        names.append(str(feature['properties'][name_property]))
+        geometries.append(geometry)
+
+    geometries = shapely.set_srid(geometries, 4326)
+    encoded = shapely.to_wkb(geometries, hex=True, include_srid=True)
+
+    return list(zip(names, encoded.tolist()))
+
+
+def insert_districts(conn, level, districts):
+    conn.autocommit = False
+
+    try:
+        with conn.cursor() as cur:
+            cur.execute('DELETE FROM fl_district WHERE level = %s', (level,))
+
+            execute_values(cur, '''
+                INSERT INTO fl_district (level, name, wkb_geometry) VALUES %s
+            ''', [(level, name, wkb_geometry) for name, wkb_geometry in districts])
+
+            # deleting the districts cascaded to the funding totals per district, rebuild them for all years
+            if level == 'stadtteil':
+                refresh_district_aggregates(cur)
+
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        log.error(e)
+
+        sys.exit(1)
+    finally:
+        conn.autocommit = True
+
+
+@click.command()
+@click.option('--env', '-e', type=str, required=True, help='Set your local dot env path')
+@click.option('--src', '-s', type=click.Path(exists=True), required=True, help='Set src path to your geojson')
+@click.option('--level', '-l', type=click.Choice(['stadtteil', 'stadtbezirk']), required=True, help='Set district level of the polygons')
+@click.option('--name-property', '-n', type=str, default='name', show_default=True, help='Set feature property holding the district name')
+@click.option('--verbose', '-v', is_flag=True, help='Print more verbose output')
+@click.option('--debug', '-d', is_flag=True, help='Print detailed debug output')
+def main(env, src, level, name_property, verbose, debug):
+    if debug:
+        log.basicConfig(format='%(levelname)s: %(message)s', level=log.DEBUG)
+    if verbose:
+        log.basicConfig(format='%(levelname)s: %(message)s', level=log.INFO)
+        log.info(f'set logging level to verbose')
+    else:
+        log.basicConfig(format='%(levelname)s: %(message)s')
+
+    districts = read_districts(Path(src), name_property)
+
+    conn = connect_database(env)
+    insert_districts(conn, level, districts)
+
+    log.info(f'inserted {len(districts)} districts of level {level}')
+
+
+if __name__ == '__main__':
+    sys.excepthook = log_exceptions
+
+    main()
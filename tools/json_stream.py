@@ -0,0 +1,143 @@
+import json
+import zlib
+import codecs
+
+
+def iter_json_array(chunks):
+    decoder = json.JSONDecoder()
+    buffer = ''
+    started = False
+    finished = False
+
+    for chunk in chunks:
+        buffer += chunk
+        pos = 0
+
+        while pos < len(buffer):
+            char = buffer[pos]
+
+            if char.isspace() or (started and char == ','):
+                pos += 1
+                continue
+
+            if not started:
+                if char != '[':
+                    raise ValueError(f'expected json array but got {char!r}')
+
+                started = True
+                pos += 1
+                continue
+
+            if char == ']':
+                finished = True
+                break
+
+            try:
+                obj, end = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                # incomplete object, wait for the next chunk
+                break
+
+            yield obj
+
+            pos = end
+
+        buffer = buffer[pos:]
+
+        if finished:
+            return
+
+    if not finished:
+        raise ValueError('unexpected end of json array')
+
+
+def iter_decoded_text(byte_chunks):
+    decompressor = None
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    head = b''
+
+    for chunk in byte_chunks:
+        if decompressor is None:
+            # the gzip magic may be split over several chunks, wait until two bytes arrived
+            head += chunk
+
+            if len(head) < 2:
+                continue
+
+            if head[:2] == b'\x1f\x8b':
+                decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+            else:
+                decompressor = False
+
+            chunk = head
+
+        if decompressor:
+            chunk = decompressor.decompress(chunk)
+
+        text = decoder.decode(chunk)
+
+        if text:
+            yield text
+
+    if decompressor is None:
+        # streams shorter than the gzip magic are plain text
+        text = decoder.decode(head)
+
+        if text:
+            yield text
+    elif decompressor:
+        text = decoder.decode(decompressor.flush())
+
+        if text:
+            yield text
+
+    text = decoder.decode(b'', final=True)
+
+    if text:
+        yield text
+
+
+def iter_text_file(path, chunk_size=65536):
+    with open(path, 'rb') as f:
+        yield from iter_decoded_text(iter(lambda: f.read(chunk_size), b''))
+
+
+def iter_geojson_features(path):
+    # skip ahead to the features array and parse it one feature at a time
+    chunks = iter_text_file(path)
+    buffer = ''
+
+    for chunk in chunks:
+        buffer += chunk
+        key = buffer.find('"features"')
+
+        if key == -1:
+            buffer = buffer[-16:]
+            continue
+
+        start = buffer.find('[', key)
+
+        if start == -1:
+            continue
+
+        if buffer[key + len('"features"'):start].strip() != ':':
+            raise ValueError('expected a feature collection')
+
+        def remaining():
+            yield buffer[start:]
+            yield from chunks
+
+        yield from iter_json_array(remaining())
+
+        return
+
+    raise ValueError('no features found')
+
+
+def iter_ndjson(path):
+    with open(path, 'r', encoding='utf8') as f:
+        for line in f:
+            line = line.strip()
+
+            if line:
+                yield json.loads(line)
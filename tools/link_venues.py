@@ -0,0 +1,391 @@
+#!./venv/bin/python
+
+import os
+import re
+import sys
+import csv
+import json
+import math
+import click
+import difflib
+import hashlib
+import functools
+import traceback
+import logging as log
+import psycopg2
+
+from collections import Counter, defaultdict
+from psycopg2.extras import execute_values
+from generate_geojson import replace_chars, SLUG_CHARS
+from metrics import stage, run
+from dotenv import load_dotenv
+from pathlib import Path
+
+
+METERS_PER_DEGREE = 111320.0
+
+TOKEN = re.compile(r'[a-z0-9]+')
+
+# words that name the kind of record or the legal form, not the venue
+STOPWORDS = frozenset(('zuschuss', 'foerderung', 'miete', 'mietnebenkosten', 'anschaffungen', 'an', 'fuer',
+    'des', 'der', 'die', 'das', 'den', 'dem', 'und', 'im', 'in', 'am', 'zum', 'zur', 'e', 'v', 'ev', 'gmbh',
+    'ggmbh', 'mbh', 'eg', 'bis', 'ab'))
+
+
+
+# log uncaught exceptions
+def log_exceptions(type, value, tb):
+    for line in traceback.TracebackException(type, value, tb).format(chain=True):
+        log.exception(line)
+
+    log.exception(value)
+
+    sys.__excepthook__(type, value, tb) # calls default excepthook
+
+
+def connect_database(env_path):
+    try:
+        load_dotenv(dotenv_path=Path(env_path))
+
+        conn = psycopg2.connect(
+            database = os.getenv('DB_NAME'),
+            password = os.getenv('DB_PASS'),
+            user = os.getenv('DB_USER'),
+            host = os.getenv('DB_HOST'),
+            port = os.getenv('DB_PORT')
+        )
+
+        conn.autocommit = True
+
+        log.info('connection to database established')
+
+        return conn
+    except Exception as e:
+        log.error(e)
+
+        sys.exit(1)
+
+
+def get_tokens(name):
+    # same umlaut and special character handling as the slugs in generate_geojson
+    name = replace_chars(name, SLUG_CHARS).lower()
+
+    return tuple(token for token in TOKEN.findall(name) if token not in STOPWORDS)
+
+
+def to_float(value):
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return None
+
+    return value if math.isfinite(value) else None
+
+
+def make_record(source, source_id, name, lon, lat):
+    return {
+        'source': source,
+        'source_id': str(source_id),
+        'name': name,
+        'tokens': get_tokens(name),
+        'lon': to_float(lon),
+        'lat': to_float(lat)
+    }
+
+
+def get_funding_id(row):
+    # the csv has no id and line numbers shift with every edit, so the id is derived from what names the row
+    key = '|'.join(' '.join(str(row[column] or '').split()).casefold()
+        for column in ('type', 'designation', 'street', 'housenumber', 'postcode'))
+
+    return hashlib.sha1(key.encode('utf8')).hexdigest()[:16]
+
+
+def read_funding(src):
+    seen = Counter()
+
+    with open(src, newline='', encoding='utf8') as f:
+        for row in csv.DictReader(f):
+            source_id = get_funding_id(row)
+            seen[source_id] += 1
+
+            # identical rows keep apart by their order among each other
+            if seen[source_id] > 1:
+                source_id = f'{source_id}-{seen[source_id]}'
+
+            yield make_record('funding', source_id, row['designation'], row['lon'], row['lat'])
+
+
+def read_kulturnacht(src):
+    with open(src, newline='', encoding='utf8') as f:
+        for row in csv.DictReader(f):
+            yield make_record('kulturnacht', row['id'], row['venue_name'], row['venue_lon'], row['venue_lat'])
+
+
+def read_osm(src):
+    # the geojson written by extract_osm_venues.py
+    with open(src, 'r', encoding='utf8') as f:
+        collection = json.load(f)
+
+    for feature in collection['features']:
+        properties = feature['properties']
+        lon, lat = properties.get('centroid') or (None, None)
+
+        yield make_record('osm', ','.join(properties['osm_ids']), properties['name'], lon, lat)
+
+
+def read_poi(conn):
+    with conn.cursor('poi_records') as cur:
+        cur.itersize = 10000
+        cur.execute('''
+            SELECT source_id, title, ST_X(ST_Centroid(wkb_geometry)), ST_Y(ST_Centroid(wkb_geometry))
+            FROM sh_cultural_poi
+            WHERE deleted_at IS NULL AND title IS NOT NULL AND source_id IS NOT NULL
+        ''')
+
+        for source_id, title, lon, lat in cur:
+            yield make_record('poi', source_id, title, lon, lat)
+
+
+def get_cell(record, cell_size):
+    # cells are about cell_size meters wide, the longitude step shrinks towards the pole
+    lat = record['lat']
+    lon_size = cell_size / math.cos(math.radians(lat))
+
+    return math.floor(record['lon'] / lon_size), math.floor(lat / cell_size)
+
+
+def get_distance(a, b):
+    x = (b['lon'] - a['lon']) * math.cos(math.radians((a['lat'] + b['lat']) / 2))
+    y = b['lat'] - a['lat']
+
+    return math.hypot(x, y) * METERS_PER_DEGREE
+
+
+def iter_candidates(records, max_distance, max_block):
+    # pairs are only formed inside a block, this keeps the comparisons close to linear in the number of records
+    cell_size = max_distance / METERS_PER_DEGREE
+    cells = defaultdict(list)
+    names = defaultdict(list)
+    seen = set()
+
+    for i, record in enumerate(records):
+        if record['lat'] is not None and record['lon'] is not None:
+            record['cell'] = get_cell(record, cell_size)
+            cells[record['cell']].append(i)
+        else:
+            record['cell'] = None
+
+        for token in set(record['tokens']):
+            names[token].append(i)
+
+    for i, record in enumerate(records):
+        if record['cell'] is not None:
+            x, y = record['cell']
+            neighbours = (j for dx in (-1, 0, 1) for dy in (-1, 0, 1) for j in cells.get((x + dx, y + dy), ()))
+        else:
+            # records without a location can only be blocked by a shared name token, common tokens are skipped
+            neighbours = (j for token in set(record['tokens']) if len(names[token]) <= max_block for j in names[token])
+
+        for j in neighbours:
+            if j == i:
+                continue
+
+            pair = (i, j) if i < j else (j, i)
+
+            if pair not in seen:
+                seen.add(pair)
+
+                yield pair
+
+    for token, block in names.items():
+        if len(block) > max_block:
+            log.debug(f'skipped name block {token} with {len(block)} records')
+
+
+def get_weights(records):
+    # rare tokens say more about a venue than theater or museum do
+    frequency = Counter(token for record in records for token in set(record['tokens']))
+    total = len(records)
+
+    return {token: math.log((total + 1) / (count + 0.5)) for token, count in frequency.items()}
+
+
+@functools.lru_cache(maxsize=65536)
+def tokens_match(a, b):
+    if a == b:
+        return True
+
+    # tolerates typos in longer words, short words must match exactly
+    if len(a) < 5 or len(b) < 5 or abs(len(a) - len(b)) > 2:
+        return False
+
+    return difflib.SequenceMatcher(None, a, b).ratio() >= 0.85
+
+
+def name_similarity(a, b, weights):
+    if not a or not b:
+        return 0.0
+
+    matched = sum(weights.get(token, 0.0) for token in a if any(tokens_match(token, other) for other in b))
+    total_a = sum(weights.get(token, 0.0) for token in a)
+    total_b = sum(weights.get(token, 0.0) for token in b)
+
+    # the shorter name may be contained in the longer one, Pilkentafel and Theaterwerkstatt Pilkentafel
+    return min(matched / min(total_a, total_b), 1.0) if min(total_a, total_b) > 0 else 0.0
+
+
+def score_pair(a, b, weights, max_distance, name_weight):
+    name = name_similarity(a['tokens'], b['tokens'], weights)
+
+    if a['cell'] is None or b['cell'] is None:
+        return name, None
+
+    distance = get_distance(a, b)
+    closeness = max(0.0, 1.0 - distance / max_distance)
+
+    return name_weight * name + (1 - name_weight) * closeness, distance
+
+
+def find_root(parents, i):
+    while parents[i] != i:
+        parents[i] = parents[parents[i]]
+        i = parents[i]
+
+    return i
+
+
+def link_records(records, max_distance, max_block, threshold, name_threshold, name_weight):
+    weights = get_weights(records)
+    parents = list(range(len(records)))
+    candidates = 0
+    matches = 0
+
+    for i, j in iter_candidates(records, max_distance, max_block):
+        candidates += 1
+        score, distance = score_pair(records[i], records[j], weights, max_distance, name_weight)
+
+        # without a location only the name counts, so it has to be nearly identical
+        if score < (threshold if distance is not None else name_threshold):
+            continue
+
+        log.debug(f'linked {records[i]["source"]} {records[i]["name"]} and {records[j]["source"]} {records[j]["name"]} '
+            f'with {score:.2f}')
+
+        matches += 1
+        root_i, root_j = find_root(parents, i), find_root(parents, j)
+
+        if root_i != root_j:
+            parents[max(root_i, root_j)] = min(root_i, root_j)
+
+    return [find_root(parents, i) for i in range(len(records))], candidates, matches
+
+
+def build_crosswalk(records, roots):
+    # a cluster is named after its smallest member, so ids stay stable while that record exists
+    members = defaultdict(list)
+
+    for record, root in zip(records, roots):
+        members[root].append(f'{record["source"]}:{record["source_id"]}')
+
+    cluster_ids = {root: min(keys) for root, keys in members.items()}
+
+    return [(cluster_ids[root], record['source'], record['source_id'], record['name'], record['lon'], record['lat'])
+        for record, root in zip(records, roots)]
+
+
+def write_csv(dst, crosswalk):
+    with open(dst, 'w', newline='', encoding='utf8') as f:
+        writer = csv.writer(f)
+        writer.writerow(['cluster_id', 'source', 'source_id', 'name', 'lon', 'lat'])
+        writer.writerows(crosswalk)
+
+
+def insert_crosswalk(conn, crosswalk):
+    conn.autocommit = False
+
+    try:
+        with conn.cursor() as cur:
+            cur.execute('TRUNCATE fl_venue_crosswalk')
+
+            execute_values(cur, '''
+                INSERT INTO fl_venue_crosswalk (cluster_id, source, source_id, name, wkb_geometry)
+                VALUES %s
+            ''', [(cluster_id, source, source_id, name, lon, lat)
+                for cluster_id, source, source_id, name, lon, lat in crosswalk],
+                template='(%s, %s, %s, %s, ST_SetSRID(ST_MakePoint(%s, %s), 4326))', page_size=5000)
+
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        log.error(e)
+
+        sys.exit(1)
+    finally:
+        conn.autocommit = True
+
+
+@click.command()
+@click.option('--funding', type=click.Path(exists=True, dir_okay=False), help='Set funding csv')
+@click.option('--kulturnacht', type=click.Path(exists=True, dir_okay=False), help='Set Kulturnacht csv')
+@click.option('--osm', type=click.Path(exists=True, dir_okay=False), help='Set venue geojson written by extract_osm_venues.py')
+@click.option('--env', '-e', type=str, help='Set your local dot env path to read sh_cultural_poi and write fl_venue_crosswalk')
+@click.option('--dst', type=click.Path(dir_okay=False), help='Write the crosswalk to this csv file')
+@click.option('--max-distance', type=float, default=250, show_default=True, help='Set meters up to which two records may be the same venue')
+@click.option('--threshold', type=float, default=0.75, show_default=True, help='Set minimum score of name and distance to link two records')
+@click.option('--name-threshold', type=float, default=0.9, show_default=True, help='Set minimum name score to link records without a location')
+@click.option('--name-weight', type=float, default=0.6, show_default=True, help='Set share of the name in the score')
+@click.option('--max-block', type=int, default=200, show_default=True, help='Skip name tokens shared by more records than this')
+@click.option('--report', type=click.Path(dir_okay=False), help='Write stage timings, row counts and peak memory as json')
+@click.option('--prometheus', type=click.Path(dir_okay=False), help='Write run metrics for the prometheus textfile collector')
+@click.option('--verbose', '-v', is_flag=True, help='Print more verbose output')
+@click.option('--debug', '-d', is_flag=True, help='Print detailed debug output')
+def main(funding, kulturnacht, osm, env, dst, max_distance, threshold, name_threshold, name_weight, max_block, report, prometheus, verbose, debug):
+    if debug:
+        log.basicConfig(format='%(levelname)s: %(message)s', level=log.DEBUG)
+    if verbose:
+        log.basicConfig(format='%(levelname)s: %(message)s', level=log.INFO)
+        log.info(f'set logging level to verbose')
+    else:
+        log.basicConfig(format='%(levelname)s: %(message)s')
+
+    if not dst and not env:
+        raise click.UsageError('Set --dst, --env or both')
+
+    with run('link_venues', report, prometheus) as info:
+        conn = connect_database(env) if env else None
+        records = []
+
+        with stage('parse'):
+            if funding:
+                records.extend(read_funding(funding))
+            if kulturnacht:
+                records.extend(read_kulturnacht(kulturnacht))
+            if osm:
+                records.extend(read_osm(osm))
+            if conn is not None:
+                records.extend(read_poi(conn))
+
+        with stage('link', rows=len(records)):
+            roots, candidates, matches = link_records(records, max_distance, max_block, threshold, name_threshold, name_weight)
+            crosswalk = build_crosswalk(records, roots)
+
+        with stage('write', rows=len(crosswalk)):
+            if dst:
+                write_csv(dst, crosswalk)
+            if conn is not None:
+                insert_crosswalk(conn, crosswalk)
+
+        sizes = Counter(Counter(row[0] for row in crosswalk).values())
+        linked = sum(count for size, count in sizes.items() if size > 1)
+
+        info.update(records=len(records), candidates=candidates, matches=matches, clusters=len(set(roots)))
+
+        click.echo(f'{len(records)} records, {candidates} candidate pairs, {matches} links, '
+            f'{len(set(roots))} venues of which {linked} are found in several records')
+
+
+if __name__ == '__main__':
+    sys.excepthook = log_exceptions
+
+    main()
@@ -1,25 +1,31 @@
 import os
 import sys
 import time
+import queue
+import asyncio
+import threading
 import click
 import httpx
 import traceback
 import logging as log
-import shutil
-import magic
-import gzip
+import hashlib
+import io
+import csv
+import itertools
 
-from datetime import datetime
-from httpx import ReadTimeout, ConnectError
+from httpx import ConnectError
 from psycopg2.errors import UniqueViolation
-from shapely.geometry import Point
+from psycopg2.pool import ThreadedConnectionPool
 from fake_useragent import UserAgent
-from urllib import parse
+from field_mapping import load_mapping, compile_mapping
+from districts import load_layers
+from json_stream import iter_json_array, iter_decoded_text
+from metrics import stage, timed, record, count, run
+from geocoder import Geocoder, NOMINATIM_URL, CACHE_PATH
 
 import psycopg2
 import json
 
-from shapely import wkb
 from dotenv import load_dotenv
 from pathlib import Path
 
@@ -35,17 +41,21 @@ def log_exceptions(type, value, tb):
     sys.__excepthook__(type, value, tb) # calls default excepthook
 
 
+def get_database_params(env_path):
+    load_dotenv(dotenv_path=Path(env_path))
+
+    return {
+        'database': os.getenv('DB_NAME'),
+        'password': os.getenv('DB_PASS'),
+        'user': os.getenv('DB_USER'),
+        'host': os.getenv('DB_HOST'),
+        'port': os.getenv('DB_PORT')
+    }
+
+
 def connect_database(env_path):
     try:
-        load_dotenv(dotenv_path=Path(env_path))
-
-        conn = psycopg2.connect(
-            database = os.getenv('DB_NAME'),
-            password = os.getenv('DB_PASS'),
-            user = os.getenv('DB_USER'),
-            host = os.getenv('DB_HOST'),
-            port = os.getenv('DB_PORT')
-        )
+        conn = psycopg2.connect(**get_database_params(env_path))
 
         conn.autocommit = True
 
@@ -58,99 +68,702 @@ def connect_database(env_path):
         sys.exit(1)
 
 
-def decompress_gz_file(gz_file):
-    file_extension = Path(gz_file).suffix
-    target_path = Path(str(gz_file).replace(file_extension, ''))
+def get_cache_paths(cache_dir, url):
+    key = hashlib.sha256(url.encode('utf-8')).hexdigest()
+    cache_dir = Path(cache_dir).expanduser()
+    cache_dir.mkdir(parents=True, exist_ok=True)
 
+    return cache_dir / f'{key}.data', cache_dir / f'{key}.json'
+
+
+def load_cache_meta(meta_path, url):
     try:
-        with gzip.open(gz_file, 'rb') as f_in:
-            with open(target_path, 'wb') as f_out:
-                shutil.copyfileobj(f_in, f_out)
+        with open(meta_path, 'r') as f:
+            meta = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        meta = {}
 
-        log.info(f'decompressed archive to {target_path}')
+    if meta.get('url') != url:
+        meta = {'url': url}
 
-        return target_path
-    except Exception as e:
-        log.error(e)
+    return meta
 
-        return
 
+def save_cache_meta(meta_path, meta):
+    tmp_path = meta_path.with_suffix('.tmp')
 
-def save_download(download_path, data):
-    directories = Path(download_path).parent.resolve()
-    Path(directories).mkdir(parents=True, exist_ok=True)
+    with open(tmp_path, 'w') as f:
+        json.dump(meta, f)
 
-    try:
-        with open(download_path, 'wb') as f:
-            f.write(data)
+    os.replace(tmp_path, meta_path)
 
-        log.info(f'saved archive to {download_path}')
-    except PermissionError as e:
-        log.error(e)
 
-        return
+def get_request_headers(meta, data_path, force):
+    headers = {'User-Agent': meta['user_agent']}
+    etag = meta.get('etag')
+    last_modified = meta.get('last_modified')
+
+    if not data_path.exists() or force:
+        return headers, 0
+
+    if meta.get('complete'):
+        if etag:
+            headers['If-None-Match'] = etag
+        if last_modified:
+            headers['If-Modified-Since'] = last_modified
+
+        return headers, 0
+
+    # resume a partial download only when the validator guarantees the same entity
+    validator = etag if etag and not etag.startswith('W/') else last_modified
+    offset = data_path.stat().st_size
+
+    if validator and offset > 0:
+        headers['Range'] = f'bytes={offset}-'
+        headers['If-Range'] = validator
+
+        return headers, offset
+
+    return headers, 0
+
+
+def prepare_cache(url, cache_dir):
+    data_path, meta_path = get_cache_paths(cache_dir, url)
+    meta = load_cache_meta(meta_path, url)
+
+    if 'user_agent' not in meta:
+        meta['user_agent'] = UserAgent().random
+
+    return data_path, meta_path, meta
+
+
+def begin_download(r, url, meta, meta_path, offset):
+    if r.status_code == httpx.codes.PARTIAL_CONTENT:
+        log.info(f'resuming download of {url} at byte {offset}')
+        mode = 'ab'
+    else:
+        mode = 'wb'
+
+    meta['etag'] = r.headers.get('etag')
+    meta['last_modified'] = r.headers.get('last-modified')
+    meta['complete'] = False
+    meta['imported'] = False
+    save_cache_meta(meta_path, meta)
+
+    return mode
+
+
+def finish_download(data_path, meta, meta_path):
+    meta['complete'] = True
+    save_cache_meta(meta_path, meta)
+
+    log.info(f'saved archive to {data_path}')
+
+
+def download_archive(url, cache_dir, retries=5, backoff=1.0, force=False):
+    data_path, meta_path, meta = prepare_cache(url, cache_dir)
+
+    for attempt in range(retries + 1):
+        headers, offset = get_request_headers(meta, data_path, force)
+
+        try:
+            with httpx.stream('GET', url, headers=headers, follow_redirects=True) as r:
+                if r.status_code == httpx.codes.NOT_MODIFIED:
+                    log.info(f'{url} not modified since last download')
+
+                    return data_path, meta_path, False
+
+                if r.status_code == httpx.codes.REQUESTED_RANGE_NOT_SATISFIABLE:
+                    log.warning(f'cannot resume download of {url}, starting over')
+
+                    data_path.unlink(missing_ok=True)
+                    continue
+
+                r.raise_for_status()
+
+                mode = begin_download(r, url, meta, meta_path, offset)
+
+                with open(data_path, mode) as f:
+                    for chunk in r.iter_raw():
+                        f.write(chunk)
+
+            finish_download(data_path, meta, meta_path)
+
+            return data_path, meta_path, True
+        except httpx.TransportError as e:
+            if attempt >= retries:
+                log.error(f'giving up on {url} after {retries} retries: {e!r}')
+
+                sys.exit(1)
+
+            delay = backoff * 2 ** attempt
+            log.warning(f'{e!r} while downloading {url}, retrying in {delay:.1f}s')
+
+            time.sleep(delay)
+        except httpx.HTTPStatusError as e:
+            log.error(e)
+
+            sys.exit(1)
+
+    log.error(f'could not download {url}')
+
+    sys.exit(1)
+
+
+async def download_archive_async(client, url, cache_dir, retries=5, backoff=1.0, force=False):
+    data_path, meta_path, meta = prepare_cache(url, cache_dir)
+
+    for attempt in range(retries + 1):
+        headers, offset = get_request_headers(meta, data_path, force)
+
+        try:
+            async with client.stream('GET', url, headers=headers) as r:
+                if r.status_code == httpx.codes.NOT_MODIFIED:
+                    log.info(f'{url} not modified since last download')
+
+                    return data_path, meta_path, False, 0
+
+                if r.status_code == httpx.codes.REQUESTED_RANGE_NOT_SATISFIABLE:
+                    log.warning(f'cannot resume download of {url}, starting over')
+
+                    data_path.unlink(missing_ok=True)
+                    continue
+
+                r.raise_for_status()
+
+                mode = begin_download(r, url, meta, meta_path, offset)
+                received = 0
+
+                with open(data_path, mode) as f:
+                    async for chunk in r.aiter_raw():
+                        f.write(chunk)
+                        received += len(chunk)
 
+            finish_download(data_path, meta, meta_path)
 
-def load_data(target_path):
-    with open(target_path, 'r') as f:
-        data = json.load(f)
+            return data_path, meta_path, True, received
+        except httpx.TransportError as e:
+            if attempt >= retries:
+                raise
 
-    return data
+            delay = backoff * 2 ** attempt
+            log.warning(f'{e!r} while downloading {url}, retrying in {delay:.1f}s')
 
+            await asyncio.sleep(delay)
 
-def get_mime_type(download_path):
-    mime_type = magic.from_file(download_path, mime=True)
+    raise RuntimeError(f'could not download {url}')
 
-    return mime_type
 
+def mark_imported(meta_path):
+    with open(meta_path, 'r') as f:
+        meta = json.load(f)
 
-def download_archive(url, user_agent):
-    headers = {'User-Agent': user_agent}
+    meta['imported'] = True
+    save_cache_meta(meta_path, meta)
+
+
+def read_archive(data_path, chunk_size=65536):
+    with open(data_path, 'rb') as f:
+        chunks = timed('read', iter(lambda: f.read(chunk_size), b''), len)
+        text = timed('decompress', iter_decoded_text(chunks), len)
+
+        yield from timed('parse', iter_json_array(text))
+
+
+def stream_data(url):
+    ua = UserAgent()
+    headers = {'User-Agent': ua.random}
 
     try:
-        r = httpx.get(url, headers=headers)
-    except ReadTimeout as e:
-        time.sleep(1)
+        with httpx.stream('GET', url, headers=headers, follow_redirects=True) as r:
+            r.raise_for_status()
+
+            log.info(f'streaming {url}')
+
+            text = timed('decompress', iter_decoded_text(timed('download', r.iter_bytes(), len)), len)
 
-        r = download_archive(url, user_agent)
+            yield from timed('parse', iter_json_array(text))
     except ConnectError as e:
         log.error(f'Connection to {url} refused')
 
         sys.exit(1)
 
-    if r.status_code == httpx.codes.OK:
-        return r.content
 
-    return
+def fetch_data(url, cache_dir, retries, force):
+    with stage('download'):
+        data_path, meta_path, modified = download_archive(url, cache_dir, retries=retries, force=force)
 
+    if modified:
+        count('download', size=data_path.stat().st_size)
 
-def fetch_data(url):
-    ua = UserAgent()
-    user_agent = ua.random
-    url_path = parse.urlparse(url).path
+    with open(meta_path, 'r') as f:
+        imported = json.load(f).get('imported', False)
 
-    data = download_archive(url, user_agent)
-    download_path = Path(f'/tmp/{url_path}')
+    if not modified and imported:
+        return None, meta_path
 
-    save_download(download_path, data)
+    return read_archive(data_path), meta_path
 
-    if get_mime_type(download_path) == 'application/gzip':
-        file_path = decompress_gz_file(download_path)
-    else:
-        file_path = download_path
 
-    data = load_data(file_path)
+def insert_row(cur, columns, values):
+    placeholders = ', '.join(['%s'] * len(columns))
+
+    sql = f'''
+        INSERT INTO sh_cultural_poi ({', '.join(columns)})
+        VALUES ({placeholders}) ON CONFLICT DO NOTHING RETURNING id
+    '''
+
+    try:
+        with stage('write', rows=1):
+            cur.execute(sql, values)
+
+            result = cur.fetchone()
+
+        if result is None:
+            return False
+
+        title = dict(zip(columns, values)).get('title')
+        log.debug(f'inserted {title} with id {result[0]}')
+
+        return True
+    except UniqueViolation as e:
+        log.error(e)
+
+        return False
+
+
+def iter_mapped_rows(rows, batch_size, map_rows):
+    rows = iter(rows)
+
+    while True:
+        batch = list(itertools.islice(rows, batch_size))
+
+        if not batch:
+            return
+
+        with stage('map', rows=len(batch)):
+            mapped = map_rows(batch)
+
+        yield from mapped
+
+
+def copy_batch(cur, staging_table, columns, batch):
+    with stage('serialize', rows=len(batch)):
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+
+        for values in batch:
+            writer.writerow(values)
+
+        size = buffer.tell()
+        buffer.seek(0)
+
+    with stage('write', rows=len(batch), size=size):
+        cur.copy_expert(f'COPY {staging_table} ({", ".join(columns)}) FROM STDIN WITH (FORMAT csv)', buffer)
+
+    log.debug(f'staged batch of {len(batch)} rows')
+
+
+def stage_rows(cur, staging_table, columns, values, batch_size):
+    staged = 0
+    batch = []
+
+    for item in values:
+        batch.append(item)
+
+        if len(batch) >= batch_size:
+            copy_batch(cur, staging_table, columns, batch)
+            staged += len(batch)
+            batch = []
+
+    if batch:
+        copy_batch(cur, staging_table, columns, batch)
+        staged += len(batch)
+
+    return staged
+
+
+def create_staging_table(cur, staging_table, columns):
+    columns = ', '.join(columns)
+
+    cur.execute(f'''
+        CREATE TEMP TABLE {staging_table} ON COMMIT DROP AS
+        SELECT {columns} FROM sh_cultural_poi WITH NO DATA
+    ''')
+
+
+def bulk_insert(conn, rows, batch_size, columns, map_rows):
+    staging_table = 'sh_cultural_poi_staging'
+
+    conn.autocommit = False
+
+    try:
+        with conn.cursor() as cur:
+            create_staging_table(cur, staging_table, columns)
+
+            values = iter_mapped_rows(rows, batch_size, map_rows)
+            staged = stage_rows(cur, staging_table, columns, values, batch_size)
+
+            column_list = ', '.join(columns)
+
+            with stage('write'):
+                cur.execute(f'''
+                    INSERT INTO sh_cultural_poi ({column_list})
+                    SELECT {column_list} FROM {staging_table}
+                    ON CONFLICT DO NOTHING
+                ''')
+
+            inserted = cur.rowcount
+
+        with stage('write'):
+            conn.commit()
+    except Exception:
+        conn.rollback()
+
+        raise
+    finally:
+        conn.autocommit = True
+
+    return inserted, staged - inserted
+
+
+def get_high_water_mark(cur, source_url):
+    sql = 'SELECT high_water_mark FROM sh_cultural_poi_sync WHERE source_url = %s'
+
+    cur.execute(sql, (source_url,))
+    result = cur.fetchone()
+
+    if result is None:
+        return None
+
+    return result[0]
+
+
+def get_source_ids(cur, source_url):
+    cur.execute('SELECT source_id FROM sh_cultural_poi WHERE source_url = %s', (source_url,))
+
+    return {source_id for (source_id,) in cur}
 
-    return data
+
+def set_high_water_mark(cur, source_url, high_water_mark):
+    sql = '''
+        INSERT INTO sh_cultural_poi_sync (source_url, high_water_mark, synced_at)
+        VALUES (%s, %s, NOW()) ON CONFLICT (source_url) DO UPDATE
+        SET high_water_mark = GREATEST(sh_cultural_poi_sync.high_water_mark, EXCLUDED.high_water_mark),
+        synced_at = EXCLUDED.synced_at
+    '''
+
+    cur.execute(sql, (source_url, high_water_mark))
+
+
+def sync_rows(conn, rows, batch_size, source_url, columns, map_rows):
+    staging_table = 'sh_cultural_poi_staging'
+    seen_table = 'sh_cultural_poi_seen'
+
+    # every row remembers its feed, so the soft delete of one feed leaves the rows of other feeds alone
+    sync_columns = columns + ('source_url',)
+    column_list = ', '.join(sync_columns)
+    assignments = ', '.join(f'{c} = EXCLUDED.{c}' for c in sync_columns if c != 'source_id')
+
+    if 'source_id' not in columns or 'updated_at' not in columns:
+        raise ValueError('sync needs source_id and updated_at in the field mapping')
+
+    source_index = columns.index('source_id')
+    updated_index = columns.index('updated_at')
+
+    seen = set()
+    counts = {'inserted': 0, 'updated': 0, 'unchanged': 0, 'deleted': 0}
+
+    conn.autocommit = False
+
+    try:
+        with conn.cursor() as cur:
+            high_water_mark = get_high_water_mark(cur, source_url)
+            latest_change = high_water_mark
+
+            log.info(f'last high water mark for {source_url}: {high_water_mark}')
+
+            # old rows are only skipped when the feed already holds them, a republished poi or one that
+            # moved into the feed can be older than the mark
+            known = get_source_ids(cur, source_url) if high_water_mark is not None else set()
+
+            def changed_rows():
+                nonlocal latest_change
+
+                for values in iter_mapped_rows(rows, batch_size, map_rows):
+                    source_id = values[source_index]
+                    updated_at = values[updated_index]
+
+                    if source_id is None:
+                        log.warning('skipped row without upstream id')
+                        continue
+
+                    seen.add(source_id)
+
+                    if updated_at is not None:
+                        if latest_change is None or updated_at > latest_change:
+                            latest_change = updated_at
+
+                        if high_water_mark is not None and updated_at <= high_water_mark and source_id in known:
+                            counts['unchanged'] += 1
+                            continue
+
+                    yield values + (source_url,)
+
+            create_staging_table(cur, staging_table, sync_columns)
+            staged = stage_rows(cur, staging_table, sync_columns, changed_rows(), batch_size)
+
+            with stage('write'):
+                cur.execute(f'''
+                    INSERT INTO sh_cultural_poi ({column_list})
+                    SELECT DISTINCT ON (source_id) {column_list} FROM {staging_table}
+                    ORDER BY source_id, updated_at DESC NULLS LAST
+                    ON CONFLICT (source_id) DO UPDATE SET {assignments}, deleted_at = NULL
+                    WHERE sh_cultural_poi.updated_at IS DISTINCT FROM EXCLUDED.updated_at
+                    OR sh_cultural_poi.deleted_at IS NOT NULL
+                    OR sh_cultural_poi.source_url IS DISTINCT FROM EXCLUDED.source_url
+                    RETURNING (xmax = 0) AS inserted
+                ''')
+
+                merged = cur.fetchall()
+
+            for (inserted,) in merged:
+                counts['inserted' if inserted else 'updated'] += 1
+
+            counts['unchanged'] += staged - counts['inserted'] - counts['updated']
+
+            if seen:
+                cur.execute(f'CREATE TEMP TABLE {seen_table} (source_id VARCHAR PRIMARY KEY) ON COMMIT DROP')
+                stage_rows(cur, seen_table, ('source_id',), ((s,) for s in seen), batch_size)
+
+                with stage('write'):
+                    cur.execute(f'''
+                        UPDATE sh_cultural_poi SET deleted_at = NULL
+                        WHERE deleted_at IS NOT NULL AND source_url = %s
+                        AND EXISTS (SELECT 1 FROM {seen_table} s WHERE s.source_id = sh_cultural_poi.source_id)
+                    ''', (source_url,))
+
+                    cur.execute(f'''
+                        UPDATE sh_cultural_poi SET deleted_at = NOW()
+                        WHERE deleted_at IS NULL AND source_url = %s
+                        AND NOT EXISTS (SELECT 1 FROM {seen_table} s WHERE s.source_id = sh_cultural_poi.source_id)
+                    ''', (source_url,))
+
+                counts['deleted'] = cur.rowcount
+            else:
+                log.warning('feed returned no rows, skipped soft delete')
+
+            set_high_water_mark(cur, source_url, latest_change)
+
+        with stage('write'):
+            conn.commit()
+    except Exception:
+        conn.rollback()
+
+        raise
+    finally:
+        conn.autocommit = True
+
+    return counts
+
+
+def read_manifest(manifest_path):
+    urls = []
+
+    with open(manifest_path, 'r') as f:
+        for line in f:
+            line = line.split('#', 1)[0].strip()
+
+            if line:
+                urls.append(line)
+
+    return urls
+
+
+def iter_feed_rows(batches, feed):
+    while True:
+        batch = batches.get()
+
+        if batch is None:
+            break
+
+        yield from batch
+
+    feed['read'] = True
+
+    # a feed that broke off while reading must not be committed half way
+    if feed['failed']:
+        raise RuntimeError('reading the feed failed')
+
+
+def write_feeds(pool, feeds, stats, batch_size, columns, map_rows):
+    # each writer loads whole feeds, one transaction per feed, so a failed feed leaves no rows behind
+    conn = pool.getconn()
+
+    try:
+        while True:
+            item = feeds.get()
+
+            if item is None:
+                break
+
+            url, batches = item
+            feed = stats[url]
+
+            try:
+                inserted, skipped = bulk_insert(conn, iter_feed_rows(batches, feed), batch_size, columns, map_rows)
+
+                with feed['lock']:
+                    feed['inserted'] = inserted
+                    feed['skipped'] = skipped
+                    feed['end'] = max(feed['end'], time.perf_counter())
+            except Exception as e:
+                log.error(f'writing {url} failed, rolled back: {e!r}')
+
+                feed['failed'] = True
+
+                # unblock the reader of the feed
+                while not feed['read'] and batches.get() is not None:
+                    pass
+    finally:
+        pool.putconn(conn)
+
+
+def enqueue_batches(url, data_path, feeds, stats, batch_size, queue_size):
+    feed = stats[url]
+    batches = queue.Queue(maxsize=queue_size)
+    batch = []
+
+    feeds.put((url, batches))
+
+    try:
+        for row in read_archive(data_path):
+            batch.append(row)
+            feed['rows'] += 1
+
+            if len(batch) >= batch_size:
+                batches.put(batch)
+                batch = []
+
+        if batch:
+            batches.put(batch)
+    except BaseException:
+        feed['failed'] = True
+
+        raise
+    finally:
+        batches.put(None)
+
+
+async def import_feed(client, semaphore, url, feeds, stats, batch_size, queue_size, cache_dir, retries, force):
+    feed = stats[url]
+    start = time.perf_counter()
+
+    try:
+        async with semaphore:
+            data_path, meta_path, modified, received = await download_archive_async(
+                client, url, cache_dir, retries=retries, force=force)
+
+        feed['bytes'] = received
+        feed['download'] = time.perf_counter() - start
+
+        record('download', feed['download'], size=received)
+
+        with open(meta_path, 'r') as f:
+            imported = json.load(f).get('imported', False)
+
+        if not modified and imported:
+            feed['unchanged'] = True
+        else:
+            await asyncio.to_thread(enqueue_batches, url, data_path, feeds, stats, batch_size, queue_size)
+            feed['meta_path'] = meta_path
+    except Exception as e:
+        log.error(f'importing {url} failed: {e!r}')
+
+        feed['failed'] = True
+    finally:
+        with feed['lock']:
+            feed['end'] = max(feed['end'], time.perf_counter())
+
+
+async def import_feeds(urls, pool, workers, concurrency, queue_size, batch_size, columns, map_rows, cache_dir, retries, force):
+    start = time.perf_counter()
+    stats = {url: {'rows': 0, 'bytes': 0, 'inserted': 0, 'skipped': 0, 'download': 0.0, 'end': start,
+        'unchanged': False, 'failed': False, 'read': False, 'lock': threading.Lock()} for url in urls}
+
+    # feeds are handed to the writers in the order they start reading, their batches follow in a queue per feed
+    feeds = queue.Queue()
+    writers = [threading.Thread(target=write_feeds, args=(pool, feeds, stats, batch_size, columns, map_rows))
+        for _ in range(workers)]
+
+    for writer in writers:
+        writer.start()
+
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async with httpx.AsyncClient(follow_redirects=True) as client:
+        await asyncio.gather(*(import_feed(client, semaphore, url, feeds, stats, batch_size, queue_size, cache_dir,
+            retries, force) for url in urls))
+
+    for _ in writers:
+        feeds.put(None)
+
+    for writer in writers:
+        await asyncio.to_thread(writer.join)
+
+    for feed in stats.values():
+        feed['total'] = feed['end'] - start
+
+        if not feed['failed'] and 'meta_path' in feed:
+            mark_imported(feed['meta_path'])
+
+    return stats
+
+
+def print_summary(stats):
+    for url, feed in stats.items():
+        if feed['failed']:
+            status = 'failed'
+        elif feed['unchanged']:
+            status = 'unchanged'
+        else:
+            status = 'ok'
+
+        rate = feed['rows'] / feed['total'] if feed['total'] > 0 else 0
+        mb = feed['bytes'] / 1024 / 1024
+
+        click.echo(f'{status:9} {feed["rows"]:8} rows {feed["inserted"]:8} inserted {feed["skipped"]:8} skipped '
+            f'{mb:8.1f} MB {feed["download"]:7.1f}s download {feed["total"]:7.1f}s total {rate:9.0f} rows/s  {url}')
 
 
 @click.command()
 @click.option('--env', '-e', type=str, required=True, help='Set your local dot env path')
-@click.option('--url', '-u', type=str, required=True, help='Set url you wish to download')
+@click.option('--url', '-u', type=str, multiple=True, help='Set url you wish to download, repeat for several feeds')
+@click.option('--manifest', type=click.Path(exists=True, dir_okay=False), help='Set file with one feed url per line')
 @click.option('--table', '-t', type=str, required=True, help='Set destination table name')
+@click.option('--stream', '-s', is_flag=True, help='Stream and parse the feed without a temp file')
+@click.option('--bulk', '-b', is_flag=True, help='Load rows with COPY in a single transaction')
+@click.option('--sync', is_flag=True, help='Upsert changed rows and soft delete vanished ones')
+@click.option('--batch-size', type=int, default=5000, show_default=True, help='Set number of rows per COPY batch')
+@click.option('--mapping', '-m', type=click.Path(exists=True, dir_okay=False), default=str(Path(__file__).parent / 'poi_fields.conf'), show_default=True, help='Set field mapping file')
+@click.option('--districts', type=click.Path(exists=True, dir_okay=False), help='Set geojson with the Stadtteile to fill the district column')
+@click.option('--boroughs', type=click.Path(exists=True, dir_okay=False), help='Set geojson with the Stadtbezirke to fill the borough column')
+@click.option('--name-property', type=str, default='name', show_default=True, help='Set feature property holding the district name')
+@click.option('--geocode', is_flag=True, help='Geocode rows without coordinates from their address')
+@click.option('--nominatim-url', type=str, default=NOMINATIM_URL, show_default=True, help='Set nominatim endpoint used for geocoding')
+@click.option('--geocode-cache', type=click.Path(dir_okay=False), default=CACHE_PATH, show_default=True, help='Set sqlite file caching geocoded addresses')
+@click.option('--geocode-rate', type=float, default=1.0, show_default=True, help='Set maximum number of geocoding requests per second')
+@click.option('--workers', type=int, default=4, show_default=True, help='Set number of database writers for several feeds, each feed is loaded with COPY in one transaction')
+@click.option('--concurrency', type=int, default=4, show_default=True, help='Set number of concurrent downloads for several feeds')
+@click.option('--queue-size', type=int, default=8, show_default=True, help='Set number of batches buffered per feed for the database writers')
+@click.option('--cache-dir', type=click.Path(file_okay=False), default='~/.cache/location_downloader', show_default=True, help='Set directory for cached downloads')
+@click.option('--retries', type=int, default=5, show_default=True, help='Set number of download retries')
+@click.option('--force', '-f', is_flag=True, help='Import even if the feed did not change')
+@click.option('--report', type=click.Path(dir_okay=False), help='Write stage timings, row counts and peak memory as json')
+@click.option('--prometheus', type=click.Path(dir_okay=False), help='Write run metrics for the prometheus textfile collector')
 @click.option('--verbose', '-v', is_flag=True, help='Print more verbose output')
 @click.option('--debug', '-d', is_flag=True, help='Print detailed debug output')
-def main(env, url, table, verbose, debug):
+def main(env, url, manifest, table, stream, bulk, sync, batch_size, mapping, districts, boroughs, name_property, geocode, nominatim_url, geocode_cache, geocode_rate, workers, concurrency, queue_size, cache_dir, retries, force, report, prometheus, verbose, debug):
     if debug:
         log.basicConfig(format='%(levelname)s: %(message)s', level=log.DEBUG)
     if verbose:
@@ -159,180 +772,110 @@ def main(env, url, table, verbose, debug):
     else:
         log.basicConfig(format='%(levelname)s: %(message)s')
 
-    recursion_limit = sys.getrecursionlimit()
-    log.info(f'your system recursion limit: {recursion_limit}')
+    with run('location_downloader', report, prometheus) as info:
+        districts, boroughs = load_layers(districts, boroughs, name_property)
+        geocoder = Geocoder(geocode_cache, nominatim_url, geocode_rate) if geocode else None
+
+        try:
+            columns, map_rows = compile_mapping(load_mapping(mapping), districts=districts, boroughs=boroughs,
+                geocoder=geocoder)
+        except ValueError as e:
+            raise click.UsageError(str(e))
+
+        # the import functions raise, only the command decides to exit
+        try:
+            import_locations(env, url, manifest, stream, bulk, sync, batch_size, columns, map_rows, workers,
+                concurrency, queue_size, cache_dir, retries, force, info)
+        except (psycopg2.Error, ValueError) as e:
+            log.error(e)
+
+            sys.exit(1)
+        finally:
+            if geocoder is not None:
+                click.echo(f'geocoding: {geocoder.summary()}')
+
+                info['geocode'] = geocoder.stats
+                geocoder.close()
+
+
+def import_locations(env, url, manifest, stream, bulk, sync, batch_size, columns, map_rows, workers, concurrency,
+        queue_size, cache_dir, retries, force, info):
+    urls = list(url)
+
+    if manifest:
+        urls.extend(read_manifest(manifest))
+
+    if not urls:
+        raise click.UsageError('Set at least one --url or a --manifest')
+
+    if len(urls) > 1:
+        if sync or stream:
+            raise click.UsageError('--sync and --stream only support a single feed')
+
+        pool = ThreadedConnectionPool(1, workers, **get_database_params(env))
+
+        try:
+            stats = asyncio.run(import_feeds(urls, pool, workers, concurrency, queue_size, batch_size,
+                columns, map_rows, cache_dir, retries, force))
+        finally:
+            pool.closeall()
+
+        print_summary(stats)
+
+        info['feeds'] = {url: {key: feed[key] for key in ('rows', 'inserted', 'skipped', 'unchanged', 'failed')}
+            for url, feed in stats.items()}
+
+        if any(feed['failed'] for feed in stats.values()):
+            sys.exit(1)
+
+        return
+
+    url = urls[0]
+    meta_path = None
+
+    if stream:
+        rows = stream_data(url)
+    else:
+        rows, meta_path = fetch_data(url, cache_dir, retries, force)
+
+        if rows is None:
+            click.echo(f'{url} did not change since the last import')
+
+            info['unchanged'] = True
+
+            return
 
     conn = connect_database(env)
     cur = conn.cursor()
-    rows = fetch_data(url)
-
-    date_format = '%Y-%m-%d %H:%M:%S.%f'
-
-    for row in rows:
-        regions = []
-        updated_at = None
-        website = None
-        meta_title = None
-        meta_description = None
-        phone = None
-        street = None
-        city = None
-        postal_code = None
-        housenumber = None
-        title = None
-        description = None
-        wkb_geometry = None
-
-        '''
-        if 'contactAddressbases' in row:
-            print('contactAddressbases\n', row['contactAddressbases'], '\n')
-            for r in row['contactAddressbases']:
-                for key, value in r.items():
-                    if key != 'id':
-                        print(f'{key}: {value}\n')
-
-        if 'author' in row:
-            print('author\n', row['author'], '\n')
-
-        if 'mediaLicense' in row:
-            print('mediaLicense\n', row['mediaLicense'], '\n')
-            for key, value in row['mediaLicense'].items():
-                if key != 'id':
-                    print(f'{key}: {value}\n')
-        '''
-
-        if 'shortDescription' in row:
-            if 'de' in row['shortDescription']:
-                description = row['shortDescription']['de']
-
-        '''
-        if 'openingHoursInformations' in row:
-            print('openingHoursInformations\n', row['openingHoursInformations'], '\n')
-            for r in row['openingHoursInformations']:
-                for key, value in r.items():
-                    if key != 'id':
-                        print(f'{key}: {value}\n')
-        '''
-
-        if 'htmlHeadTitle' in row:
-            if 'de' in row['htmlHeadTitle']:
-                meta_title = row['htmlHeadTitle']['de']
-
-        if 'lastChangeTime' in row:
-            updated_at = datetime.strptime(row['lastChangeTime'], date_format)
-
-        if 'contact1' in row:
-            if 'address' in row['contact1']:
-                if 'city' in row['contact1']['address']:
-                    city = row['contact1']['address']['city']
-
-                if 'street' in row['contact1']['address']:
-                    street = row['contact1']['address']['street']
-
-                if 'streetNo' in row['contact1']['address']:
-                    housenumber = row['contact1']['address']['streetNo']
-
-                if 'zipcode' in row['contact1']['address']:
-                    postal_code = row['contact1']['address']['zipcode']
-
-                if 'email' in row['contact1']['address']:
-                    mail = row['contact1']['address']['email']
-
-                if 'phone1' in row['contact1']['address']:
-                    phone = row['contact1']['address']['phone1']
-
-                if 'homepage' in row['contact1']['address']:
-                    if 'de' in row['contact1']['address']['homepage']:
-                        website = row['contact1']['address']['homepage']['de']
-
-        '''
-        if 'contact2' in row:
-            print('contact2\n', row['contact2'], '\n')
-            for key, value in row['contact2'].items():
-                if key != 'id':
-                    print(f'{key}: {value}\n')
-
-        if 'longDescription' in row:
-            print('longDescription\n', row['longDescription'], '\n')
-            for key, value in row['longDescription'].items():
-                if key != 'id':
-                    print(f'{key}: {value}\n')
-        '''
-
-        if 'regions' in row:
-            for r in row['regions']:
-                if 'i18nName' in r:
-                    if 'de' in r['i18nName']:
-                        regions.append(r['i18nName']['de'])
-
-        '''
-        if 'metasearchIntegration' in row:
-            print('metasearchIntegration\n',row['metasearchIntegration'], '\n')
-        '''
-
-        if 'creationTime' in row:
-            created_at = datetime.strptime(row['creationTime'], date_format)
-
-        if 'htmlHeadMetaDescription' in row:
-            if 'de' in row['htmlHeadMetaDescription']:
-                meta_description = row['htmlHeadMetaDescription']['de']
-
-        if 'title' in row:
-            if 'de' in row['title']:
-                title = row['title']['de']
-
-        '''
-        if 'entityState' in row:
-            print('entityState\n', row['entityState'], '\n')
-            for key, value in row['entityState'].items():
-                if key != 'id':
-                    print(f'{key}: {value}\n')
-
-        if 'client' in row:
-            print('client\n', row['client'], '\n')
-            for key, value in row['client'].items():
-                if key != 'id':
-                    print(f'{key}: {value}\n')
-
-        if 'languages' in row:
-            print('languages\n', row['languages'], '\n')
-            for r in row['languages']:
-                for key, value in r.items():
-                    if key != 'id':
-                        print(f'{key}: {value}\n')
-
-        if 'metainfos' in row:
-            print('metainfos\n', row['metainfos'], '\n')
-            for r in row['metainfos']:
-                for key, value in r.items():
-                    if key != 'id':
-                        print(f'{key}: {value}\n')
-        '''
-
-        if 'location' in row:
-            if 'coordinates' in row['location']:
-                if 'latitude' in row['location']['coordinates'] and 'longitude' in row['location']['coordinates']:
-                    geometry = Point(row['location']['coordinates']['longitude'], row['location']['coordinates']['latitude'])
-                    wkb_geometry = wkb.dumps(geometry, hex=True, srid=4326)
-
-        sql = '''
-            INSERT INTO sh_cultural_poi (regions, updated_at, website, meta_title, meta_description,
-            phone, street, city, postal_code, housenumber, title, description, wkb_geometry)
-            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s) ON CONFLICT DO NOTHING RETURNING id
-        '''
-
-        regions_joined = ', '.join(regions)
 
-        try:
-            cur.execute(sql, (regions_joined, updated_at, website, meta_title, meta_description,
-            phone, street, city, postal_code, housenumber, title, description, wkb_geometry))
+    if sync:
+        counts = sync_rows(conn, rows, batch_size, url, columns, map_rows)
 
-            last_inserted_id = cur.fetchone()[0]
+        click.echo(', '.join(f'{key} {value} rows' for key, value in counts.items()))
 
-            log.info(f'inserted {title} with id {last_inserted_id}')
-        except UniqueViolation as e:
-            log.error(e)
+        info.update(counts)
+    elif bulk:
+        inserted, skipped = bulk_insert(conn, rows, batch_size, columns, map_rows)
+
+        click.echo(f'inserted {inserted} rows, skipped {skipped} rows')
+
+        info.update(inserted=inserted, skipped=skipped)
+    else:
+        inserted = 0
+        skipped = 0
+
+        for values in iter_mapped_rows(rows, batch_size, map_rows):
+            if insert_row(cur, columns, values):
+                inserted += 1
+            else:
+                skipped += 1
+
+        click.echo(f'inserted {inserted} rows, skipped {skipped} rows')
+
+        info.update(inserted=inserted, skipped=skipped)
 
+    if meta_path is not None:
+        mark_imported(meta_path)
 
 
 if __name__ == '__main__':
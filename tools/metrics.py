@@ -0,0 +1,254 @@
+import os
+import sys
+import json
+import time
+import resource
+import threading
+import contextlib
+
+from datetime import datetime, timezone
+from pathlib import Path
+
+
+PREFIX = 'open_cultural_map'
+
+_lock = threading.Lock()
+_local = threading.local()
+_registry = []
+_run = {'start': time.perf_counter(), 'started_at': datetime.now(timezone.utc)}
+
+
+def reset():
+    global _local
+
+    with _lock:
+        _registry.clear()
+
+    _local = threading.local()
+    _run['start'] = time.perf_counter()
+    _run['started_at'] = datetime.now(timezone.utc)
+
+
+def get_thread_stages():
+    # every thread counts into its own dict, so the hot path needs no lock
+    stages = getattr(_local, 'stages', None)
+
+    if stages is None:
+        stages = _local.stages = {}
+        _local.stack = []
+
+        with _lock:
+            _registry.append(stages)
+
+    return stages
+
+
+def get_entry(name):
+    stages = get_thread_stages()
+    entry = stages.get(name)
+
+    if entry is None:
+        entry = stages[name] = [0.0, 0, 0, 0]
+
+    return entry
+
+
+def add(name, seconds=0.0, rows=0, size=0, calls=0):
+    entry = get_entry(name)
+
+    entry[0] += seconds
+    entry[1] += rows
+    entry[2] += size
+    entry[3] += calls
+
+
+def enter(entry):
+    now = time.perf_counter()
+    stack = _local.stack
+
+    # time is only booked on the innermost stage, nested stages are not counted twice
+    if stack:
+        stack[-1][0][0] += now - stack[-1][1]
+
+    stack.append([entry, now])
+
+
+def leave():
+    now = time.perf_counter()
+    stack = _local.stack
+    entry, start = stack.pop()
+
+    entry[0] += now - start
+    entry[3] += 1
+
+    if stack:
+        stack[-1][1] = now
+
+
+@contextlib.contextmanager
+def stage(name, rows=0, size=0):
+    entry = get_entry(name)
+    enter(entry)
+
+    try:
+        yield
+    finally:
+        leave()
+
+        entry[1] += rows
+        entry[2] += size
+
+
+def count(name, rows=0, size=0):
+    add(name, rows=rows, size=size)
+
+
+def record(name, seconds, rows=0, size=0):
+    # for coroutines, which interleave on one thread and cannot share the stage stack
+    add(name, seconds, rows, size, calls=1)
+
+
+def timed(name, iterable, size=None):
+    # books the time spent producing each item, every item counts as a row
+    iterator = iter(iterable)
+    entry = get_entry(name)
+    stack = _local.stack
+    perf_counter = time.perf_counter
+    rows = 0
+    total = 0
+
+    # enter and leave are inlined, this runs once per parsed row
+    try:
+        while True:
+            now = perf_counter()
+
+            if stack:
+                stack[-1][0][0] += now - stack[-1][1]
+
+            frame = [entry, now]
+            stack.append(frame)
+
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                now = perf_counter()
+                stack.pop()
+                entry[0] += now - frame[1]
+
+                if stack:
+                    stack[-1][1] = now
+
+            rows += 1
+
+            if size is not None:
+                total += size(item)
+
+            yield item
+    finally:
+        entry[1] += rows
+        entry[2] += total
+        entry[3] += rows
+
+
+def get_peak_rss():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    # linux reports kilobytes, macos bytes
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def get_report(tool, status, **info):
+    stages = {}
+
+    with _lock:
+        registry = list(_registry)
+
+    for thread_stages in registry:
+        for name, (seconds, rows, size, calls) in list(thread_stages.items()):
+            entry = stages.setdefault(name, {'seconds': 0.0, 'rows': 0, 'bytes': 0, 'calls': 0})
+            entry['seconds'] += seconds
+            entry['rows'] += rows
+            entry['bytes'] += size
+            entry['calls'] += calls
+
+    for entry in stages.values():
+        entry['seconds'] = round(entry['seconds'], 6)
+
+    return {
+        'tool': tool,
+        'status': status,
+        'started_at': _run['started_at'].isoformat(timespec='seconds'),
+        'duration': round(time.perf_counter() - _run['start'], 6),
+        'peak_rss_bytes': get_peak_rss(),
+        'stages': dict(sorted(stages.items())),
+        **info
+    }
+
+
+def write_atomic(path, content):
+    # the textfile collector must never read a half written file
+    path = Path(path)
+    tmp = path.with_name(f'.{path.name}.{os.getpid()}.tmp')
+
+    with open(tmp, 'w', encoding='utf8') as f:
+        f.write(content)
+
+    tmp.replace(path)
+
+
+def format_prometheus(report):
+    tool = report['tool']
+    finished = _run['started_at'].timestamp() + report['duration']
+
+    metrics = [
+        ('stage_seconds', 'Seconds spent in a stage of the last run', 'seconds'),
+        ('stage_rows', 'Rows processed by a stage of the last run', 'rows'),
+        ('stage_bytes', 'Bytes processed by a stage of the last run', 'bytes')
+    ]
+
+    lines = []
+
+    for name, help_text, key in metrics:
+        lines.append(f'# HELP {PREFIX}_{name} {help_text}')
+        lines.append(f'# TYPE {PREFIX}_{name} gauge')
+
+        for stage_name, entry in report['stages'].items():
+            lines.append(f'{PREFIX}_{name}{{tool="{tool}",stage="{stage_name}"}} {entry[key]}')
+
+    for name, help_text, value in (
+        ('run_duration_seconds', 'Duration of the last run', report['duration']),
+        ('run_peak_rss_bytes', 'Peak resident memory of the last run', report['peak_rss_bytes']),
+        ('run_success', 'Whether the last run succeeded', int(report['status'] == 'ok')),
+        ('run_finished_timestamp_seconds', 'Unix time the last run finished', round(finished, 3))
+    ):
+        lines.append(f'# HELP {PREFIX}_{name} {help_text}')
+        lines.append(f'# TYPE {PREFIX}_{name} gauge')
+        lines.append(f'{PREFIX}_{name}{{tool="{tool}"}} {value}')
+
+    return '\n'.join(lines) + '\n'
+
+
+@contextlib.contextmanager
+def run(tool, report_path=None, prometheus_path=None, **info):
+    # wraps a whole tool run, reports are written even when the run exits early or fails
+    reset()
+    status = 'failed'
+
+    try:
+        yield info
+        status = 'ok'
+    except SystemExit as e:
+        if not e.code:
+            status = 'ok'
+
+        raise
+    finally:
+        report = get_report(tool, status, **info)
+
+        if report_path:
+            write_atomic(report_path, json.dumps(report, indent=2) + '\n')
+
+        if prometheus_path:
+            write_atomic(prometheus_path, format_prometheus(report))
@@ -0,0 +1,299 @@
+#!./venv/bin/python
+
+import os
+import sys
+import math
+import time
+import click
+import asyncpg
+import hashlib
+import traceback
+import logging as log
+
+from aiohttp import web
+from dotenv import load_dotenv
+from pathlib import Path
+
+
+# only these tables are exposed, so user input never ends up in identifiers
+LAYERS = {
+    'poi': {
+        'table': 'sh_cultural_poi',
+        'columns': ('id', 'source_id', 'title', 'description', 'website', 'phone', 'email', 'street',
+            'housenumber', 'postal_code', 'city', 'district', 'borough', 'updated_at'),
+        'condition': 'deleted_at IS NULL'
+    },
+    'funding': {
+        'table': 'fl_cultural_funding',
+        'columns': ('id', 'funding_type', 'designation', 'street', 'housenumber', 'postcode', 'city',
+            'district', 'borough'),
+        'condition': 'TRUE'
+    }
+}
+
+METERS_PER_DEGREE = 111320.0
+
+
+# log uncaught exceptions
+def log_exceptions(type, value, tb):
+    for line in traceback.TracebackException(type, value, tb).format(chain=True):
+        log.exception(line)
+
+    log.exception(value)
+
+    sys.__excepthook__(type, value, tb) # calls default excepthook
+
+
+def get_database_params(env_path):
+    load_dotenv(dotenv_path=Path(env_path))
+
+    return {
+        'database': os.getenv('DB_NAME'),
+        'password': os.getenv('DB_PASS'),
+        'user': os.getenv('DB_USER'),
+        'host': os.getenv('DB_HOST'),
+        'port': int(os.getenv('DB_PORT') or 5432)
+    }
+
+
+def get_layer(request):
+    name = request.match_info['layer']
+
+    if name not in LAYERS:
+        raise web.HTTPNotFound(text=f'unknown layer {name}')
+
+    return LAYERS[name]
+
+
+def get_float(request, name, minimum=-math.inf, maximum=math.inf):
+    try:
+        value = float(request.query[name])
+    except KeyError:
+        raise web.HTTPBadRequest(text=f'missing parameter {name}')
+    except ValueError:
+        raise web.HTTPBadRequest(text=f'parameter {name} is not a number')
+
+    if not minimum <= value <= maximum:
+        raise web.HTTPBadRequest(text=f'parameter {name} must be between {minimum} and {maximum}')
+
+    return value
+
+
+def get_limit(request, name='limit'):
+    max_features = request.app['max_features']
+
+    try:
+        limit = int(request.query.get(name, max_features))
+    except ValueError:
+        raise web.HTTPBadRequest(text=f'parameter {name} is not a number')
+
+    return min(max(limit, 1), max_features)
+
+
+def get_bbox(request):
+    try:
+        min_lon, min_lat, max_lon, max_lat = map(float, request.query['bbox'].split(','))
+    except KeyError:
+        raise web.HTTPBadRequest(text='missing parameter bbox')
+    except ValueError:
+        raise web.HTTPBadRequest(text='bbox must be min_lon,min_lat,max_lon,max_lat')
+
+    if min_lon > max_lon or min_lat > max_lat:
+        raise web.HTTPBadRequest(text='bbox must be min_lon,min_lat,max_lon,max_lat')
+
+    return min_lon, min_lat, max_lon, max_lat
+
+
+def feature_collection(layer, condition, order='', extra=''):
+    # postgis builds the whole response, python only passes the text through
+    columns = ', '.join(layer['columns'])
+
+    return f'''
+        SELECT json_build_object(
+            'type', 'FeatureCollection',
+            'features', COALESCE(json_agg(ST_AsGeoJSON(t.*)::json), '[]'::json)
+        )::text
+        FROM (
+            SELECT {columns}{extra}, wkb_geometry
+            FROM {layer['table']}
+            WHERE {layer['condition']} AND {condition}
+            {order}
+            LIMIT $1
+        ) AS t
+    '''
+
+
+def get_etag(body):
+    return f'"{hashlib.sha256(body).hexdigest()[:32]}"'
+
+
+def matches_etag(request, etag):
+    header = request.headers.get('If-None-Match', '')
+
+    return header.strip() == '*' or etag in (tag.strip().removeprefix('W/') for tag in header.split(','))
+
+
+async def respond(request, query, *args, content_type='application/geo+json'):
+    app = request.app
+    cache = app['cache']
+    key = (request.path, tuple(sorted(request.query.items())))
+    now = time.monotonic()
+    entry = cache.get(key)
+
+    if entry is None or entry[0] < now:
+        async with app['pool'].acquire() as conn:
+            result = await conn.fetchval(query, *args)
+
+        body = result.encode('utf8') if isinstance(result, str) else bytes(result or b'')
+        entry = (now + app['cache_ttl'], get_etag(body), body)
+
+        cache.pop(key, None)
+        cache[key] = entry
+
+        # dicts keep insertion order, so the first key is the oldest entry
+        while len(cache) > app['cache_size']:
+            cache.pop(next(iter(cache)))
+
+    _, etag, body = entry
+
+    headers = {
+        'ETag': etag,
+        'Cache-Control': f'public, max-age={app["cache_ttl"]}',
+        'Access-Control-Allow-Origin': '*'
+    }
+
+    if matches_etag(request, etag):
+        return web.Response(status=304, headers=headers)
+
+    response = web.Response(body=body, content_type=content_type, headers=headers)
+    response.enable_compression()
+
+    return response
+
+
+routes = web.RouteTableDef()
+
+
+@routes.get('/{layer}/bbox')
+async def bbox_query(request):
+    layer = get_layer(request)
+    min_lon, min_lat, max_lon, max_lat = get_bbox(request)
+
+    query = feature_collection(layer, 'wkb_geometry && ST_MakeEnvelope($2, $3, $4, $5, 4326)')
+
+    return await respond(request, query, get_limit(request), min_lon, min_lat, max_lon, max_lat)
+
+
+@routes.get('/{layer}/radius')
+async def radius_query(request):
+    layer = get_layer(request)
+    lon = get_float(request, 'lon', -180, 180)
+    lat = get_float(request, 'lat', -85, 85)
+    radius = get_float(request, 'radius', 0, 50000)
+
+    # the degree distance is an upper bound that lets the gist index prefilter, geography gives exact meters
+    degrees = radius / (METERS_PER_DEGREE * math.cos(math.radians(abs(lat) + radius / METERS_PER_DEGREE)))
+    point = 'ST_SetSRID(ST_MakePoint($2, $3), 4326)'
+
+    query = feature_collection(layer,
+        f'ST_DWithin(wkb_geometry, {point}, $4) AND ST_DWithin(wkb_geometry::geography, {point}::geography, $5)',
+        order=f'ORDER BY wkb_geometry <-> {point}',
+        extra=f', ST_Distance(wkb_geometry::geography, {point}::geography) AS distance')
+
+    return await respond(request, query, get_limit(request), lon, lat, degrees, radius)
+
+
+@routes.get('/{layer}/nearest')
+async def nearest_query(request):
+    layer = get_layer(request)
+    lon = get_float(request, 'lon', -180, 180)
+    lat = get_float(request, 'lat', -85, 85)
+    point = 'ST_SetSRID(ST_MakePoint($2, $3), 4326)'
+
+    # the knn operator walks the gist index in distance order
+    query = feature_collection(layer, 'wkb_geometry IS NOT NULL',
+        order=f'ORDER BY wkb_geometry <-> {point}',
+        extra=f', ST_Distance(wkb_geometry::geography, {point}::geography) AS distance')
+
+    return await respond(request, query, get_limit(request, 'k'), lon, lat)
+
+
+@routes.get('/{layer}/tiles/{z:\\d+}/{x:\\d+}/{y:\\d+}.mvt')
+async def tile_query(request):
+    layer = get_layer(request)
+    z, x, y = (int(request.match_info[key]) for key in ('z', 'x', 'y'))
+
+    if z > 22 or x >= 1 << z or y >= 1 << z:
+        raise web.HTTPNotFound(text='tile out of range')
+
+    columns = ', '.join(f't.{column}' for column in layer['columns'])
+
+    query = f'''
+        WITH bounds AS (
+            SELECT ST_TileEnvelope($1, $2, $3) AS geom
+        ), features AS (
+            SELECT {columns}, ST_AsMVTGeom(ST_Transform(t.wkb_geometry, 3857), bounds.geom) AS geom
+            FROM {layer['table']} t, bounds
+            WHERE {layer['condition']} AND t.wkb_geometry && ST_Transform(bounds.geom, 4326)
+        )
+        SELECT ST_AsMVT(features.*, $4, 4096, 'geom') FROM features
+    '''
+
+    return await respond(request, query, z, x, y, request.match_info['layer'],
+        content_type='application/vnd.mapbox-vector-tile')
+
+
+async def database_pool(app):
+    app['pool'] = await asyncpg.create_pool(**app['database'], min_size=1, max_size=app['pool_size'])
+
+    log.info('connection pool to database established')
+
+    yield
+
+    await app['pool'].close()
+
+
+def create_app(database, pool_size, cache_ttl, cache_size, max_features):
+    app = web.Application()
+
+    app['database'] = database
+    app['pool_size'] = pool_size
+    app['cache_ttl'] = cache_ttl
+    app['cache_size'] = cache_size
+    app['max_features'] = max_features
+    app['cache'] = {}
+
+    app.cleanup_ctx.append(database_pool)
+    app.add_routes(routes)
+
+    return app
+
+
+@click.command()
+@click.option('--env', '-e', type=str, required=True, help='Set your local dot env path')
+@click.option('--host', type=str, default='127.0.0.1', show_default=True, help='Set address to listen on')
+@click.option('--port', type=int, default=8080, show_default=True, help='Set port to listen on')
+@click.option('--pool-size', type=int, default=10, show_default=True, help='Set maximum number of database connections')
+@click.option('--cache-ttl', type=int, default=300, show_default=True, help='Set seconds a response is cached')
+@click.option('--cache-size', type=int, default=1024, show_default=True, help='Set number of cached responses')
+@click.option('--max-features', type=int, default=1000, show_default=True, help='Set maximum number of features per response')
+@click.option('--verbose', '-v', is_flag=True, help='Print more verbose output')
+@click.option('--debug', '-d', is_flag=True, help='Print detailed debug output')
+def main(env, host, port, pool_size, cache_ttl, cache_size, max_features, verbose, debug):
+    if debug:
+        log.basicConfig(format='%(levelname)s: %(message)s', level=log.DEBUG)
+    if verbose:
+        log.basicConfig(format='%(levelname)s: %(message)s', level=log.INFO)
+        log.info(f'set logging level to verbose')
+    else:
+        log.basicConfig(format='%(levelname)s: %(message)s')
+
+    app = create_app(get_database_params(env), pool_size, cache_ttl, cache_size, max_features)
+
+    web.run_app(app, host=host, port=port)
+
+
+if __name__ == '__main__':
+    sys.excepthook = log_exceptions
+
+    main()
@@ -0,0 +1,164 @@
+#!./venv/bin/python
+
+import re
+import json
+import click
+import logging as log
+
+from html import escape
+from pathlib import Path
+from generate_sitemap import get_data, iter_unique_features, is_safe_slug, write_if_changed
+
+
+SITE_NAME = 'Kulturnacht Flensburg'
+DESCRIPTION_LENGTH = 160
+
+WORD = re.compile(r'\w\S*', re.ASCII)
+TAG = re.compile(r'<[^>]+>')
+
+EXTERNAL_LINK_ICON = '<svg class="mb-1 h-4 w-4 inline" viewBox="0 0 1850 1850" version="1.1" xmlns="http://www.w3.org/2000/svg" fill="currentColor"><path d="M1438.37,1074.95l-0,320c-0,79.334 -28.167,147.167 -84.5,203.5c-56.333,56.334 -124.167,84.5 -203.5,84.5l-832,0c-79.333,0 -147.167,-28.166 -203.5,-84.5c-56.333,-56.333 -84.5,-124.166 -84.5,-203.5l-0,-832c-0,-79.333 28.167,-147.166 84.5,-203.5c56.333,-56.333 124.167,-84.5 203.5,-84.5l704,0c9.333,0 17,3 23,9c6,6 9,13.667 9,23l-0,64c-0,9.334 -3,17 -9,23c-6,6 -13.667,9 -23,9l-704,0c-44,0 -81.667,15.667 -113,47c-31.333,31.334 -47,69 -47,113l-0,832c-0,44 15.667,81.667 47,113c31.333,31.334 69,47 113,47l832,0c44,0 81.667,-15.666 113,-47c31.333,-31.333 47,-69 47,-113l-0,-320c-0,-9.333 3,-17 9,-23c6,-6 13.667,-9 23,-9l64,0c9.333,0 17,3 23,9c6,6 9,13.667 9,23Zm384,-864l-0,512c-0,17.334 -6.333,32.334 -19,45c-12.667,12.667 -27.667,19 -45,19c-17.333,0 -32.333,-6.333 -45,-19l-176,-176l-652,652c-6.667,6.667 -14.333,10 -23,10c-8.667,0 -16.333,-3.333 -23,-10l-114,-114c-6.667,-6.666 -10,-14.333 -10,-23c-0,-8.666 3.333,-16.333 10,-23l652,-652l-176,-176c-12.667,-12.666 -19,-27.666 -19,-45c-0,-17.333 6.333,-32.333 19,-45c12.667,-12.666 27.667,-19 45,-19l512,0c17.333,0 32.333,6.334 45,19c12.667,12.667 19,27.667 19,45Z"></path></svg>'
+
+
+def capitalize_each_word(string):
+    # same as capitalizeEachWord in src/main.js
+    return WORD.sub(lambda m: m.group(0)[:1].upper() + m.group(0)[1:].lower(), string.replace('-', ' '))
+
+
+def get_description(properties):
+    text = TAG.sub(' ', properties.get('event_description_de') or properties.get('event_description_dk') or '')
+    text = ' '.join(text.split())
+
+    if len(text) > DESCRIPTION_LENGTH:
+        text = text[:DESCRIPTION_LENGTH - 1].rsplit(' ', 1)[0] + '…'
+
+    return text
+
+
+def render_image(properties):
+    if not properties.get('event_image'):
+        return ''
+
+    return (f'<img src="{escape(properties["event_image"])}" alt="{escape(properties["event_title"])}">'
+        '<div class="px-3 py-2 w-full text-xs text-knf-light bg-knf-darkblue">Foto Kulturnacht Flensburg</div>')
+
+
+def render_details(properties):
+    # mirrors renderFeatureDetails in src/main.js, the client keeps this markup on first paint
+    p = properties
+    show_language = p['event_description_de'] != '' and p['event_description_dk'] != ''
+
+    items = [
+        f'<li class="pb-3"><div class="flex justify-center items-center w-8 h-8 rounded-full font-bold text-center text-lg text-knf-light bg-knf-darkblue">{p["event_id"]}</div></li>',
+        f'<li class="text-xl lg:text-2xl xl:text-3xl text-knf-pink font-bold"><h3>{p["venue_name"]}</h3></li>',
+        f'<li class="pb-4 text-xl lg:text-2xl xl:text-3xl font-bold"><h4>{p["event_title"]}</h4></li>',
+        f'<li class="font-bold text-knf-pink">{p["event_tags"]}</li>',
+        f'<li class="pb-3 font-bold text-knf-darkblue">{p["venue_street"]} {p["venue_housenumber"]}<br>{p["venue_postal_code"]} {p["venue_city"]}</li>'
+    ]
+
+    for key, language in (('event_description_de', '[deutsch]<br>'), ('event_description_dk', '[dansk]<br>')):
+        if p[key] != '':
+            items.append(f'<li class="py-1">{language if show_language else ""}{p[key]}</li>')
+
+    items.append(f'<li class="py-2"><strong>Öffnungszeiten</strong><br>{p["venue_open"]} Uhr bis {p["venue_close"]} Uhr</li>')
+
+    if p['activity_title'] != '' and p['activity_time'] != '':
+        items.append(f'<li class="py-2"><strong>{p["activity_title"]}</strong><br>{p["activity_time"]} Uhr</li>')
+
+    items.append(f'<li class="py-2"><a href="{escape(p["venue_url"])}" class="relative inline-block text-knf-darkblue focus:text-knf-pink hover:text-knf-pink transition-all duration-300 before:absolute before:left-0 before:bottom-0 before:h-[2px] before:bg-current before:w-full before:scale-x-0 hover:before:scale-x-100 before:transition-transform before:origin-left" title="Website {escape(p["venue_name"])}" target="_blank">Website {EXTERNAL_LINK_ICON}<span class="absolute bottom-0 left-0 w-full h-[2px] bg-current scale-x-0 group-hover:scale-x-100 transition-transform origin-left"></span></a></li>')
+
+    return ''.join(items)
+
+
+def find_tag(html, name, attribute, value):
+    # the built template may be minified, so attribute quotes are optional
+    pattern = rf'<{name}\b[^>]*\b{attribute}=["\']?{re.escape(value)}(?=["\'\s>])[^>]*>'
+    match = re.search(pattern, html)
+
+    if match is None:
+        raise click.ClickException(f'template has no <{name} {attribute}="{value}">')
+
+    return match
+
+
+def replace_tag(html, name, attribute, value, replacement):
+    match = find_tag(html, name, attribute, value)
+
+    return html[:match.start()] + replacement + html[match.end():]
+
+
+def set_content(html, name, element_id, content):
+    match = find_tag(html, name, 'id', element_id)
+    end = html.index(f'</{name}>', match.end())
+
+    return html[:match.end()] + content + html[end:]
+
+
+def set_hidden(html, element_id, hidden):
+    match = find_tag(html, '[a-z]+', 'id', element_id)
+    tag = match.group(0)
+    classes = re.search(r'class=(?:"([^"]*)"|\'([^\']*)\'|([^\s>]+))', tag)
+    names = [name for name in (classes.group(1) or classes.group(2) or classes.group(3) or '').split() if name != 'hidden']
+
+    if hidden:
+        names.append('hidden')
+
+    tag = tag[:classes.start()] + f'class="{" ".join(names)}"' + tag[classes.end():]
+
+    return html[:match.start()] + tag + html[match.end():]
+
+
+def render_page(template, feature, url):
+    properties = feature['properties']
+    slug = properties['slug']
+    title = escape(f'{capitalize_each_word(slug)} - {SITE_NAME}')
+    description = escape(get_description(properties))
+    page_url = escape(url + slug)
+
+    html = re.sub(r'<title>.*?</title>', lambda m: f'<title>{title}</title>', template, count=1, flags=re.S)
+    html = replace_tag(html, 'meta', 'property', 'og:title', f'<meta property="og:title" content="{title}">')
+    html = replace_tag(html, 'meta', 'property', 'og:url', f'<meta property="og:url" content="{page_url}">')
+
+    if description:
+        html = replace_tag(html, 'meta', 'property', 'og:description', f'<meta property="og:description" content="{description}">')
+        html = replace_tag(html, 'meta', 'name', 'description', f'<meta content="{description}" name="description">')
+
+    # inline the feature, so the client can show it without waiting for the whole collection
+    data = json.dumps(feature, ensure_ascii=False, separators=(',', ':')).replace('</', '<\\/')
+    head = f'<link rel="canonical" href="{page_url}"><script type="application/json" id="feature">{data}</script>'
+    html = html.replace('</head>', f'{head}</head>', 1)
+
+    html = set_content(html, 'div', 'detailImage', render_image(properties))
+    html = set_content(html, 'ul', 'detailList', render_details(properties))
+    html = set_hidden(html, 'details', False)
+    html = set_hidden(html, 'about', True)
+
+    return html
+
+
+@click.command()
+@click.argument('src')
+@click.argument('template')
+@click.argument('dst')
+@click.argument('url')
+def main(src, template, dst, url):
+    template = Path(template).read_text(encoding='utf8')
+    dst = Path(dst)
+    dst.mkdir(parents=True, exist_ok=True)
+
+    pages = 0
+    written = 0
+
+    for feature in iter_unique_features(get_data(src)):
+        if not is_safe_slug(feature['properties']['slug']):
+            log.warning(f'skipped unsafe slug {feature["properties"]["slug"]!r}')
+            continue
+
+        html = render_page(template, feature, url)
+        written += write_if_changed(dst / f'{feature["properties"]["slug"]}.html', html)
+        pages += 1
+
+    click.echo(f'{pages} venue pages, {written} files rewritten')
+
+
+if __name__ == '__main__':
+    main()
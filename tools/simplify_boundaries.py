@@ -0,0 +1,379 @@
+#!./venv/bin/python
+
+import json
+import math
+import click
+import shapely
+import numpy as np
+import logging as log
+
+from shapely.geometry import shape
+from pathlib import Path
+
+
+METERS_PER_DEGREE = 111320.0
+
+
+def parse_levels(ctx, param, value):
+    levels = {}
+
+    for item in value:
+        name, sep, tolerance = item.partition('=')
+
+        try:
+            levels[name] = float(tolerance)
+        except ValueError:
+            raise click.BadParameter(f'expected name=meters but got {item!r}')
+
+        if not sep or not name:
+            raise click.BadParameter(f'expected name=meters but got {item!r}')
+
+    return levels
+
+
+def snap(coordinates, precision):
+    return tuple((round(lon, precision), round(lat, precision)) for lon, lat, *_ in coordinates)
+
+
+def get_parts(geometry, precision):
+    # every geometry is reduced to lists of rings or lines of snapped coordinates
+    kind = geometry['type']
+    coordinates = geometry['coordinates']
+
+    if kind == 'Polygon':
+        return [[snap(ring, precision)[:-1] for ring in coordinates]]
+    if kind == 'MultiPolygon':
+        return [[snap(ring, precision)[:-1] for ring in polygon] for polygon in coordinates]
+    if kind == 'LineString':
+        return [snap(coordinates, precision)]
+    if kind == 'MultiLineString':
+        return [snap(line, precision) for line in coordinates]
+
+    raise ValueError(f'unsupported geometry type {kind}')
+
+
+def iter_sequences(features):
+    for feature in features:
+        if feature['parts'] is None:
+            continue
+
+        if feature['type'] in ('Polygon', 'MultiPolygon'):
+            for polygon in feature['parts']:
+                for ring in polygon:
+                    yield ring, True
+        else:
+            for line in feature['parts']:
+                yield line, False
+
+
+def find_junctions(features):
+    # a point is a junction when it is visited with different neighbours, this is where shared borders begin or end
+    visits = {}
+    junctions = set()
+
+    for points, closed in iter_sequences(features):
+        count = len(points)
+
+        for i, point in enumerate(points):
+            if not closed and i in (0, count - 1):
+                junctions.add(point)
+                continue
+
+            neighbours = frozenset((points[i - 1], points[(i + 1) % count]))
+            seen = visits.setdefault(point, neighbours)
+
+            if seen != neighbours:
+                junctions.add(point)
+
+    return junctions
+
+
+def cut_ring(ring, junctions):
+    indexes = [i for i, point in enumerate(ring) if point in junctions]
+
+    if not indexes:
+        # rings without junctions become one closed arc, starting at the smallest point so equal rings match
+        start = ring.index(min(ring))
+        ring = ring[start:] + ring[:start]
+
+        return [ring + ring[:1]]
+
+    ring = ring[indexes[0]:] + ring[:indexes[0]]
+    indexes = [i - indexes[0] for i in indexes] + [len(ring)]
+    ring = ring + ring[:1]
+
+    return [ring[start:end + 1] for start, end in zip(indexes, indexes[1:])]
+
+
+def cut_line(line, junctions):
+    indexes = [i for i, point in enumerate(line) if point in junctions]
+
+    return [line[start:end + 1] for start, end in zip(indexes, indexes[1:])]
+
+
+def add_arc(arcs, index, arc):
+    if arc in index:
+        return index[arc]
+
+    reverse = arc[::-1]
+
+    if reverse in index:
+        return ~index[reverse]
+
+    index[arc] = len(arcs)
+    arcs.append(arc)
+
+    return index[arc]
+
+
+def build_topology(features):
+    junctions = find_junctions(features)
+    arcs = []
+    index = {}
+
+    for feature in features:
+        if feature['parts'] is None:
+            feature['arcs'] = None
+            continue
+
+        if feature['type'] in ('Polygon', 'MultiPolygon'):
+            feature['arcs'] = [[[add_arc(arcs, index, arc) for arc in cut_ring(ring, junctions)]
+                for ring in polygon] for polygon in feature['parts']]
+        else:
+            feature['arcs'] = [[add_arc(arcs, index, arc) for arc in cut_line(line, junctions)]
+                for line in feature['parts']]
+
+    return arcs
+
+
+def get_scale(features):
+    lats = [lat for points, _ in iter_sequences(features) for _, lat in points]
+    latitude = (min(lats) + max(lats)) / 2
+
+    # equirectangular projection around the layer, accurate to well below a meter within a city
+    return METERS_PER_DEGREE * math.cos(math.radians(latitude)), METERS_PER_DEGREE
+
+
+def simplify_arcs(arcs, tolerance, scale, precision):
+    simplified = []
+
+    for arc in arcs:
+        projected = np.array(arc) * scale
+        line = shapely.simplify(shapely.linestrings(projected), tolerance, preserve_topology=False)
+        coordinates = shapely.get_coordinates(line) / scale
+
+        # closed arcs are whole rings and must not collapse
+        if arc[0] == arc[-1] and len(coordinates) < 4:
+            coordinates = np.array(arc)
+
+        simplified.append(snap(coordinates.tolist(), precision))
+
+    return simplified
+
+
+def resolve_arcs(arcs, refs):
+    points = []
+
+    for ref in refs:
+        arc = arcs[ref] if ref >= 0 else arcs[~ref][::-1]
+
+        points.extend(arc if not points else arc[1:])
+
+    return [list(point) for point in points]
+
+
+def to_geometry(kind, refs, arcs):
+    if refs is None:
+        return None
+
+    if kind in ('LineString', 'MultiLineString'):
+        lines = [resolve_arcs(arcs, line) for line in refs]
+
+        return {'type': kind, 'coordinates': lines[0] if kind == 'LineString' else lines}
+
+    polygons = []
+
+    for polygon in refs:
+        rings = [resolve_arcs(arcs, ring) for ring in polygon]
+
+        if len(rings[0]) < 4:
+            continue
+
+        polygons.append([ring for ring in rings if len(ring) >= 4])
+
+    if not polygons:
+        return None
+
+    if kind == 'Polygon':
+        return {'type': kind, 'coordinates': polygons[0]}
+
+    return {'type': kind, 'coordinates': polygons}
+
+
+def quantize_arcs(arcs, quantization):
+    points = np.array([point for arc in arcs for point in arc])
+    min_x, min_y = points.min(axis=0)
+    max_x, max_y = points.max(axis=0)
+
+    kx = (max_x - min_x) / (quantization - 1) or 1
+    ky = (max_y - min_y) / (quantization - 1) or 1
+
+    encoded = []
+
+    for arc in arcs:
+        quantized = np.rint((np.array(arc) - (min_x, min_y)) / (kx, ky)).astype(int)
+        deltas = np.diff(quantized, axis=0)
+
+        # points that fall onto the same grid cell are dropped, the delta encoding stays exact
+        deltas = deltas[np.any(deltas != 0, axis=1)]
+
+        if len(deltas) == 0:
+            deltas = np.zeros((1, 2), dtype=int)
+
+        encoded.append([quantized[0].tolist()] + deltas.tolist())
+
+    return encoded, {'scale': [kx, ky], 'translate': [min_x, min_y]}
+
+
+def to_topojson(name, features, arcs, quantization):
+    encoded, transform = quantize_arcs(arcs, quantization)
+    geometries = []
+
+    for feature in features:
+        geometry = {'type': feature['type'] if feature['arcs'] is not None else None}
+
+        if feature['arcs'] is not None:
+            if feature['type'] in ('Polygon', 'LineString'):
+                geometry['arcs'] = feature['arcs'][0]
+            else:
+                geometry['arcs'] = feature['arcs']
+
+        geometry['properties'] = feature['properties']
+        geometries.append(geometry)
+
+    return {
+        'type': 'Topology',
+        'transform': transform,
+        'objects': {
+            name: {'type': 'GeometryCollection', 'geometries': geometries}
+        },
+        'arcs': encoded
+    }
+
+
+def to_geojson(collection, features, arcs):
+    output = {key: value for key, value in collection.items() if key != 'features'}
+    output['features'] = []
+
+    for feature in features:
+        output['features'].append({
+            'type': 'Feature',
+            'geometry': to_geometry(feature['type'], feature['arcs'], arcs),
+            'properties': feature['properties']
+        })
+
+    return output
+
+
+def read_layer(src, precision):
+    with open(src, 'r') as f:
+        collection = json.load(f)
+
+    features = []
+
+    for feature in collection['features']:
+        geometry = feature.get('geometry')
+
+        features.append({
+            'type': geometry['type'] if geometry else None,
+            'parts': get_parts(geometry, precision) if geometry else None,
+            'properties': feature.get('properties'),
+            'original': shape(geometry) if geometry else None
+        })
+
+    return collection, features
+
+
+def measure_error(features, output, scale):
+    # hausdorff distance in meters between every original and simplified feature
+    originals = []
+    simplified = []
+
+    for feature, result in zip(features, output['features']):
+        if feature['original'] is None or result['geometry'] is None:
+            continue
+
+        originals.append(feature['original'])
+        simplified.append(shape(result['geometry']))
+
+    if not originals:
+        return 0.0, 0.0
+
+    def project(coordinates):
+        return coordinates * scale
+
+    distances = shapely.hausdorff_distance(shapely.transform(np.array(originals), project),
+        shapely.transform(np.array(simplified), project))
+
+    return float(distances.max()), float(distances.mean())
+
+
+def count_vertices(arcs):
+    return sum(len(arc) for arc in arcs)
+
+
+@click.command()
+@click.argument('src', nargs=-1, required=True, type=click.Path(exists=True, dir_okay=False))
+@click.option('--dst', type=click.Path(file_okay=False), required=True, help='Set directory for the simplified layers')
+@click.option('--level', '-l', 'levels', multiple=True, required=True, callback=parse_levels, help='Add an output level as name=meters of simplification tolerance')
+@click.option('--precision', type=int, default=5, show_default=True, help='Set number of decimals kept in coordinates')
+@click.option('--topojson', is_flag=True, help='Write topojson instead of geojson')
+@click.option('--quantization', type=int, default=100000, show_default=True, help='Set topojson grid size per axis')
+@click.option('--verbose', '-v', is_flag=True, help='Print more verbose output')
+def main(src, dst, levels, precision, topojson, quantization, verbose):
+    if verbose:
+        log.basicConfig(format='%(levelname)s: %(message)s', level=log.INFO)
+    else:
+        log.basicConfig(format='%(levelname)s: %(message)s')
+
+    dst = Path(dst)
+    dst.mkdir(parents=True, exist_ok=True)
+
+    suffix = 'topojson' if topojson else 'geojson'
+
+    for path in map(Path, src):
+        collection, features = read_layer(path, precision)
+        arcs = build_topology(features)
+        scale = get_scale(features)
+        size = path.stat().st_size
+
+        log.info(f'{path.name}: {len(arcs)} arcs with {count_vertices(arcs)} vertices')
+
+        for level, tolerance in levels.items():
+            simplified = simplify_arcs(arcs, tolerance, scale, precision)
+            output = to_geojson(collection, features, simplified)
+
+            for feature, result in zip(features, output['features']):
+                if feature['original'] is not None and result['geometry'] is None:
+                    log.warning(f'{path.name}: feature {result["properties"]} collapsed at level {level}')
+
+            max_error, mean_error = measure_error(features, output, scale)
+
+            if topojson:
+                output = to_topojson(path.stem, features, simplified, quantization)
+
+            data = json.dumps(output, ensure_ascii=False, separators=(',', ':'))
+            target = dst / f'{path.stem}.{level}.{suffix}'
+
+            with open(target, 'w', encoding='utf8') as f:
+                f.write(data)
+
+            written = len(data.encode('utf8'))
+
+            click.echo(f'{path.name:36} {level:8} {count_vertices(arcs):8} -> {count_vertices(simplified):7} vertices '
+                f'{size / 1024:8.1f} -> {written / 1024:7.1f} KB ({written / size:6.1%}) '
+                f'hausdorff max {max_error:6.1f} m mean {mean_error:6.1f} m')
+
+
+if __name__ == '__main__':
+    main()
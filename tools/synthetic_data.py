@@ -0,0 +1,199 @@
+#!./venv/bin/python
+
+import csv
+import gzip
+import json
+import click
+import random
+
+from datetime import datetime, timedelta
+from pathlib import Path
+from geometry import FLENSBURG_BBOX, SCHLESWIG_HOLSTEIN_BBOX
+
+
+WORDS = ['Kultur', 'Theater', 'Werkstatt', 'Museum', 'Galerie', 'Kirche', 'Bühne', 'Haus',
+    'Förde', 'Süd', 'Nord', 'Kunst', 'Musik', 'Café', '&', '(e.V.)', 'Atelier', 'Schloß']
+STREETS = ['Große Straße', 'Norderstraße', 'Süderhofenden', 'Schiffbrücke', 'Holm',
+    'Rote Straße', 'Friesischer Berg', 'Mühlenstraße', 'Am Öxer', 'Batteriestraße']
+CITIES = ['Flensburg', 'Glücksburg', 'Harrislee', 'Schleswig']
+REGIONS = ['Flensburger Förde', 'Nordsee', 'Ostsee', 'Schlei', 'Holsteinische Schweiz']
+TAGS = ['Kultur', 'Museum', 'Musik', 'Kunst', 'Film', 'Lesung', 'Theater', 'Kinder']
+FUNDING_TYPES = ['Zuschuss', 'Förderung', 'Miete', 'Projektförderung']
+YEARS = range(2008, 2025)
+LOREM = ('Eintauchen in die Entwicklung der Geschichte. Begegnung mit Pionieren, Visionären und '
+    'Monsterkrabben. Entspannung im Zauberland der Meere. ')
+
+SIZES = {'1k': 1000, '100k': 100000, '1m': 1000000}
+
+
+def parse_size(value):
+    value = value.lower()
+
+    if value in SIZES:
+        return SIZES[value]
+
+    try:
+        return int(value)
+    except ValueError:
+        raise click.BadParameter(f'expected one of {", ".join(SIZES)} or a number but got {value!r}')
+
+
+def format_size(rows):
+    for name, count in SIZES.items():
+        if count == rows:
+            return name
+
+    return str(rows)
+
+
+def random_label(rng):
+    return ' '.join(rng.choice(WORDS) for _ in range(rng.randint(1, 4)))
+
+
+def random_point(rng, bbox):
+    min_lon, min_lat, max_lon, max_lat = bbox
+
+    return rng.uniform(min_lon, max_lon), rng.uniform(min_lat, max_lat)
+
+
+def generate_venues(count, distinct, seed):
+    rng = random.Random(seed)
+    venues = []
+
+    for _ in range(distinct):
+        label = random_label(rng)
+        address = f'{rng.choice(STREETS)} {rng.randint(1, 120)}'
+        venues.append((label, rng.choice(CITIES), address))
+
+    return [rng.choice(venues) for _ in range(count)]
+
+
+def iter_poi_rows(count, seed):
+    # shaped like the touristic POI feed, so every path in poi_fields.conf resolves
+    rng = random.Random(seed)
+    epoch = datetime(2020, 1, 1)
+
+    for i in range(count):
+        title = random_label(rng)
+        created = epoch + timedelta(seconds=rng.randrange(100000000))
+        changed = created + timedelta(seconds=rng.randrange(10000000))
+        lon, lat = random_point(rng, SCHLESWIG_HOLSTEIN_BBOX)
+
+        yield {
+            'id': f'poi_{i}',
+            'regions': [{'i18nName': {'de': region}} for region in rng.sample(REGIONS, rng.randint(1, 2))],
+            'creationTime': created.strftime('%Y-%m-%d %H:%M:%S.%f')[:-3],
+            'lastChangeTime': changed.strftime('%Y-%m-%d %H:%M:%S.%f')[:-3],
+            'title': {'de': title},
+            'htmlHeadTitle': {'de': title},
+            'htmlHeadMetaDescription': {'de': LOREM[:rng.randint(40, 150)]},
+            'shortDescription': {'de': LOREM[:rng.randint(40, 150)]},
+            'longDescription': {'de': LOREM * rng.randint(1, 6)},
+            'contact1': {
+                'address': {
+                    'homepage': {'de': f'https://example.org/{i}'},
+                    'phone1': f'0461 {rng.randint(10000, 99999)}',
+                    'email': f'info{i}@example.org',
+                    'street': rng.choice(STREETS),
+                    'streetNo': str(rng.randint(1, 120)),
+                    'zipcode': str(rng.randint(24000, 25999)),
+                    'city': rng.choice(CITIES)
+                }
+            },
+            'contact2': {'name': random_label(rng)},
+            'openingHoursInformations': [{'day': day, 'open': '10:00', 'close': '18:00'} for day in range(rng.randint(0, 7))],
+            'mediaLicense': {'name': 'CC BY 4.0'},
+            'location': {'coordinates': {'latitude': lat, 'longitude': lon}}
+        }
+
+
+def write_poi_feed(dst, count, seed):
+    with gzip.open(dst, 'wt', encoding='utf8', compresslevel=6) as f:
+        f.write('[')
+
+        for i, row in enumerate(iter_poi_rows(count, seed)):
+            if i:
+                f.write(',\n')
+
+            f.write(json.dumps(row, ensure_ascii=False))
+
+        f.write(']\n')
+
+
+def write_funding_csv(dst, count, seed):
+    rng = random.Random(seed)
+
+    with open(dst, 'w', encoding='utf8', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['type', 'designation', *YEARS, 'street', 'housenumber', 'postcode', 'city', 'lat', 'lon'])
+
+        for _ in range(count):
+            funding_type = rng.choice(FUNDING_TYPES)
+            amount = rng.randrange(1000, 150000, 100)
+            amounts = [amount if rng.random() > 0.2 else '' for _ in YEARS]
+            lon, lat = random_point(rng, FLENSBURG_BBOX)
+
+            writer.writerow([funding_type, f'{funding_type} {random_label(rng)}', *amounts, rng.choice(STREETS),
+                rng.randint(1, 120), rng.randint(24937, 24944), 'Flensburg', lat, lon])
+
+
+def write_kulturnacht_csv(dst, count, seed):
+    rng = random.Random(seed)
+    venues = generate_venues(count, max(count // 5, 1), seed)
+
+    with open(dst, 'w', encoding='utf8', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['id', 'venue_lat', 'venue_lon', 'venue_name', 'event_title', 'event_tags', 'venue_street',
+            'venue_housenumber', 'venue_postal_code', 'venue_city', 'venue_open', 'venue_close', 'activity_time',
+            'activity_title', 'venue_url', 'event_description_de', 'event_description_dk', 'event_image'])
+
+        for i, (label, city, address) in enumerate(venues, 1):
+            street, _, housenumber = address.rpartition(' ')
+            lon, lat = random_point(rng, FLENSBURG_BBOX)
+
+            writer.writerow([i, lat, lon, label, random_label(rng), ', '.join(rng.sample(TAGS, 2)), street,
+                housenumber, '24937', city, '17:00', '23:00', '', '', f'https://example.org/{i}',
+                LOREM[:rng.randint(40, 200)], '', ''])
+
+
+DATASETS = {
+    # the version in the name keeps feeds cached before the location fix from being reused
+    'poi': ('poi-{size}-{seed}-v2.json.gz', write_poi_feed),
+    'funding': ('funding-{size}-{seed}.csv', write_funding_csv),
+    'kulturnacht': ('kulturnacht-{size}-{seed}.csv', write_kulturnacht_csv)
+}
+
+
+def get_dataset_path(data_dir, name, rows, seed):
+    return Path(data_dir) / DATASETS[name][0].format(size=format_size(rows), seed=seed)
+
+
+def ensure_dataset(data_dir, name, rows, seed=1):
+    # datasets are deterministic for a seed, so they are only written once
+    dst = get_dataset_path(data_dir, name, rows, seed)
+
+    if not dst.exists():
+        dst.parent.mkdir(parents=True, exist_ok=True)
+        tmp = dst.with_name(f'.{dst.name}.tmp')
+
+        DATASETS[name][1](tmp, rows, seed)
+        tmp.replace(dst)
+
+    return dst
+
+
+@click.command()
+@click.argument('dst', type=click.Path(file_okay=False))
+@click.option('--size', 'sizes', multiple=True, default=['1k'], show_default=True, help='Add number of rows, 1k, 100k, 1m or a number')
+@click.option('--dataset', 'datasets', multiple=True, type=click.Choice(list(DATASETS)), help='Only write this dataset, repeat for several')
+@click.option('--seed', type=int, default=1, show_default=True, help='Set random seed')
+def main(dst, sizes, datasets, seed):
+    for rows in map(parse_size, sizes):
+        for name in datasets or DATASETS:
+            path = ensure_dataset(dst, name, rows, seed)
+
+            click.echo(f'{path} {path.stat().st_size / 1024:10.1f} KB')
+
+
+if __name__ == '__main__':
+    main()